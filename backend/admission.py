@@ -0,0 +1,295 @@
+"""Admission control: per-class concurrency pools (bulkheads) with bounded queues.
+
+Generate requests are split by theme class. Regulated themes (passport,
+resume) and creative themes each get their own pool, and composite gets a
+third. A flood in one class can only fill its own slots and queue, so it
+cannot starve the others.
+
+Each pool admits up to ``concurrency`` requests at once. Further requests
+wait in a bounded queue. The queue is ordered by start-time fair queuing
+across clients: each request gets a start tag ``max(V, client's last
+finish)`` and the client's finish tag advances by ``cost / weight``. V is
+the tag of the request most recently admitted. A client submitting many
+requests, or expensive ones, only delays its own later requests. Light
+clients keep being served in between.
+
+A request is refused straight away with ``Overloaded`` when the queue is
+full, or when it has waited longer than ``ADMISSION_MAX_WAIT_SECONDS``. The server turns that into ``503`` with a
+``Retry-After`` estimated from the pool's recent service times.
+
+``MEMORY`` is a process-wide budget on top of the pools. Each request
+reserves its estimated peak footprint (``ingest.estimate_peak``) once it
+holds a slot. Requests wait in FIFO order while the budget is exhausted,
+so a burst of large uploads is spread out over time instead of being
+decoded all at once. A request larger than the whole budget is rejected
+outright.
+
+Pools are used from the event loop only (the endpoints await a slot before
+handing work to the threadpool), so no locking is needed here.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+
+REGULATED_THEMES = {"passport", "resume"}
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.getenv(name, str(default))))
+    except Exception:
+        return default
+
+
+try:
+    MAX_WAIT_SECONDS = max(0.0, float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "30")))
+except Exception:
+    MAX_WAIT_SECONDS = 30.0
+
+# Fair-queuing tags kept per pool; idle clients are dropped well before this
+MAX_FAIR_CLIENTS = 10000
+
+try:
+    MEMORY_BUDGET_BYTES = max(0, int(os.getenv("MEMORY_BUDGET_MB", "2048"))) * 1024 * 1024
+except Exception:
+    MEMORY_BUDGET_BYTES = 2048 * 1024 * 1024
+
+# Sum of concurrencies should stay below the threadpool size (40 by default)
+POOL_DEFAULTS = {
+    # name: (concurrency, queue)
+    "regulated": (8, 32),
+    "creative": (6, 12),
+    "composite": (4, 8),
+}
+
+
+class Overloaded(Exception):
+    def __init__(self, pool: str, reason: str, retry_after: int, waited: float = 0.0):
+        super().__init__(f"{pool} pool overloaded ({reason})")
+        self.pool = pool
+        self.reason = reason
+        self.retry_after = retry_after
+        self.waited = waited
+
+
+class Bulkhead:
+    def __init__(self, name: str, concurrency: int, max_queue: int, max_wait: float = MAX_WAIT_SECONDS):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        # (start tag, seq, future); a granted future already holds a slot
+        self._waiters: List[Tuple[float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        # EWMA of slot hold time, seeds the Retry-After estimate
+        self._service_s = 5.0
+        # Fair queuing: virtual time and each client's last finish tag (LRU order)
+        self._vtime = 0.0
+        self._finish: "OrderedDict[str, float]" = OrderedDict()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> int:
+        backlog = (self.queued + 1) / self.concurrency
+        return int(min(60, max(1, math.ceil(backlog * self._service_s))))
+
+    def _publish(self) -> None:
+        metrics.ADMISSION_ACTIVE.set(self.active, pool=self.name)
+        metrics.ADMISSION_QUEUE_DEPTH.set(self.queued, pool=self.name)
+
+    def _reject(self, reason: str, waited: float = 0.0) -> Overloaded:
+        metrics.ADMISSION_REJECTED.inc(pool=self.name, reason=reason)
+        return Overloaded(self.name, reason, self.retry_after(), waited)
+
+    def _start_tag(self, client: str, cost: float, weight: float) -> float:
+        start = max(self._vtime, self._finish.get(client, 0.0))
+        self._finish[client] = start + cost / max(weight, 1e-6)
+        self._finish.move_to_end(client)
+        # A client whose finish tag is behind virtual time would start at V anyway
+        while len(self._finish) > MAX_FAIR_CLIENTS or next(iter(self._finish.values())) <= self._vtime:
+            self._finish.popitem(last=False)
+        return start
+
+    async def acquire(self, client: str = "", cost: float = 1.0, weight: float = 1.0,
+                      max_wait: Optional[float] = None) -> float:
+        """Wait for a slot; returns seconds spent queued or raises Overloaded.
+
+        ``max_wait`` (what the request's deadline allows) can only shorten the pool's own limit.
+        """
+        if self.active < self.concurrency and not self._waiters:
+            self._vtime = max(self._vtime, self._start_tag(client, cost, weight))
+            self.active += 1
+            self._publish()
+            metrics.ADMISSION_WAIT_SECONDS.observe(0.0, pool=self.name)
+            return 0.0
+        if self.queued >= self.max_queue:
+            raise self._reject("queue_full")
+        wait = self.max_wait if max_wait is None else min(self.max_wait, max_wait)
+        if wait <= 0:
+            raise self._reject("deadline")
+
+        fut = asyncio.get_running_loop().create_future()
+        entry = (self._start_tag(client, cost, weight), next(self._seq), fut)
+        heapq.heappush(self._waiters, entry)
+        self._publish()
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(fut, wait)
+        except asyncio.TimeoutError:
+            self._discard(entry)
+            raise self._reject("timeout" if wait >= self.max_wait else "deadline", time.perf_counter() - t0)
+        except asyncio.CancelledError:
+            # Client went away while queued; hand a slot we were just granted to the next waiter
+            if fut.done() and not fut.cancelled():
+                self.release()
+            else:
+                self._discard(entry)
+            raise
+        waited = time.perf_counter() - t0
+        metrics.ADMISSION_WAIT_SECONDS.observe(waited, pool=self.name)
+        return waited
+
+    def _discard(self, entry) -> None:
+        try:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+        except ValueError:
+            pass
+        self._publish()
+
+    def release(self, held_s: float = None) -> None:
+        if held_s is not None:
+            self._service_s += 0.2 * (held_s - self._service_s)
+        while self._waiters:
+            tag, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                # Hand the slot over directly; active count is unchanged
+                self._vtime = max(self._vtime, tag)
+                fut.set_result(None)
+                self._publish()
+                return
+        self.active = max(0, self.active - 1)
+        self._publish()
+
+    @asynccontextmanager
+    async def slot(self, client: str = "", cost: float = 1.0, weight: float = 1.0, max_wait: Optional[float] = None):
+        waited = await self.acquire(client, cost, weight, max_wait)
+        t0 = time.perf_counter()
+        try:
+            yield waited
+        finally:
+            self.release(time.perf_counter() - t0)
+
+
+class MemoryBudget:
+    def __init__(self, limit: int, max_wait: float = MAX_WAIT_SECONDS):
+        self.limit = limit
+        self.max_wait = max_wait
+        self.in_use = 0
+        self._waiters: List[Tuple[int, asyncio.Future]] = []  # FIFO; large requests are not overtaken
+        metrics.MEMORY_BUDGET_LIMIT.set(limit)
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit > 0
+
+    def fits(self, nbytes: int) -> bool:
+        return not self.enabled or nbytes <= self.limit
+
+    def _publish(self) -> None:
+        metrics.MEMORY_BUDGET_IN_USE.set(self.in_use)
+        metrics.ADMISSION_QUEUE_DEPTH.set(len(self._waiters), pool="memory")
+
+    async def acquire(self, nbytes: int, max_wait: Optional[float] = None) -> float:
+        if not self.enabled:
+            return 0.0
+        if not self._waiters and self.in_use + nbytes <= self.limit:
+            self.in_use += nbytes
+            self._publish()
+            return 0.0
+        wait = self.max_wait if max_wait is None else min(self.max_wait, max_wait)
+        if wait <= 0:
+            metrics.ADMISSION_REJECTED.inc(pool="memory", reason="deadline")
+            raise Overloaded("memory", "deadline", int(min(60, max(1, self.max_wait / 2))))
+        fut = asyncio.get_running_loop().create_future()
+        entry = (nbytes, fut)
+        self._waiters.append(entry)
+        self._publish()
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(fut, wait)
+        except asyncio.TimeoutError:
+            self._waiters.remove(entry)
+            self._publish()
+            reason = "timeout" if wait >= self.max_wait else "deadline"
+            metrics.ADMISSION_REJECTED.inc(pool="memory", reason=reason)
+            self._grant()
+            raise Overloaded("memory", reason, int(min(60, max(1, self.max_wait / 2))), time.perf_counter() - t0)
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release(nbytes)
+            else:
+                self._waiters.remove(entry)
+                self._publish()
+                self._grant()
+            raise
+        waited = time.perf_counter() - t0
+        metrics.ADMISSION_WAIT_SECONDS.observe(waited, pool="memory")
+        return waited
+
+    def _grant(self) -> None:
+        while self._waiters and self.in_use + self._waiters[0][0] <= self.limit:
+            nbytes, fut = self._waiters.pop(0)
+            if not fut.done():
+                self.in_use += nbytes
+                fut.set_result(None)
+        self._publish()
+
+    def release(self, nbytes: int) -> None:
+        if not self.enabled:
+            return
+        self.in_use = max(0, self.in_use - nbytes)
+        self._grant()
+
+    @asynccontextmanager
+    async def reserve(self, nbytes: int, max_wait: Optional[float] = None):
+        metrics.MEMORY_ESTIMATE_BYTES.observe(nbytes)
+        waited = await self.acquire(nbytes, max_wait)
+        try:
+            yield waited
+        finally:
+            self.release(nbytes)
+
+
+def _build_pools() -> Dict[str, Bulkhead]:
+    pools = {}
+    for name, (concurrency, queue) in POOL_DEFAULTS.items():
+        prefix = f"ADMISSION_{name.upper()}"
+        pools[name] = Bulkhead(
+            name,
+            _env_int(f"{prefix}_CONCURRENCY", concurrency),
+            _env_int(f"{prefix}_QUEUE", queue),
+        )
+    return pools
+
+
+POOLS = _build_pools()
+MEMORY = MemoryBudget(MEMORY_BUDGET_BYTES)
+
+
+def pool_for(endpoint: str, theme: str = "") -> Bulkhead:
+    if endpoint == "composite":
+        return POOLS["composite"]
+    return POOLS["regulated" if theme in REGULATED_THEMES else "creative"]
@@ -0,0 +1,347 @@
+"""Offline bulk processing of a photo folder through the generate pipeline.
+
+Imports ``server`` and runs ``_generate`` directly, with no HTTP, for every
+(photo, theme) pair under an input directory. Examples: a company-wide ID
+photo refresh in ``resume``/``passport``, or a re-render of an event album.
+Each pair goes through the same traced path as an API request: ingest,
+payload planning, upstream calls, post-processing, metrics and the event
+log. At most ``--concurrency`` pairs run at once.
+
+Progress is checkpointed to ``<out>/manifest.jsonl``, one fsynced line per
+finished pair. A rerun with the same ``--out`` skips pairs already done.
+A pair counts as done when it succeeded for the same file content, or
+failed with a client error (pass ``--retry-failed`` to try those again).
+Interrupting a run with Ctrl-C stops the pairs in flight at their next
+stage, and they rerun next time. Transient upstream failures (429, 5xx)
+are retried with backoff.
+
+Outputs go to ``<out>/<theme>/<relative path>.png``, or ``..._<n>.png``
+when a pair yields several images. ``<out>/summary.json`` reports counts,
+latency and token use per theme.
+
+Usage (from backend/):
+    python batch.py PHOTOS_DIR --out OUT_DIR [--themes resume,passport] [--concurrency 4]
+                    [--shots 1] [--options '{"gender_presentation": "auto"}'] [--retries 2]
+                    [--retry-failed] [--limit N] [--deadline SECONDS] [--endpoint URL]
+
+Against the local upstream stand-in (no key or network needed):
+    python bench/fake_gemini.py --port 9010 &
+    python batch.py PHOTOS_DIR --out /tmp/run --endpoint http://127.0.0.1:9010/v1beta/models/fake:generateContent
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("ai_portrait_studio.batch")
+
+_EXTENSIONS = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png"}
+# Upstream and capacity failures worth another attempt; anything else in 4xx is the input's fault
+_TRANSIENT = {429, 500, 502, 503, 504}
+
+
+def find_inputs(root: str) -> List[str]:
+    """Image paths under ``root``, relative and sorted, skipping hidden entries."""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for name in filenames:
+            if not name.startswith(".") and os.path.splitext(name)[1].lower() in _EXTENSIONS:
+                found.append(os.path.relpath(os.path.join(dirpath, name), root))
+    return sorted(found)
+
+
+class Manifest:
+    """Append-only JSON-lines checkpoint; the last line for a key wins."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line from a crash
+                    self.done[rec["key"]] = rec
+        self._file = open(path, "a", encoding="utf-8")
+
+    def finished(self, key: str, sha256: str, retry_failed: bool) -> bool:
+        rec = self.done.get(key)
+        if rec is None or rec.get("sha256") != sha256:
+            return False
+        if rec["status"] == "ok":
+            return True
+        return not retry_failed and rec.get("http_status") not in _TRANSIENT
+
+    def record(self, rec: Dict[str, Any]) -> None:
+        with self._lock:
+            self.done[rec["key"]] = rec
+            self._file.write(json.dumps(rec, separators=(",", ":")) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _output_paths(out_dir: str, theme: str, rel: str, count: int) -> List[str]:
+    stem = os.path.join(out_dir, theme, os.path.splitext(rel)[0])
+    if count == 1:
+        return [stem + ".png"]
+    return [f"{stem}_{i}.png" for i in range(1, count + 1)]
+
+
+class Runner:
+    def __init__(self, args, server):
+        self.args = args
+        self.server = server
+        self.stopping = threading.Event()
+        self._active: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _attempt(self, key: str, theme: str, image_b64: str, mime: str) -> Tuple[int, Optional[Dict], Any, str]:
+        """One pipeline run; returns (status, result, trace, error)."""
+        server = self.server
+        from fastapi import HTTPException, Response
+        from starlette.requests import Request
+
+        trace = server.metrics.RequestTrace("generate", theme)
+        if self.args.deadline:
+            trace.deadline = trace.started + self.args.deadline
+        with self._lock:
+            self._active[key] = trace
+        options = {**self.args.options, "shots": self.args.shots}
+        body = server.GenerateBody(theme=theme, image=image_b64, mime_type=mime, options=options)
+        request = Request({"type": "http", "method": "POST", "path": "/batch", "headers": [], "client": ("batch", 0)})
+        shape = {"theme": theme, "mime_type": mime, "options": options, "batch": True}
+        try:
+            result = server._traced(trace, Response(), shape, server._generate, body, request, trace)
+            return 200, result, trace, ""
+        except HTTPException as e:
+            return e.status_code, None, trace, str(e.detail)[:500]
+        except Exception as e:
+            logger.exception("%s failed: %s", key, e)
+            return 500, None, trace, f"{type(e).__name__}: {e}"[:500]
+        finally:
+            with self._lock:
+                self._active.pop(key, None)
+
+    def run_one(self, rel: str, theme: str, data: bytes, sha256: str) -> Optional[Dict[str, Any]]:
+        """Process one pair with retries; returns its manifest record (None when interrupted)."""
+        key = f"{theme}:{rel}"
+        mime = _EXTENSIONS[os.path.splitext(rel)[1].lower()]
+        image_b64 = base64.b64encode(data).decode("ascii")
+        t0 = time.perf_counter()
+        attempts = 0
+        upstream: List[int] = []
+        tokens: Dict[str, int] = {}
+        while True:
+            attempts += 1
+            status, result, trace, error = self._attempt(key, theme, image_b64, mime)
+            # Failed attempts still cost upstream calls and tokens
+            upstream += trace.info.get("upstream", [])
+            for kind, n in trace.info.get("tokens", {}).items():
+                tokens[kind] = tokens.get(kind, 0) + n
+            if status == 499 or self.stopping.is_set() and status != 200:
+                return None
+            if status == 200 or status not in _TRANSIENT or attempts > self.args.retries:
+                break
+            delay = min(30.0, 2.0 ** attempts)
+            logger.warning("%s: %s (%s), retrying in %.0fs", key, status, error[:120], delay)
+            if self.stopping.wait(delay):
+                return None
+        rec = {
+            "key": key, "input": rel, "theme": theme, "sha256": sha256, "status": "ok" if status == 200 else "error",
+            "http_status": status, "attempts": attempts, "seconds": round(time.perf_counter() - t0, 3),
+            "upstream": upstream, "tokens": tokens, "ts": time.time(),
+        }
+        if status != 200:
+            rec["error"] = error
+            return rec
+        rec["render"] = result.get("render", "upstream")
+        if result.get("warnings"):
+            rec["warnings"] = [w["check"] for w in result["warnings"]]
+        images = result.get("images") or [result]
+        paths = _output_paths(self.args.out, theme, rel, len(images))
+        os.makedirs(os.path.dirname(paths[0]), exist_ok=True)
+        for image, path in zip(images, paths):
+            saved = os.path.join(self.server.OUTPUTS_DIR, os.path.basename(image.get("saved_url") or ""))
+            if image.get("saved_url") and os.path.isfile(saved):
+                # The pipeline already wrote the file; move it under its batch name
+                shutil.move(saved, path)
+            else:
+                with open(path, "wb") as f:
+                    f.write(base64.b64decode(image["image_base64"]))
+        rec["outputs"] = [os.path.relpath(p, self.args.out) for p in paths]
+        return rec
+
+    def interrupt(self) -> None:
+        self.stopping.set()
+        with self._lock:
+            for trace in self._active.values():
+                trace.token.cancel()
+
+
+def summarize(records: List[Dict[str, Any]], skipped: int, wall: float) -> Dict[str, Any]:
+    def pct(values: List[float], q: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(round((len(ordered) - 1) * q / 100.0)))]
+
+    themes: Dict[str, Dict[str, Any]] = {}
+    for rec in records:
+        t = themes.setdefault(rec["theme"], {"ok": 0, "failed": 0, "outputs": 0, "upstream_calls": 0,
+                                             "tokens": 0, "_secs": []})
+        t["ok" if rec["status"] == "ok" else "failed"] += 1
+        t["outputs"] += len(rec.get("outputs", []))
+        t["upstream_calls"] += len(rec.get("upstream", []))
+        t["tokens"] += rec.get("tokens", {}).get("total", 0)
+        t["_secs"].append(rec["seconds"])
+    for t in themes.values():
+        secs = t.pop("_secs")
+        t["p50_s"], t["p95_s"] = round(pct(secs, 50), 3), round(pct(secs, 95), 3)
+    ok = sum(t["ok"] for t in themes.values())
+    return {
+        "processed": len(records),
+        "ok": ok,
+        "failed": len(records) - ok,
+        "skipped": skipped,
+        "wall_s": round(wall, 1),
+        "per_minute": round(len(records) / wall * 60, 1) if wall > 0 else 0.0,
+        "themes": themes,
+        "errors": [{"input": r["input"], "theme": r["theme"], "status": r["http_status"], "error": r.get("error")}
+                   for r in records if r["status"] != "ok"][:100],
+    }
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("input_dir")
+    ap.add_argument("--out", required=True, help="output directory (holds the manifest; reuse it to resume)")
+    ap.add_argument("--themes", default="resume")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--shots", type=int, default=1)
+    ap.add_argument("--options", type=json.loads, default={}, help="JSON object merged into every request's options")
+    ap.add_argument("--retries", type=int, default=2, help="extra attempts after a 429/5xx")
+    ap.add_argument("--retry-failed", action="store_true", help="also rerun pairs that failed with a client error")
+    ap.add_argument("--limit", type=int, default=0, help="process at most N pending pairs (0 = all)")
+    ap.add_argument("--deadline", type=float, default=0.0, help="per-pair deadline in seconds (0 = none)")
+    ap.add_argument("--endpoint", help="upstream URL, e.g. bench/fake_gemini.py; overrides GEMINI_ENDPOINT and any key pool")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    args.out = os.path.abspath(args.out)
+    os.makedirs(args.out, exist_ok=True)
+    if args.endpoint:
+        os.environ["GEMINI_ENDPOINT"] = args.endpoint
+        os.environ.setdefault("GEMINI_API_KEY", "offline-batch")
+        # A configured key pool would route around the stand-in
+        os.environ.pop("GEMINI_UPSTREAMS", None)
+        os.environ.pop("GEMINI_API_KEYS", None)
+    # The pipeline's own copies land next to the batch outputs (and are moved into place)
+    store = os.path.join(args.out, ".store")
+    os.environ.setdefault("OUTPUTS_DIR", os.path.join(store, "outputs"))
+    os.environ.setdefault("GALLERY_DB", os.path.join(store, "gallery.sqlite3"))
+    os.environ.setdefault("EVENTS_DIR", os.path.join(store, "events"))
+    import server
+
+    themes = [t.strip() for t in args.themes.split(",") if t.strip()]
+    # ID_LOCAL_MODE=only renders ID themes without the upstream
+    local_only = server.idphoto.MODE == "only" and set(themes) <= server.idphoto.THEMES
+    if not server.upstreams.POOL.upstreams and not local_only:
+        print("no upstream key configured: set GEMINI_API_KEY or GEMINI_UPSTREAMS (or pass --endpoint for a local stand-in)",
+              file=sys.stderr)
+        return 2
+    valid = set(server.GenerateBody.model_fields["theme"].annotation.__args__)
+    unknown = [t for t in themes if t not in valid]
+    if unknown:
+        print(f"unknown theme(s): {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    manifest = Manifest(os.path.join(args.out, "manifest.jsonl"))
+    pending, skipped = [], 0
+    for rel in find_inputs(args.input_dir):
+        with open(os.path.join(args.input_dir, rel), "rb") as f:
+            sha256 = hashlib.sha256(f.read()).hexdigest()
+        for theme in themes:
+            if manifest.finished(f"{theme}:{rel}", sha256, args.retry_failed):
+                skipped += 1
+            else:
+                pending.append((rel, theme, sha256))
+    if args.limit:
+        pending = pending[:args.limit]
+    logger.info("%d pairs to process, %d already done", len(pending), skipped)
+
+    runner = Runner(args, server)
+    records: List[Dict[str, Any]] = []
+    t0 = time.perf_counter()
+    todo = iter(pending)
+    interrupted = False
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency), thread_name_prefix="batch") as pool:
+        running = set()
+
+        def submit_next() -> bool:
+            item = next(todo, None)
+            if item is None:
+                return False
+            rel, theme, sha256 = item
+            # Read lazily so only in-flight photos are held in memory
+            with open(os.path.join(args.input_dir, rel), "rb") as f:
+                data = f.read()
+            running.add(pool.submit(runner.run_one, rel, theme, data, sha256))
+            return True
+
+        try:
+            while len(running) < max(1, args.concurrency) and submit_next():
+                pass
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    running.discard(fut)
+                    rec = fut.result()
+                    if rec is not None:
+                        manifest.record(rec)
+                        records.append(rec)
+                        logger.info("[%d/%d] %s %s %s", len(records), len(pending), rec["status"], rec["theme"], rec["input"])
+                    if not runner.stopping.is_set():
+                        submit_next()
+        except KeyboardInterrupt:
+            interrupted = True
+            logger.warning("interrupted; stopping in-flight work (rerun with the same --out to resume)")
+            runner.interrupt()
+            for fut in running:
+                rec = fut.result()
+                if rec is not None:
+                    manifest.record(rec)
+                    records.append(rec)
+    manifest.close()
+    server.workers.shutdown()
+    server.jsonlog.close_all()
+
+    summary = summarize(records, skipped, time.perf_counter() - t0)
+    summary["interrupted"] = interrupted
+    with open(os.path.join(args.out, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    print(f"\nprocessed {summary['processed']} ({summary['ok']} ok, {summary['failed']} failed), "
+          f"skipped {skipped}, {summary['wall_s']}s ({summary['per_minute']}/min)")
+    print(f"{'theme':<16} {'ok':>5} {'failed':>7} {'outputs':>8} {'p50 s':>7} {'p95 s':>7} {'tokens':>9}")
+    for theme, t in summary["themes"].items():
+        print(f"{theme:<16} {t['ok']:>5} {t['failed']:>7} {t['outputs']:>8} {t['p50_s']:>7.2f} {t['p95_s']:>7.2f} {t['tokens']:>9}")
+    return 130 if interrupted else (1 if summary["failed"] else 0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
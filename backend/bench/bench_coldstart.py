@@ -0,0 +1,168 @@
+"""Cold-start benchmark: import time and time-to-first-request.
+
+Each run starts a fresh interpreter, so nothing is cached in-process
+(the OS page cache stays warm, as it would on a reused host). Measures:
+
+- ``import/server``: ``import server`` as reported by ``python -X importtime``
+- ``warmup=N/listen``: process spawn until ``/health`` answers
+- ``warmup=1/ready``: process spawn until ``/ready`` answers 200
+- ``warmup=N/first_request`` and ``/second_request``: latency of the first
+  two ``/api/generate`` calls against the local Gemini stand-in. With
+  warm-up on, the first call is sent once ``/ready`` is 200.
+
+With warm-up on, it also checks that those requests built no face detector
+(``portrait_detector_builds_total`` unchanged after ``/ready``): a build
+there means a request thread paid the cascade/model load. The run exits 1
+when one did.
+
+Usage (from backend/):
+    python bench/bench_coldstart.py [--runs 5] [--top 10] [--json out.json] [--baseline base.json]
+"""
+
+import argparse
+import base64
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import requests
+
+import common
+import corpus
+import fake_gemini
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import(env):
+    """Seconds to import server, plus cumulative seconds of its direct imports."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    total, children = 0.0, {}
+    for line in proc.stderr.splitlines():
+        m = _IMPORTTIME.match(line)
+        if not m:
+            continue
+        cumulative, depth, name = int(m.group(2)) / 1e6, len(m.group(3)) - 1, m.group(4)
+        if depth == 0 and name == "server":
+            total = cumulative
+        elif depth == 2:
+            children[name] = children.get(name, 0.0) + cumulative
+    return total, children
+
+
+def _wait_for(url: str, deadline: float, status: int = 200) -> bool:
+    while time.perf_counter() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == status:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.005)
+    return False
+
+
+def _detector_builds(base: str) -> float:
+    text = requests.get(f"{base}/metrics", timeout=5).text
+    return sum(float(line.rsplit(" ", 1)[1]) for line in text.splitlines()
+               if line.startswith("portrait_detector_builds_total{"))
+
+
+def measure_start(env, warmup: bool, payload):
+    """Startup and first-request timings, and detector builds after ``/ready`` (None without warm-up)."""
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    env = dict(env, WARMUP="1" if warmup else "0")
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    try:
+        out = {}
+        if not _wait_for(f"{base}/health", t0 + 60):
+            raise RuntimeError("API did not start")
+        out["listen"] = time.perf_counter() - t0
+        if warmup:
+            if not _wait_for(f"{base}/ready", t0 + 120):
+                raise RuntimeError("API did not become ready")
+            out["ready"] = time.perf_counter() - t0
+            builds = _detector_builds(base)
+        with requests.Session() as session:
+            for name in ("first_request", "second_request"):
+                t1 = time.perf_counter()
+                r = session.post(f"{base}/api/generate", json=payload, timeout=120)
+                r.raise_for_status()
+                out[name] = time.perf_counter() - t1
+        return out, (_detector_builds(base) - builds) if warmup else None
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--top", type=int, default=10, help="slowest direct imports of server to list")
+    common.add_baseline_args(ap)
+    args = ap.parse_args(argv)
+
+    endpoint, _ = fake_gemini.start(fake_gemini.FakeConfig(latency="fixed:0", seed=1))
+    env = dict(
+        os.environ,
+        GEMINI_ENDPOINT=endpoint,
+        GEMINI_API_KEY=os.environ.get("GEMINI_API_KEY", "offline-bench"),
+        OUTPUTS_DIR=tempfile.mkdtemp(prefix="bench-outputs-"),
+        RATE_LIMIT_GENERATE_PER_MIN="0",
+        PREFLIGHT_MODE=os.environ.get("PREFLIGHT_MODE", "warn"),
+    )
+    data, mime = corpus.encode(corpus.make_image(corpus.SIZES["hd"], subjects=1, seed=3), "JPEG")
+    payload = {"theme": "passport", "image": base64.b64encode(data).decode("ascii"), "mime_type": mime}
+
+    samples = defaultdict(list)
+    child_totals = defaultdict(float)
+    late_builds = []
+    for _ in range(max(1, args.runs)):
+        total, children = measure_import(env)
+        samples["import/server"].append(total)
+        for name, seconds in children.items():
+            child_totals[name] += seconds
+        for warm in (False, True):
+            timings, builds = measure_start(env, warm, payload)
+            for name, seconds in timings.items():
+                samples[f"warmup={int(warm)}/{name}"].append(seconds)
+            if builds is not None:
+                late_builds.append(int(builds))
+
+    runs = max(1, args.runs)
+    print(f"slowest direct imports of server (mean of {runs} runs):")
+    for name, seconds in sorted(child_totals.items(), key=lambda kv: -kv[1])[: args.top]:
+        print(f"  {name:<24} {1000.0 * seconds / runs:>8.1f} ms")
+    print()
+    print(f"detector builds after /ready, per run (want 0): {late_builds}")
+    print()
+    results = {name: common.summarize(values, sum(values)) for name, values in samples.items()}
+    code = common.finish(results, args)
+    if any(late_builds):
+        print("\nFAILED: requests after /ready built a face detector; warm-up did not cover them")
+        return 1
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
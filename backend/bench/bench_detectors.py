@@ -0,0 +1,88 @@
+"""Compare face detector backends on a local image set.
+
+Usage (from backend/):
+    python bench/bench_detectors.py IMAGE_DIR [--backends haar,yunet] [--repeat 3]
+
+Reports per backend: images/s, mean and p95 latency, detection rate (images
+with at least one face) and landmark rate (images where eyes were located).
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import common
+import cv2
+
+import detectors
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+
+def load_images(image_dir: str):
+    images = []
+    for name in sorted(os.listdir(image_dir)):
+        if os.path.splitext(name)[1].lower() not in IMAGE_EXTS:
+            continue
+        img = cv2.imread(os.path.join(image_dir, name), cv2.IMREAD_COLOR)
+        if img is not None:
+            images.append((name, img))
+    return images
+
+
+def run_backend(backend: str, images, repeat: int):
+    det = detectors.BACKENDS[backend]()
+    det.detect(images[0][1])  # warm-up (model load, first allocation)
+    latencies = []
+    found = 0
+    with_eyes = 0
+    for _ in range(repeat):
+        found = with_eyes = 0
+        for _, img in images:
+            t0 = time.perf_counter()
+            faces = det.detect(img, min_size=48)
+            latencies.append(time.perf_counter() - t0)
+            if faces:
+                found += 1
+                if faces[0].eyes is not None:
+                    with_eyes += 1
+    total = sum(latencies)
+    return {
+        "backend": backend,
+        "images": len(images),
+        "throughput": len(latencies) / total if total else 0.0,
+        "mean_ms": 1000.0 * total / len(latencies),
+        "p95_ms": 1000.0 * common.percentile(latencies, 95),
+        "detect_rate": found / len(images),
+        "landmark_rate": with_eyes / len(images),
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("image_dir")
+    ap.add_argument("--backends", default="haar,yunet")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args(argv)
+
+    images = load_images(args.image_dir)
+    if not images:
+        print(f"no images found in {args.image_dir}", file=sys.stderr)
+        return 2
+
+    print(f"{'backend':<8} {'img/s':>8} {'mean ms':>9} {'p95 ms':>8} {'detect':>7} {'eyes':>6}")
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        if backend == "yunet" and not detectors.yunet_available():
+            print(f"{backend:<8} skipped (model not found at {detectors.YUNET_MODEL_PATH})")
+            continue
+        r = run_backend(backend, images, max(1, args.repeat))
+        print(
+            f"{r['backend']:<8} {r['throughput']:>8.1f} {r['mean_ms']:>9.2f} {r['p95_ms']:>8.2f} "
+            f"{r['detect_rate']:>6.0%} {r['landmark_rate']:>6.0%}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
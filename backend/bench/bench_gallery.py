@@ -0,0 +1,102 @@
+"""Gallery index benchmark: listing latency at millions of rows.
+
+Fills a temporary index with synthetic rows (themes drawn from the
+generate themes, creation times spread over a year) through bulk inserts,
+then times ``GalleryIndex.list``:
+
+- ``first_page``: newest page, no filter
+- ``deep_page``: a page reached by a cursor near the oldest rows
+- ``theme``: first page of one theme
+- ``theme_deep``: cursor page within one theme
+- ``range``: first page of a one-day window in the middle of the year
+- ``insert``: one ``add`` per call (the per-output cost on the request path)
+
+Usage (from backend/):
+    python bench/bench_gallery.py [--rows 1000000] [--page 50] [--repeat 200] [--json out.json] [--baseline base.json]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import common
+
+import gallery
+
+THEMES = ("resume", "passport", "model", "kpop", "travel", "anime", "meme", "wedding", "cosmos", "profession")
+YEAR_MS = 365 * 24 * 3600 * 1000
+
+
+def populate(index: gallery.GalleryIndex, rows: int, start_ms: int, seed: int = 1) -> None:
+    rng = random.Random(seed)
+    batch = []
+    for i in range(rows):
+        oid = f"{rng.getrandbits(128):032x}"
+        batch.append((oid, start_ms + rng.randrange(YEAR_MS), "generate", rng.choice(THEMES), "half",
+                      1080, 1620, rng.randrange(400_000, 3_000_000), "PNG", f"/outputs/{oid}.png"))
+        if len(batch) == 50_000:
+            index.add_many(batch)
+            batch = []
+    if batch:
+        index.add_many(batch)
+
+
+def timed(fn, repeat: int):
+    latencies = []
+    t_start = time.perf_counter()
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+    return common.summarize(latencies, time.perf_counter() - t_start)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--page", type=int, default=50)
+    ap.add_argument("--repeat", type=int, default=200)
+    common.add_baseline_args(ap)
+    args = ap.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench-gallery-")
+    path = os.path.join(workdir, "gallery.sqlite3")
+    index = gallery.GalleryIndex(path)
+    start_ms = int(time.time() * 1000) - YEAR_MS
+    t0 = time.perf_counter()
+    populate(index, args.rows, start_ms)
+    print(f"populated {index.count()} rows in {time.perf_counter() - t0:.1f}s ({os.path.getsize(path) / 1e6:.0f} MB)\n")
+
+    # Cursors near the old end of the whole index and of one theme
+    oldest = index._read_conn().execute(
+        "SELECT created_ms, id FROM outputs ORDER BY created_ms, id LIMIT 1 OFFSET ?", (args.page * 2,)
+    ).fetchone()
+    oldest_theme = index._read_conn().execute(
+        "SELECT created_ms, id FROM outputs WHERE theme = 'meme' ORDER BY created_ms, id LIMIT 1 OFFSET ?",
+        (args.page * 2,),
+    ).fetchone()
+    deep_cursor = gallery.encode_cursor(*oldest)
+    theme_cursor = gallery.encode_cursor(*oldest_theme)
+    mid = (start_ms + YEAR_MS // 2) / 1000.0
+    n = args.page
+    cases = {
+        "first_page": lambda: index.list(limit=n),
+        "deep_page": lambda: index.list(limit=n, cursor=deep_cursor),
+        "theme": lambda: index.list(theme="meme", limit=n),
+        "theme_deep": lambda: index.list(theme="meme", limit=n, cursor=theme_cursor),
+        "range": lambda: index.list(since=mid, until=mid + 86400, limit=n),
+    }
+    results = {name: timed(fn, args.repeat) for name, fn in cases.items()}
+    png = b"\x89PNG\r\n\x1a\n"
+    results["insert"] = timed(lambda: index.add(f"{random.getrandbits(128):032x}", "/outputs/x.png", png, "generate", "meme"),
+                              args.repeat)
+    shutil.rmtree(workdir, ignore_errors=True)
+    return common.finish(results, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
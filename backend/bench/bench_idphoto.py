@@ -0,0 +1,117 @@
+"""Local ID-photo render benchmark: latency, pass rate, and end-to-end time vs the upstream.
+
+Part 1 runs ``idphoto.render`` in-process on portrait corpus images, after
+the same ``ingest_input`` the server applies. Each image is rendered for
+every ``--targets`` entry (a passport region, or ``resume``). It reports
+p50/p95 render time, the share that passed the checks, and the checks that
+failed.
+
+Part 2 starts a Gemini stand-in (``--latency``) and the API in-process,
+then sends the same passport requests with ``ID_LOCAL_MODE`` off and auto.
+It reports end-to-end latency and the share rendered locally. A render
+that fails its checks in auto pays its render time on top of the upstream
+call.
+
+Corpus faces are drawn, not photographed, so pass rates only say the
+pipeline works end to end, not how real uploads fare.
+
+Usage (from backend/):
+    python bench/bench_idphoto.py [--sizes hd,2mp,12mp] [--seeds 6] [--targets US,UK,KR,resume]
+                                  [--latency lognormal:1.5,0.4] [--requests 12] [--json out.json] [--baseline base.json]
+"""
+
+import argparse
+import base64
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import common
+import corpus
+import fake_gemini
+import load
+
+import idphoto
+import imaging
+import metrics
+
+
+def build(sizes, seeds):
+    """(size name, working-resolution JPEG bytes) per size and seed, in portrait orientation."""
+    out = []
+    for name in sizes:
+        w, h = sorted(corpus.SIZES[name])
+        for seed in range(seeds):
+            data, mime = corpus.encode(corpus.make_image((w, h), 1, seed))
+            out.append((name, imaging.ingest_input(data, mime)[0]))
+    return out
+
+
+def bench_render(images, targets):
+    results, reasons = {}, {}
+    for name in dict.fromkeys(n for n, _ in images):
+        latencies, passed, failed = [], 0, Counter()
+        t_start = time.perf_counter()
+        for _, data in (i for i in images if i[0] == name):
+            for target in targets:
+                theme, region = ("resume", None) if target == "resume" else ("passport", target)
+                t0 = time.perf_counter()
+                png, checks, _ = idphoto.render(data, theme, region)
+                latencies.append(time.perf_counter() - t0)
+                passed += png is not None
+                failed.update(checks)
+        key = f"render/{name}"
+        results[key] = common.summarize(latencies, time.perf_counter() - t_start)
+        results[key]["pass_rate"] = passed / max(1, len(latencies))
+        reasons[key] = failed
+    return results, reasons
+
+
+def bench_api(images, latency: str, requests_total: int):
+    host = fake_gemini.start(fake_gemini.FakeConfig(latency=latency))[0]
+    base = load.start_api(host, tempfile.mkdtemp(prefix="bench-outputs-"))
+    payloads = [{"theme": "passport", "image": base64.b64encode(data).decode("ascii"), "mime_type": "image/jpeg",
+                 "options": {"shots": 1, "region": "US"}} for _, data in images]
+    results = {}
+    for mode in ("off", "auto"):
+        idphoto.MODE = mode
+        before = metrics.LOCAL_RENDERS.value(theme="passport", outcome="ok")
+        latencies, errors, wall = load.drive(f"{base}/api/generate", payloads, 1, requests_total)
+        key = f"api/{mode}"
+        results[key] = common.summarize(latencies, wall, errors)
+        results[key]["local_share"] = (metrics.LOCAL_RENDERS.value(theme="passport", outcome="ok") - before) / max(1, requests_total)
+    return results
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="hd,2mp,12mp")
+    ap.add_argument("--seeds", type=int, default=6)
+    ap.add_argument("--targets", default="US,UK,KR,resume")
+    ap.add_argument("--latency", default="lognormal:1.5,0.4", help="stand-in upstream latency")
+    ap.add_argument("--requests", type=int, default=12, help="API requests per mode (0 skips part 2)")
+    common.add_baseline_args(ap)
+    args = ap.parse_args(argv)
+
+    images = build([s.strip() for s in args.sizes.split(",") if s.strip()], args.seeds)
+    targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    results, reasons = bench_render(images, targets)
+    print(f"{'size':<16} {'renders':>8} {'pass':>6} {'p50 ms':>9} {'p95 ms':>9}  failed checks")
+    for key, r in results.items():
+        failed = " ".join(f"{k}={v}" for k, v in reasons[key].most_common())
+        print(f"{key:<16} {r['n']:>8} {r['pass_rate']:>6.0%} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f}  {failed or '-'}")
+    print()
+
+    if args.requests:
+        api = bench_api(images, args.latency, args.requests)
+        print(f"{'mode':<16} {'ok':>5} {'local':>6} {'p50 ms':>9} {'p95 ms':>9}")
+        for key, r in api.items():
+            print(f"{key:<16} {r['n']:>5} {r['local_share']:>6.0%} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f}")
+        print()
+        results.update(api)
+    return common.finish(results, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""Ingest benchmark: draft-mode decode vs full decode + resize, 12-48 MP.
+
+Compares ``imaging.ingest_input`` with the previous approach: full
+decode, LANCZOS resize to the working size, then re-encode. Reports
+latency from repeated in-process runs. Peak memory is measured separately:
+each (method, image) pair runs once in a fresh spawned process, and the
+growth of its peak RSS (VmHWM) is recorded, so allocator reuse across
+runs does not hide the footprint.
+
+It also checks EXIF handling. A portrait photo is stored sideways with
+Orientation=6, and the bench reports the working image's dimensions and
+the faces detected for each method.
+
+Usage (from backend/):
+    python bench/bench_ingest.py [--sizes 12mp,24mp,48mp] [--formats JPEG] [--repeat 5]
+                                 [--json out.json] [--baseline base.json]
+"""
+
+import argparse
+import multiprocessing
+import resource
+import sys
+import time
+from io import BytesIO
+
+import common
+import corpus
+
+import imaging
+import ingest
+
+
+def legacy_preprocess(img_bytes: bytes, mime: str):
+    """Previous ingest: full-resolution decode, LANCZOS to working size, JPEG q90; no EXIF handling."""
+    from PIL import Image
+
+    img = Image.open(BytesIO(img_bytes)).convert("RGB")
+    w, h = img.size
+    if max(w, h) > ingest.WORKING_MAX_SIDE:
+        img = img.resize(ingest.working_size(w, h), Image.LANCZOS)
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=90)
+    return buf.getvalue(), "image/jpeg"
+
+
+METHODS = {"legacy": legacy_preprocess, "ingest": imaging.ingest_input}
+
+
+def _peak_rss() -> int:
+    # VmHWM belongs to this process image; ru_maxrss survives exec and would report the parent's peak
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _peak_rss_child(method: str, data: bytes, mime: str, conn) -> None:
+    before = _peak_rss()
+    METHODS[method](data, mime)
+    conn.send(_peak_rss() - before)
+    conn.close()
+
+
+def peak_rss_bytes(method: str, data: bytes, mime: str) -> int:
+    ctx = multiprocessing.get_context("spawn")
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_peak_rss_child, args=(method, data, mime, child))
+    proc.start()
+    value = parent.recv()
+    proc.join()
+    return value
+
+
+def orientation_check(size) -> None:
+    from PIL import Image
+
+    upright = corpus.make_image(size, subjects=1, seed=1)
+    exif = Image.Exif()
+    exif[0x0112] = 6  # stored rotated 90 degrees; viewers rotate it back
+    buf = BytesIO()
+    upright.rotate(90, expand=True).save(buf, format="JPEG", quality=90, exif=exif.tobytes())
+    data = buf.getvalue()
+    print(f"EXIF orientation check ({size[0]}x{size[1]} portrait stored sideways, Orientation=6):")
+    for name, fn in METHODS.items():
+        out, _ = fn(data, "image/jpeg")
+        w, h = Image.open(BytesIO(out)).size
+        faces = len(imaging.detect_faces(out))
+        print(f"  {name:<7} working image {w}x{h} ({'portrait' if h > w else 'landscape'}), faces detected: {faces}")
+    print()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="12mp,24mp,48mp")
+    ap.add_argument("--formats", default="JPEG", help="JPEG and/or PNG")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--no-memory", action="store_true", help="skip the per-process peak RSS runs")
+    common.add_baseline_args(ap)
+    args = ap.parse_args(argv)
+
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    formats = [f.strip().upper() for f in args.formats.split(",") if f.strip()]
+    entries = corpus.build(sizes=sizes, subjects=(1,), formats=formats)
+
+    orientation_check(corpus.SIZES["12mp"])
+
+    results = {}
+    memory_rows = []
+    for entry in entries:
+        data, mime = entry["bytes"], entry["mime"]
+        for name, fn in METHODS.items():
+            fn(data, mime)  # warm-up
+            latencies = []
+            t_start = time.perf_counter()
+            for _ in range(max(1, args.repeat)):
+                t0 = time.perf_counter()
+                fn(data, mime)
+                latencies.append(time.perf_counter() - t0)
+            key = f"{name}/{entry['name']}"
+            results[key] = common.summarize(latencies, time.perf_counter() - t_start)
+            if not args.no_memory:
+                peak = peak_rss_bytes(name, data, mime)
+                results[key]["peak_rss_mb"] = peak / (1024 * 1024)
+                memory_rows.append((key, peak))
+
+    if memory_rows:
+        print(f"{'peak RSS growth (fresh process)':<44} {'MiB':>9}")
+        for key, peak in memory_rows:
+            print(f"{key:<44} {peak / (1024 * 1024):>9.1f}")
+        print()
+    return common.finish(results, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""Upstream response parsing benchmark: time and peak memory per response size.
+
+Builds generateContent responses shaped like the real API: pretty-printed,
+a text part before the image, and usage metadata. The image is a random
+payload of the given size, so the base64 does not compress. Each response
+is parsed three ways:
+
+- ``json``: the previous path, ``resp.json()`` (decode to ``str`` + ``json.loads``), then ``b64decode``
+- ``orjson``: ``orjson.loads`` on the bytes, then ``b64decode`` (skipped when orjson is missing)
+- ``extract``: ``gemini_parse.extract`` (scan + ``a2b_base64`` on a memoryview slice)
+
+All three must return the same image and usage. Peak memory is the
+tracemalloc peak of one parse above what was allocated before it, with the
+response body excluded, since requests already holds it.
+
+Usage (from backend/):
+    python bench/bench_parse.py [--sizes 0.5,2,4,8] [--repeat 20] [--json out.json] [--baseline base.json]
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import common
+
+import gemini_parse
+import lazy
+
+
+def make_response(image_mb: float, seed: int = 0) -> bytes:
+    image = os.urandom(int(image_mb * 1024 * 1024))
+    doc = {
+        "candidates": [{
+            "content": {"role": "model", "parts": [
+                {"text": "Here is the portrait with a clean studio background."},
+                {"inlineData": {"mimeType": "image/png", "data": base64.b64encode(image).decode("ascii")}},
+            ]},
+            "finishReason": "STOP",
+            "index": 0,
+        }],
+        "usageMetadata": {
+            "promptTokenCount": 1290 + seed,
+            "candidatesTokenCount": 1290,
+            "totalTokenCount": 2580 + seed,
+            "promptTokensDetails": [{"modality": "TEXT", "tokenCount": 32}, {"modality": "IMAGE", "tokenCount": 1258}],
+        },
+        "modelVersion": "gemini-2.5-flash-image",
+        "responseId": "bench",
+    }
+    return json.dumps(doc, indent=2).encode("utf-8")
+
+
+def _first_image(doc):
+    for cand in doc.get("candidates", []):
+        for part in cand.get("content", {}).get("parts", []):
+            if "inlineData" in part:
+                return base64.b64decode(part["inlineData"]["data"]), doc.get("usageMetadata")
+    return None, doc.get("usageMetadata")
+
+
+def parse_json(body: bytes):
+    return _first_image(json.loads(body.decode("utf-8")))
+
+
+def parse_orjson(body: bytes):
+    return _first_image(lazy.module("orjson").loads(body))
+
+
+def parse_extract(body: bytes):
+    found = gemini_parse.extract(body)
+    return found.data, found.usage
+
+
+def peak_bytes(fn, body: bytes) -> int:
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        result = fn(body)
+        peak = tracemalloc.get_traced_memory()[1]
+        del result
+    finally:
+        tracemalloc.stop()
+    return peak - base
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="0.5,2,4,8", help="decoded image sizes in MiB")
+    ap.add_argument("--repeat", type=int, default=20)
+    common.add_baseline_args(ap)
+    args = ap.parse_args(argv)
+
+    methods = {"json": parse_json, "extract": parse_extract}
+    if lazy.available("orjson"):
+        methods["orjson"] = parse_orjson
+    else:
+        print("orjson not installed; skipping that method")
+
+    results = {}
+    for size in [float(s) for s in args.sizes.split(",") if s.strip()]:
+        body = make_response(size)
+        expected = parse_json(body)
+        for name, fn in methods.items():
+            if fn(body) != expected:
+                raise SystemExit(f"{name} disagrees with json on the {size:g} MiB response")
+            latencies = []
+            t_start = time.perf_counter()
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                fn(body)
+                latencies.append(time.perf_counter() - t0)
+            key = f"{name}/{size:g}MiB"
+            results[key] = common.summarize(latencies, time.perf_counter() - t_start)
+            results[key]["peak_mib"] = peak_bytes(fn, body) / (1024 * 1024)
+
+    print(f"{'method/image size':<24} {'body MiB':>9} {'p50 ms':>9} {'peak MiB':>9}")
+    for key, r in results.items():
+        body_mib = float(key.split("/")[1][:-3]) * 4 / 3
+        print(f"{key:<24} {body_mib:>9.2f} {r['p50_ms']:>9.2f} {r['peak_mib']:>9.2f}")
+    print()
+    return common.finish(results, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
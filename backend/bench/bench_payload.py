@@ -0,0 +1,125 @@
+"""Upstream payload benchmark: request bytes and upstream latency per budget.
+
+Starts the local Gemini stand-in with a simulated upload bandwidth, so
+payload size turns into upstream time, and serves the API in-process. It
+then sends the same generate and composite requests once per budget
+setting:
+
+- ``off``: ``PAYLOAD_PLANNER=0``; parts go upstream as the pipeline produced them
+- ``scale=S``: every budget in ``payload.py`` scaled by S (1.0 is the shipped default)
+
+For each setting and input it reports the upstream request body size (as
+received by the stand-in) and the ``upstream`` duration from Server-Timing.
+Corpus images are smooth and compress far better than photos, so the bench
+adds sensor-like grain (``--grain``) to bring encoded sizes closer to real
+uploads.
+
+Usage (from backend/):
+    python bench/bench_payload.py [--scales 0.5,0.75,1,1.5] [--upload-mbps 20] [--sizes hd,2mp,12mp]
+                                  [--formats JPEG,PNG] [--themes passport,model,meme] [--grain 12] [--repeat 3]
+                                  [--json out.json] [--baseline base.json]
+"""
+
+import argparse
+import base64
+import os
+import re
+import sys
+import tempfile
+
+import requests
+from PIL import Image
+
+import common
+import corpus
+import fake_gemini
+from load import start_api
+
+_UPSTREAM = re.compile(r"upstream;dur=([\d.]+)")
+
+
+def _upstream_seconds(resp: requests.Response) -> float:
+    m = _UPSTREAM.search(resp.headers.get("Server-Timing", ""))
+    return float(m.group(1)) / 1000.0 if m else 0.0
+
+
+def grainy_corpus(sizes, formats, grain: float):
+    images = []
+    for i, size in enumerate(sizes):
+        img = corpus.make_image(corpus.SIZES[size], subjects=1, seed=i)
+        if grain > 0:
+            noise = Image.effect_noise(img.size, grain).convert("RGB")
+            img = Image.blend(img, noise, 0.15)
+        for fmt in formats:
+            data, mime = corpus.encode(img, fmt)
+            images.append((f"{size}-{fmt.lower()}", base64.b64encode(data).decode("ascii"), mime))
+    return images
+
+
+def build_requests(images, themes):
+    out = []
+    for name, b64, mime in images:
+        for theme in themes:
+            out.append((f"generate-{theme}/{name}", "/api/generate",
+                        {"theme": theme, "image": b64, "mime_type": mime, "options": {"shots": 1}}))
+        if len(b64) * 3 // 4 > 12 * 1024 * 1024:
+            continue  # over composite's per-image limit
+        # The image serves as both portrait and scene; enough to size both parts
+        out.append((f"composite/{name}", "/api/composite",
+                    {"user_image": b64, "user_mime_type": mime, "ref_image": b64, "ref_mime_type": mime}))
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scales", default="0.5,0.75,1,1.5")
+    ap.add_argument("--upload-mbps", type=float, default=20.0, help="simulated upload bandwidth to the model")
+    ap.add_argument("--sizes", default="hd,2mp,12mp")
+    ap.add_argument("--formats", default="JPEG,PNG")
+    ap.add_argument("--themes", default="passport,model,meme")
+    ap.add_argument("--grain", type=float, default=12.0, help="noise sigma added to corpus images (0 = none)")
+    ap.add_argument("--repeat", type=int, default=3)
+    common.add_baseline_args(ap)
+    args = ap.parse_args(argv)
+
+    endpoint, fake = fake_gemini.start(fake_gemini.FakeConfig(latency="fixed:0", upload_mbps=args.upload_mbps, seed=1))
+    # Inline CPU work, so the budget changes below reach every stage
+    os.environ["CPU_POOL_WORKERS"] = "0"
+    base = start_api(endpoint, tempfile.mkdtemp(prefix="bench-outputs-"))
+    import payload
+
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    formats = [f.strip().upper() for f in args.formats.split(",") if f.strip()]
+    themes = [t.strip() for t in args.themes.split(",") if t.strip()]
+    reqs = build_requests(grainy_corpus(sizes, formats, args.grain), themes)
+    settings = [("off", None)] + [(f"scale={float(s):g}", float(s)) for s in args.scales.split(",") if s.strip()]
+
+    results = {}
+    with requests.Session() as session:
+        for label, scale in settings:
+            payload.ENABLED = scale is not None
+            payload.BUDGET_SCALE = scale or 1.0
+            for name, path, body in reqs:
+                latencies, sent, errors = [], [], 0
+                for _ in range(max(1, args.repeat)):
+                    mark = len(fake.received_bytes)
+                    r = session.post(base + path, json=body, timeout=300)
+                    if r.status_code != 200:
+                        errors += 1
+                        continue
+                    latencies.append(_upstream_seconds(r))
+                    sent.append(sum(fake.received_bytes[mark:]))
+                key = f"{label}/{name}"
+                results[key] = common.summarize(latencies, sum(latencies), errors)
+                results[key]["payload_kb"] = sum(sent) / max(1, len(sent)) / 1024
+
+    print(f"upstream request body per call ({args.upload_mbps:g} Mbit/s simulated upload)")
+    print(f"{'setting/request':<44} {'KiB':>9} {'upstream p50 ms':>16}")
+    for key, r in results.items():
+        print(f"{key:<44} {r['payload_kb']:>9.1f} {r['p50_ms']:>16.1f}")
+    print()
+    return common.finish(results, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""Upstream key pool benchmark against rpm-limited local stand-ins.
+
+Starts ``--hosts`` Gemini stand-ins, each enforcing ``--rpm`` requests per
+minute per API key, and the API in-process. It then sends the same burst
+of /api/generate requests through three pools:
+
+- ``single``: one key, the old setup
+- ``pool``: ``--keys`` keys spread over the hosts, with their rpm declared,
+  so routing follows headroom and a key is skipped before it fills up
+- ``pool-undeclared``: the same keys with no quota declared, so the pool
+  only learns from 429s (cooldown and failover)
+
+For each pool it reports delivered images, refusals, upstream 429s and the
+calls per key. ``--weights`` sets per-key weights (e.g. ``1,1,2``).
+
+Usage (from backend/):
+    python bench/bench_upstreams.py [--keys 3] [--hosts 2] [--rpm 10] [--requests 40] [--concurrency 6]
+                                    [--latency fixed:0.2] [--weights 1,1,1] [--json out.json] [--baseline base.json]
+"""
+
+import argparse
+import sys
+import tempfile
+
+import common
+import fake_gemini
+import load
+
+import metrics
+import upstreams
+
+
+def _spec(keys, hosts, rpm: float, weights, declare: bool) -> str:
+    entries = []
+    for i in range(keys):
+        entry = f"name=k{i + 1},key=bench-key-{i + 1},endpoint={hosts[i % len(hosts)]},weight={weights[i % len(weights)]}"
+        entries.append(entry + (f",rpm={rpm:g}" if declare else ""))
+    return ";".join(entries)
+
+
+def _calls(names):
+    """Calls per key and the total of 429s, from the pool metrics."""
+    per_key, throttled = {}, 0
+    for name in names:
+        for status in ("200", "400", "429", "500", "error"):
+            n = metrics.UPSTREAM_POOL_CALLS.value(upstream=name, status=status)
+            per_key[name] = per_key.get(name, 0) + n
+            if status == "429":
+                throttled += n
+    return per_key, throttled
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--keys", type=int, default=3)
+    ap.add_argument("--hosts", type=int, default=2)
+    ap.add_argument("--rpm", type=float, default=10, help="stand-in quota per key per minute")
+    ap.add_argument("--requests", type=int, default=40)
+    ap.add_argument("--concurrency", type=int, default=6)
+    ap.add_argument("--latency", default="fixed:0.2")
+    ap.add_argument("--weights", default="1")
+    ap.add_argument("--theme", default="passport")
+    common.add_baseline_args(ap)
+    args = ap.parse_args(argv)
+
+    hosts = [fake_gemini.start(fake_gemini.FakeConfig(latency=args.latency, rpm=args.rpm, seed=i))[0]
+             for i in range(max(1, args.hosts))]
+    weights = [float(w) for w in args.weights.split(",") if w.strip()] or [1.0]
+    base = load.start_api(hosts[0], tempfile.mkdtemp(prefix="bench-outputs-"))
+    payloads, _ = load.build_payloads([args.theme], ["vga"])
+
+    runs = {
+        "single": _spec(1, hosts, args.rpm, weights, True),
+        "pool": _spec(args.keys, hosts, args.rpm, weights, True),
+        "pool-undeclared": _spec(args.keys, hosts, args.rpm, weights, False),
+    }
+    results, details = {}, {}
+    for i, (name, spec) in enumerate(runs.items()):
+        # Fresh keys per run so quotas used by an earlier run do not carry over
+        spec = spec.replace("key=bench-key-", f"key=run{i}-key-")
+        upstreams.POOL = upstreams.Pool(upstreams.parse(spec, hosts[0]))
+        names = [u.name for u in upstreams.POOL.upstreams]
+        before, throttled_before = _calls(names)
+        latencies, errors, wall = load.drive(f"{base}/api/generate", payloads, args.concurrency, args.requests)
+        after, throttled_after = _calls(names)
+        results[name] = common.summarize(latencies, wall, errors)
+        details[name] = {
+            "throttled": throttled_after - throttled_before,
+            "per_key": {k: int(after[k] - before.get(k, 0)) for k in names},
+        }
+        results[name]["upstream_429"] = details[name]["throttled"]
+
+    print(f"{'pool':<18} {'ok':>5} {'refused':>8} {'429s':>6} {'p50 ms':>9}  calls per key")
+    for name, r in results.items():
+        per_key = " ".join(f"{k}={v}" for k, v in details[name]["per_key"].items())
+        print(f"{name:<18} {r['n']:>5} {r['errors']:>8} {details[name]['throttled']:>6} {r['p50_ms']:>9.1f}  {per_key}")
+    print()
+    return common.finish(results, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""Shared helpers for the offline benchmarks: stats, reporting and baselines."""
+
+import json
+import os
+import sys
+from typing import Dict, Iterable, List
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# Metrics where larger is better; everything else (latencies) regresses upward
+HIGHER_IS_BETTER = {"throughput"}
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(latencies: List[float], wall_seconds: float, errors: int = 0) -> Dict[str, float]:
+    """Latency percentiles in ms plus throughput (ok requests per second)."""
+    ok = len(latencies)
+    return {
+        "n": ok,
+        "errors": errors,
+        "throughput": ok / wall_seconds if wall_seconds > 0 else 0.0,
+        "p50_ms": 1000.0 * percentile(latencies, 50),
+        "p95_ms": 1000.0 * percentile(latencies, 95),
+        "p99_ms": 1000.0 * percentile(latencies, 99),
+    }
+
+
+def print_table(results: Dict[str, Dict[str, float]]) -> None:
+    print(f"{'benchmark':<44} {'n':>5} {'err':>4} {'ops/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, r in results.items():
+        print(
+            f"{name:<44} {r['n']:>5} {r.get('errors', 0):>4} {r['throughput']:>9.2f} "
+            f"{r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f}"
+        )
+
+
+def compare_to_baseline(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float,
+    keys: Iterable[str] = ("throughput", "p50_ms", "p95_ms", "p99_ms"),
+) -> List[str]:
+    """Return human-readable regressions beyond ``tolerance`` (fraction, e.g. 0.2)."""
+    problems = []
+    for name, cur in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for key in keys:
+            b, c = base.get(key), cur.get(key)
+            if not b or c is None:
+                continue
+            if key in HIGHER_IS_BETTER:
+                regressed = c < b * (1.0 - tolerance)
+            else:
+                regressed = c > b * (1.0 + tolerance)
+            if regressed:
+                problems.append(f"{name} {key}: {c:.2f} vs baseline {b:.2f} (tolerance {tolerance:.0%})")
+    return problems
+
+
+def add_baseline_args(ap) -> None:
+    ap.add_argument("--json", help="write results as JSON to this path")
+    ap.add_argument("--baseline", help="baseline JSON to compare against; exit 1 on regression")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="allowed regression fraction (default 0.2)")
+
+
+def finish(results: Dict[str, Dict[str, float]], args) -> int:
+    """Print, optionally save, and check results against a baseline. Returns exit code."""
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        problems = compare_to_baseline(results, baseline, args.tolerance)
+        if problems:
+            print("\nREGRESSIONS:")
+            for p in problems:
+                print("  " + p)
+            return 1
+        print(f"\nno regressions vs {args.baseline}")
+    return 0
@@ -0,0 +1,85 @@
+"""Synthetic face corpus for the offline benchmarks.
+
+Images are drawn procedurally (blurred skin-tone face with darker eye band,
+brows and mouth) at several sizes, with one or two subjects, and encoded as
+JPEG or PNG. They are not photographs; they exist to give the pipeline the
+same pixel counts, codecs and rough structure as real uploads.
+"""
+
+import random
+from io import BytesIO
+from typing import Dict, List, Tuple
+
+from PIL import Image, ImageDraw, ImageFilter
+
+# name -> (width, height); 0.3 MP up to 48 MP phone captures
+SIZES: Dict[str, Tuple[int, int]] = {
+    "vga": (640, 480),
+    "hd": (1280, 960),
+    "2mp": (1600, 1200),
+    "12mp": (3000, 4000),
+    "24mp": (4000, 6000),
+    "48mp": (6000, 8000),
+}
+DEFAULT_SIZES = ("vga", "2mp", "12mp")
+
+
+def _draw_face(d: ImageDraw.ImageDraw, cx: float, cy: float, fw: float, rng: random.Random) -> None:
+    fh = fw * 1.3
+    skin = (rng.randint(170, 235), rng.randint(130, 190), rng.randint(100, 160))
+    d.ellipse((cx - fw / 2, cy - fh / 2, cx + fw / 2, cy + fh / 2), fill=skin)
+    hair = tuple(rng.randint(10, 70) for _ in range(3))
+    d.chord((cx - fw / 2, cy - fh / 2 - fw * 0.08, cx + fw / 2, cy + fh * 0.1), 180, 360, fill=hair)
+    eye_y = cy - fh * 0.08
+    for side in (-1, 1):
+        ex = cx + side * fw * 0.2
+        d.ellipse((ex - fw * 0.09, eye_y - fw * 0.045, ex + fw * 0.09, eye_y + fw * 0.045), fill=(245, 245, 245))
+        d.ellipse((ex - fw * 0.04, eye_y - fw * 0.04, ex + fw * 0.04, eye_y + fw * 0.04), fill=(40, 30, 25))
+        d.rectangle((ex - fw * 0.11, eye_y - fw * 0.12, ex + fw * 0.11, eye_y - fw * 0.09), fill=hair)
+    d.polygon(
+        [(cx, eye_y + fw * 0.05), (cx - fw * 0.06, cy + fh * 0.12), (cx + fw * 0.06, cy + fh * 0.12)],
+        fill=tuple(max(0, c - 30) for c in skin),
+    )
+    d.ellipse((cx - fw * 0.15, cy + fh * 0.2, cx + fw * 0.15, cy + fh * 0.26), fill=(150, 60, 60))
+
+
+def make_image(size: Tuple[int, int], subjects: int = 1, seed: int = 0) -> Image.Image:
+    rng = random.Random(seed)
+    w, h = size
+    img = Image.new("RGB", size, tuple(rng.randint(60, 200) for _ in range(3)))
+    d = ImageDraw.Draw(img)
+    for i in range(subjects):
+        cx = w * (i + 1) / (subjects + 1)
+        fw = min(w / (subjects + 1.5), h * 0.35) * rng.uniform(0.75, 0.95)
+        cy = h * 0.42
+        # shoulders
+        d.rectangle((cx - fw * 1.1, cy + fw * 0.75, cx + fw * 1.1, h), fill=tuple(rng.randint(20, 140) for _ in range(3)))
+        _draw_face(d, cx, cy, fw, rng)
+    return img.filter(ImageFilter.GaussianBlur(radius=max(1, min(w, h) // 400)))
+
+
+def encode(img: Image.Image, fmt: str = "JPEG") -> Tuple[bytes, str]:
+    buf = BytesIO()
+    if fmt == "JPEG":
+        img.save(buf, format="JPEG", quality=90)
+        return buf.getvalue(), "image/jpeg"
+    img.save(buf, format="PNG")
+    return buf.getvalue(), "image/png"
+
+
+def build(sizes=DEFAULT_SIZES, subjects=(1, 2), formats=("JPEG",)) -> List[Dict]:
+    """Return corpus entries: {name, size, subjects, bytes, mime}."""
+    out = []
+    for si, name in enumerate(sizes):
+        for subj in subjects:
+            img = make_image(SIZES[name], subjects=subj, seed=si * 10 + subj)
+            for fmt in formats:
+                data, mime = encode(img, fmt)
+                out.append({
+                    "name": f"{name}-{subj}p-{fmt.lower()}",
+                    "size": SIZES[name],
+                    "subjects": subj,
+                    "bytes": data,
+                    "mime": mime,
+                })
+    return out
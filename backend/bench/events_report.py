@@ -0,0 +1,157 @@
+"""Capacity and cost report from the generation event log (see events.py).
+
+Reads ``events.jsonl`` and its rotated siblings (``events.jsonl.1`` ...)
+and groups requests by (endpoint, theme). For each group it reports:
+
+- request count and status mix
+- latency p50/p95/p99 and mean time per stage
+- the share of total latency spent in ``upstream``
+- extra upstream calls per request by reason (400 fallback, duplicate variant)
+- mean input size, subjects and shots
+- token totals and the estimated model cost at the given per-million-token prices
+
+Usage (from backend/):
+    python bench/events_report.py [data/events] [--since 2026-10-01] [--until 2026-10-08]
+                                  [--price-input 0.30] [--price-output 30] [--json report.json]
+
+Paths may be files, globs or directories (all ``events.jsonl*`` inside).
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+import common
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "events")
+
+
+def _parse_time(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def _files(paths: List[str]) -> List[str]:
+    out = []
+    for p in paths:
+        if os.path.isdir(p):
+            out.extend(glob.glob(os.path.join(p, "events.jsonl*")))
+        else:
+            out.extend(sorted(glob.glob(p)) or [p])
+    return out
+
+
+def read_events(paths: List[str], since: Optional[float] = None, until: Optional[float] = None) -> Iterator[Dict]:
+    for path in _files(paths):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by a crash
+                ts = rec.get("ts", 0)
+                if (since is None or ts >= since) and (until is None or ts < until):
+                    yield rec
+
+
+def _mean(values: List[float]) -> float:
+    return sum(values) / len(values) if values else 0.0
+
+
+def build_report(events, price_input: float, price_output: float) -> Dict[str, Dict]:
+    groups: Dict[str, List[Dict]] = defaultdict(list)
+    for rec in events:
+        groups[f"{rec.get('endpoint', '?')}/{rec.get('theme') or '-'}"].append(rec)
+
+    report = {}
+    for key in sorted(groups):
+        recs = groups[key]
+        n = len(recs)
+        durations = [r.get("duration_s", 0.0) for r in recs]
+        stage_totals: Dict[str, float] = defaultdict(float)
+        retries: Counter = Counter()
+        tokens: Counter = Counter()
+        upstream_calls = 0
+        for r in recs:
+            for stage, secs in (r.get("stages_s") or {}).items():
+                stage_totals[stage] += secs
+            retries.update(r.get("retries") or {})
+            tokens.update(r.get("tokens") or {})
+            upstream_calls += len(r.get("upstream") or ())
+        inputs = [i for r in recs for i in r.get("inputs") or ()]
+        total_time = sum(durations)
+        cost = (tokens["prompt"] * price_input + tokens["candidates"] * price_output) / 1e6
+        report[key] = {
+            "requests": n,
+            "status": dict(Counter(str(r.get("status")) for r in recs)),
+            "p50_ms": common.percentile(durations, 50) * 1000,
+            "p95_ms": common.percentile(durations, 95) * 1000,
+            "p99_ms": common.percentile(durations, 99) * 1000,
+            "stage_mean_ms": {s: t / n * 1000 for s, t in sorted(stage_totals.items())},
+            "upstream_share": stage_totals.get("upstream", 0.0) / total_time if total_time else 0.0,
+            "upstream_calls_per_request": upstream_calls / n,
+            "retries_per_request": {reason: c / n for reason, c in sorted(retries.items())},
+            "input_mb_mean": _mean([i.get("bytes") or 0 for i in inputs]) / 1e6,
+            "input_mp_mean": _mean([(i.get("width") or 0) * (i.get("height") or 0) / 1e6 for i in inputs]),
+            "subjects_mean": _mean([r["subjects"] for r in recs if "subjects" in r]),
+            "shots_mean": _mean([r["shots"] for r in recs if "shots" in r]),
+            "tokens": dict(tokens),
+            "cost_usd": cost,
+            "cost_per_request_usd": cost / n,
+        }
+    return report
+
+
+def print_report(report: Dict[str, Dict]) -> None:
+    print(f"{'endpoint/theme':<24} {'n':>6} {'ok%':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'upstr%':>7} {'calls/r':>8} {'400fb/r':>8} {'dup/r':>6} {'Mtok':>7} {'$/req':>8}")
+    for key, r in report.items():
+        ok = r["status"].get("200", 0) / r["requests"] * 100
+        rt = r["retries_per_request"]
+        print(f"{key:<24} {r['requests']:>6} {ok:>6.1f} {r['p50_ms']:>8.0f} {r['p95_ms']:>8.0f} {r['p99_ms']:>8.0f} "
+              f"{r['upstream_share'] * 100:>7.1f} {r['upstream_calls_per_request']:>8.2f} "
+              f"{rt.get('400_fallback', 0):>8.3f} {rt.get('duplicate_variant', 0):>6.3f} "
+              f"{r['tokens'].get('total', 0) / 1e6:>7.2f} {r['cost_per_request_usd']:>8.4f}")
+    print()
+    for key, r in report.items():
+        stages = ", ".join(f"{s}={ms:.0f}" for s, ms in r["stage_mean_ms"].items())
+        status = ", ".join(f"{s}:{c}" for s, c in sorted(r["status"].items()))
+        print(f"{key}: status {status}; mean stage ms {stages or '-'}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("paths", nargs="*", default=[DEFAULT_DIR])
+    ap.add_argument("--since", help="epoch seconds or ISO 8601")
+    ap.add_argument("--until", help="epoch seconds or ISO 8601")
+    ap.add_argument("--price-input", type=float, default=0.30, help="USD per million prompt tokens")
+    ap.add_argument("--price-output", type=float, default=30.0, help="USD per million candidate (output) tokens")
+    ap.add_argument("--json", help="also write the report to this file")
+    args = ap.parse_args(argv)
+
+    report = build_report(read_events(args.paths, _parse_time(args.since), _parse_time(args.until)),
+                          args.price_input, args.price_output)
+    if not report:
+        print("no events in range")
+        return 1
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
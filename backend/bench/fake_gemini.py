@@ -0,0 +1,184 @@
+"""Local stand-in for the Gemini generateContent endpoint.
+
+Answers every POST with a generated PNG in ``inlineData`` and a
+``usageMetadata`` block. Latency follows a configurable distribution, and a
+configurable share of requests fail with 400 (which exercises the server's
+minimal-payload fallback), 429 or 500. ``upload_mbps`` adds the time the
+request body would take over a link of that bandwidth, so payload size
+shows up in upstream latency. The body size of each request is appended
+to ``server.received_bytes``. ``rpm`` is a per-API-key quota: past that many
+requests in the last minute, a key gets 429 with ``Retry-After`` and a
+``retryDelay`` until its oldest request leaves the window. Requests per
+key are counted in ``server.calls_by_key``.
+
+Run standalone:
+    python bench/fake_gemini.py --port 9010 --latency lognormal:1.5,0.4 --error-rate 0.02
+then start the API with GEMINI_ENDPOINT=http://127.0.0.1:9010/generateContent.
+Or embed it with ``start(FakeConfig(...))``.
+"""
+
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Optional, Tuple
+
+from PIL import Image, ImageDraw
+
+
+@dataclass
+class FakeConfig:
+    # "fixed:S", "uniform:A,B", "lognormal:MEDIAN,SIGMA" (seconds)
+    latency: str = "fixed:0"
+    error_rate: float = 0.0  # share of 429/500 responses
+    bad_request_rate: float = 0.0  # share of 400 responses to full payloads
+    image_size: Tuple[int, int] = (1024, 1280)
+    upload_mbps: float = 0.0  # simulated client->model bandwidth; 0 = unlimited
+    rpm: float = 0.0  # requests per minute per API key; 0 = unlimited
+    seed: Optional[int] = None
+
+
+def parse_latency(spec: str):
+    kind, _, params = spec.partition(":")
+    vals = [float(v) for v in params.split(",") if v.strip()] if params else []
+    if kind == "fixed":
+        value = vals[0] if vals else 0.0
+        return lambda rng: value
+    if kind == "uniform":
+        lo, hi = vals
+        return lambda rng: rng.uniform(lo, hi)
+    if kind == "lognormal":
+        import math
+        median, sigma = vals
+        mu = math.log(max(median, 1e-6))
+        return lambda rng: rng.lognormvariate(mu, sigma)
+    raise ValueError(f"unknown latency spec: {spec}")
+
+
+def _render_png(size: Tuple[int, int], rng: random.Random) -> bytes:
+    w, h = size
+    img = Image.new("RGB", size, tuple(rng.randint(150, 240) for _ in range(3)))
+    d = ImageDraw.Draw(img)
+    # Rough head-and-shoulders silhouette so post-processing has structure to work on
+    d.ellipse((w * 0.35, h * 0.18, w * 0.65, h * 0.52), fill=(224, 190, 160))
+    d.rectangle((w * 0.2, h * 0.55, w * 0.8, h), fill=tuple(rng.randint(20, 120) for _ in range(3)))
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def make_handler(cfg: FakeConfig):
+    rng = random.Random(cfg.seed)
+    rng_lock = threading.Lock()
+    sample_latency = parse_latency(cfg.latency)
+    # Pre-render a few images; encoding one per request would dominate a busy run
+    images = [base64.b64encode(_render_png(cfg.image_size, rng)).decode("ascii") for _ in range(4)]
+    windows = {}  # api key -> deque of request times in the last minute
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            raw = self.rfile.read(length)
+            with rng_lock:
+                delay = max(0.0, sample_latency(rng))
+                roll = rng.random()
+                img = rng.choice(images)
+            received = getattr(self.server, "received_bytes", None)
+            if received is not None:
+                received.append(length)
+            key = self.headers.get("X-goog-api-key", "")
+            by_key = getattr(self.server, "calls_by_key", None)
+            if by_key is not None:
+                by_key[key] = by_key.get(key, 0) + 1
+            if cfg.rpm > 0:
+                now = time.monotonic()
+                with rng_lock:
+                    window = windows.setdefault(key, deque())
+                    while window and now - window[0] >= 60:
+                        window.popleft()
+                    over = len(window) >= cfg.rpm
+                    if not over:
+                        window.append(now)
+                    wait = 60 - (now - window[0]) if over else 0
+                if over:
+                    return self._send(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED", "details": [
+                        {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{int(wait) + 1}s"},
+                    ]}}, {"Retry-After": str(int(wait) + 1)})
+            if cfg.upload_mbps > 0:
+                delay += length * 8 / (cfg.upload_mbps * 1_000_000)
+            time.sleep(delay)
+            is_full = b'"systemInstruction"' in raw or b'"generationConfig"' in raw
+            if roll < cfg.error_rate:
+                status = 429 if roll < cfg.error_rate / 2 else 500
+                return self._send(status, {"error": {"code": status, "message": "fake upstream error"}})
+            if is_full and roll < cfg.error_rate + cfg.bad_request_rate:
+                return self._send(400, {"error": {"code": 400, "status": "INVALID_ARGUMENT"}})
+            self._send(200, {
+                "candidates": [{"content": {"role": "model", "parts": [
+                    {"inlineData": {"mimeType": "image/png", "data": img}},
+                ]}}],
+                "usageMetadata": {
+                    "promptTokenCount": 258 + length // 4096,
+                    "candidatesTokenCount": 1290,
+                    "totalTokenCount": 1548 + length // 4096,
+                },
+            })
+
+        def _send(self, status: int, obj, headers=None) -> None:
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start(cfg: FakeConfig, host: str = "127.0.0.1", port: int = 0):
+    """Start the stand-in on a background thread; returns (endpoint_url, server)."""
+    server = ThreadingHTTPServer((host, port), make_handler(cfg))
+    server.daemon_threads = True
+    server.received_bytes = []
+    server.calls_by_key = {}
+    threading.Thread(target=server.serve_forever, name="fake-gemini", daemon=True).start()
+    return f"http://{host}:{server.server_port}/v1beta/models/fake:generateContent", server
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9010)
+    ap.add_argument("--latency", default="fixed:0")
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--bad-request-rate", type=float, default=0.0)
+    ap.add_argument("--upload-mbps", type=float, default=0.0, help="simulated upload bandwidth (0 = unlimited)")
+    ap.add_argument("--rpm", type=float, default=0.0, help="requests per minute per API key (0 = unlimited)")
+    ap.add_argument("--seed", type=int)
+    args = ap.parse_args(argv)
+    cfg = FakeConfig(latency=args.latency, error_rate=args.error_rate,
+                     bad_request_rate=args.bad_request_rate, upload_mbps=args.upload_mbps, rpm=args.rpm,
+                     seed=args.seed)
+    url, server = start(cfg, args.host, args.port)
+    print(f"fake Gemini listening: GEMINI_ENDPOINT={url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
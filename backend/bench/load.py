@@ -0,0 +1,154 @@
+"""Offline macro load test of /api/generate and /api/composite.
+
+Starts the local Gemini stand-in and the API (uvicorn, in-process), then
+drives each endpoint at several concurrency levels and reports throughput
+and p50/p95/p99 latency.
+
+Usage (from backend/):
+    python bench/load.py [--concurrency 1,4,16] [--requests 40] [--latency lognormal:0.5,0.3]
+                         [--error-rate 0] [--themes passport,meme] [--cpu-pool 0] [--fail-on-errors]
+                         [--json out.json] [--baseline base.json]
+
+``--cpu-pool N`` runs the image stages on an N-process pool
+(``CPU_POOL_WORKERS``), so every stage result has to survive the round trip
+through the worker. ``--fail-on-errors`` exits 1 when any request failed; a
+short run with both is the smoke test for the pool path.
+"""
+
+import argparse
+import base64
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import common
+import corpus
+import fake_gemini
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_api(endpoint: str, outputs_dir: str, extra_env=None) -> str:
+    """Import server with the stand-in endpoint and serve it on a background thread."""
+    os.environ["GEMINI_ENDPOINT"] = endpoint
+    os.environ.setdefault("GEMINI_API_KEY", "offline-bench")
+    os.environ["OUTPUTS_DIR"] = outputs_dir
+    # One client drives all traffic here; per-client limits would cap the benchmark
+    os.environ.setdefault("RATE_LIMIT_GENERATE_PER_MIN", "0")
+    os.environ.setdefault("RATE_LIMIT_COMPOSITE_PER_MIN", "0")
+    # The detector misses some drawn corpus faces; report those as warnings instead of refusing them
+    os.environ.setdefault("PREFLIGHT_MODE", "warn")
+    os.environ.update(extra_env or {})
+    import uvicorn
+    import server
+
+    port = _free_port()
+    config = uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning")
+    srv = uvicorn.Server(config)
+    threading.Thread(target=srv.run, name="api-server", daemon=True).start()
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base}/health", timeout=1).ok:
+                return base
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError("API server did not start")
+
+
+def drive(url: str, payloads, concurrency: int, total: int, timeout: float = 300.0):
+    """POST payloads round-robin with ``concurrency`` workers; returns (latencies, errors, wall)."""
+    local = threading.local()
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(i: int):
+        nonlocal errors
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        t0 = time.perf_counter()
+        try:
+            ok = session.post(url, json=payloads[i % len(payloads)], timeout=timeout).status_code == 200
+        except requests.RequestException:
+            ok = False
+        dt = time.perf_counter() - t0
+        with lock:
+            if ok:
+                latencies.append(dt)
+            else:
+                errors += 1
+
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    return latencies, errors, time.perf_counter() - t_start
+
+
+def build_payloads(themes, sizes):
+    entries = corpus.build(sizes=sizes, subjects=(1,))
+    images = [(base64.b64encode(e["bytes"]).decode("ascii"), e["mime"]) for e in entries]
+    generate = [
+        {"theme": theme, "image": b64, "mime_type": mime, "options": {"shots": 1}}
+        for theme in themes for b64, mime in images
+    ]
+    composite = [
+        {"user_image": images[i][0], "user_mime_type": images[i][1],
+         "ref_image": images[-1 - i][0], "ref_mime_type": images[-1 - i][1]}
+        for i in range(len(images))
+    ]
+    return generate, composite
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--concurrency", default="1,4,16")
+    ap.add_argument("--requests", type=int, default=40, help="requests per endpoint and concurrency level")
+    ap.add_argument("--latency", default="lognormal:0.5,0.3", help="stand-in latency distribution")
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--bad-request-rate", type=float, default=0.0)
+    ap.add_argument("--themes", default="passport,meme")
+    ap.add_argument("--sizes", default="vga,2mp")
+    ap.add_argument("--endpoints", default="generate,composite")
+    ap.add_argument("--cpu-pool", type=int, default=0, help="CPU_POOL_WORKERS for the API (0 = inline)")
+    ap.add_argument("--fail-on-errors", action="store_true", help="exit 1 when any request failed")
+    common.add_baseline_args(ap)
+    args = ap.parse_args(argv)
+
+    endpoint, _ = fake_gemini.start(fake_gemini.FakeConfig(
+        latency=args.latency, error_rate=args.error_rate, bad_request_rate=args.bad_request_rate, seed=1,
+    ))
+    outputs_dir = tempfile.mkdtemp(prefix="bench-outputs-")
+    base = start_api(endpoint, outputs_dir, {"CPU_POOL_WORKERS": str(args.cpu_pool)})
+
+    themes = [t.strip() for t in args.themes.split(",") if t.strip()]
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    gen_payloads, comp_payloads = build_payloads(themes, sizes)
+    targets = {"generate": gen_payloads, "composite": comp_payloads}
+
+    results = {}
+    for name in [e.strip() for e in args.endpoints.split(",") if e.strip()]:
+        for conc in [int(c) for c in args.concurrency.split(",") if c.strip()]:
+            latencies, errors, wall = drive(f"{base}/api/{name}", targets[name], conc, args.requests)
+            results[f"{name}/c{conc}"] = common.summarize(latencies, wall, errors)
+    code = common.finish(results, args)
+    failed = sum(r["errors"] for r in results.values())
+    if args.fail_on_errors and failed:
+        print(f"\nFAILED: {failed} request(s) failed")
+        return 1
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
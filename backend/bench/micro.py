@@ -0,0 +1,64 @@
+"""Micro-benchmarks of the CPU image stages on the synthetic corpus.
+
+Usage (from backend/):
+    python bench/micro.py [--sizes vga,2mp,12mp] [--repeat 5] [--json out.json] [--baseline base.json]
+
+Stages: ingest_input, detect_faces, preflight (on the working image),
+enforce_id_crop, resize_cover and PNG encoding. Each result row is
+"<stage>/<corpus entry>".
+"""
+
+import argparse
+import sys
+import time
+
+import common  # noqa: F401  (puts backend/ on sys.path)
+import corpus
+import imaging
+import preflight
+
+
+def _time(fn, repeat: int):
+    fn()  # warm-up
+    latencies = []
+    t_start = time.perf_counter()
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+    return latencies, time.perf_counter() - t_start
+
+
+def run(sizes, repeat: int):
+    results = {}
+    for entry in corpus.build(sizes=sizes, subjects=(1,)):
+        data, mime, name = entry["bytes"], entry["mime"], entry["name"]
+        decoded = imaging.decode_model_image(data).convert("RGB")
+        working = imaging.ingest_input(data, mime)[0]
+        tw, th = imaging.get_target_size("passport", "half")
+        stages = {
+            "ingest_input": lambda: imaging.ingest_input(data, mime),
+            "detect_faces": lambda: imaging.detect_faces(data),
+            "preflight": lambda: preflight.run(working, "passport"),
+            "enforce_id_crop": lambda: imaging.enforce_id_crop(decoded, tw, th, head_ratio=0.45),
+            "resize_cover": lambda: imaging.resize_cover(decoded.convert("RGBA"), 1024, 1280),
+            "encode_png": lambda: imaging.encode_png(decoded),
+        }
+        for stage, fn in stages.items():
+            latencies, wall = _time(fn, repeat)
+            results[f"{stage}/{name}"] = common.summarize(latencies, wall)
+    return results
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default=",".join(corpus.DEFAULT_SIZES))
+    ap.add_argument("--repeat", type=int, default=5)
+    common.add_baseline_args(ap)
+    args = ap.parse_args(argv)
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    return common.finish(run(sizes, max(1, args.repeat)), args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
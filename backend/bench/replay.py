@@ -0,0 +1,164 @@
+"""Deterministic replay of a captured traffic trace (see capture.py).
+
+Re-drives each captured generate/composite request against a running API at
+the original pacing, or faster with ``--speed``. Each request uses a
+stand-in image with the captured dimensions, format and face count. Stand-in
+images are cached per shape, so a replay is reproducible run to run.
+
+Usage (from backend/):
+    python bench/replay.py CAPTURE.jsonl [more.jsonl ...] --target http://127.0.0.1:8000
+                           [--speed 2] [--multiply 3] [--from TS] [--until TS] [--max-inflight 256]
+
+To reproduce an incident offline, start the API against ``fake_gemini.py``
+and replay the incident's window with --from/--until.
+"""
+
+import argparse
+import base64
+import glob
+import json
+import sys
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import requests
+
+import common
+import corpus
+
+_FORMATS = {"JPEG": ("JPEG", "image/jpeg"), "PNG": ("PNG", "image/png")}
+
+
+def load_trace(paths: List[str], since: float = 0.0, until: float = float("inf")) -> List[Dict]:
+    records = []
+    for pattern in paths:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    rec = json.loads(line)
+                    if since <= rec.get("ts", 0) <= until and rec.get("endpoint") in {"generate", "composite"}:
+                        records.append(rec)
+    records.sort(key=lambda r: r["ts"])
+    return records
+
+
+class StandIns:
+    """Cache of synthetic images keyed by (width, height, format, faces)."""
+
+    def __init__(self):
+        self._cache: Dict[Tuple, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, image: Dict, faces: int = 1) -> Tuple[str, str]:
+        w, h = int(image.get("width") or 1024), int(image.get("height") or 1280)
+        fmt, mime = _FORMATS.get(image.get("format") or "JPEG", _FORMATS["JPEG"])
+        key = (w, h, fmt, faces)
+        with self._lock:
+            hit = self._cache.get(key)
+        if hit is None:
+            seed = zlib.crc32(repr(key).encode()) & 0xFFFF
+            data, mime = corpus.encode(corpus.make_image((w, h), subjects=max(1, faces), seed=seed), fmt)
+            hit = (base64.b64encode(data).decode("ascii"), mime)
+            with self._lock:
+                self._cache[key] = hit
+        return hit
+
+
+def build_request(rec: Dict, stand_ins: StandIns) -> Tuple[str, Dict]:
+    images = {img.get("role"): img for img in rec.get("images", [])}
+    if rec["endpoint"] == "generate":
+        b64, mime = stand_ins.get(images.get("image", {}), faces=max(1, min(3, rec.get("faces") or 1)))
+        body = {"theme": rec.get("theme", "resume"), "image": b64, "mime_type": mime}
+        if rec.get("options"):
+            body["options"] = rec["options"]
+        return "/api/generate", body
+    user_b64, user_mime = stand_ins.get(images.get("user", {}))
+    ref_b64, ref_mime = stand_ins.get(images.get("ref", {}))
+    body = {"user_image": user_b64, "user_mime_type": user_mime, "ref_image": ref_b64, "ref_mime_type": ref_mime}
+    if rec.get("hint_len"):
+        body["hint"] = "x" * int(rec["hint_len"])
+    return "/api/composite", body
+
+
+def replay(records: List[Dict], target: str, speed: float, multiply: int, max_inflight: int, timeout: float):
+    stand_ins = StandIns()
+    # Render stand-ins up front so image synthesis does not distort pacing
+    prepared = [(rec, build_request(rec, stand_ins)) for rec in records]
+    t0_trace = records[0]["ts"]
+    results = defaultdict(list)  # key -> [latency]
+    errors: Counter = Counter()  # key -> non-200 count
+    statuses: Counter = Counter()
+    lock = threading.Lock()
+    local = threading.local()
+
+    def send(rec: Dict, path: str, body: Dict) -> None:
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        key = f"{rec['endpoint']}/{rec.get('theme', '-')}"
+        t0 = time.perf_counter()
+        try:
+            status = session.post(target + path, json=body, timeout=timeout).status_code
+        except requests.RequestException:
+            status = "error"
+        dt = time.perf_counter() - t0
+        with lock:
+            statuses[(rec["endpoint"], status)] += 1
+            if status == 200:
+                results[key].append(dt)
+            else:
+                errors[key] += 1
+
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        for rec, (path, body) in prepared:
+            due = (rec["ts"] - t0_trace) / speed
+            wait = due - (time.perf_counter() - t_start)
+            if wait > 0:
+                time.sleep(wait)
+            for _ in range(multiply):
+                pool.submit(send, rec, path, body)
+    wall = time.perf_counter() - t_start
+    return results, errors, statuses, wall
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("captures", nargs="+", help="capture.jsonl files (globs allowed)")
+    ap.add_argument("--target", required=True, help="API base URL, e.g. http://127.0.0.1:8000")
+    ap.add_argument("--speed", type=float, default=1.0, help="time compression factor (2 = twice as fast)")
+    ap.add_argument("--multiply", type=int, default=1, help="send each captured request N times")
+    ap.add_argument("--from", dest="since", type=float, default=0.0, help="first capture ts to replay")
+    ap.add_argument("--until", type=float, default=float("inf"), help="last capture ts to replay")
+    ap.add_argument("--max-inflight", type=int, default=256)
+    ap.add_argument("--timeout", type=float, default=300.0)
+    common.add_baseline_args(ap)
+    args = ap.parse_args(argv)
+
+    records = load_trace(args.captures, args.since, args.until)
+    if not records:
+        print("no captured requests in range", file=sys.stderr)
+        return 2
+    span = records[-1]["ts"] - records[0]["ts"]
+    print(f"replaying {len(records)} requests x{args.multiply} over {span / args.speed:.1f}s (speed {args.speed}x)")
+    latencies, errors, statuses, wall = replay(
+        records, args.target.rstrip("/"), max(args.speed, 1e-6), max(1, args.multiply), args.max_inflight, args.timeout
+    )
+
+    results = {
+        key: common.summarize(latencies.get(key, []), wall, errors.get(key, 0))
+        for key in sorted(set(latencies) | set(errors))
+    }
+    print("status mix: " + ", ".join(f"{e} {s}: {n}" for (e, s), n in sorted(statuses.items(), key=str)))
+    return common.finish(results, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""Cancel generations whose client has gone away.
+
+A browser that closes or times out partway through a 3-shot or
+multi-subject request does not stop the handler thread. Left alone, the
+handler keeps calling the model, post-processing and writing files
+nobody will fetch. Every ``RequestTrace`` therefore carries a
+``CancelToken``. While the request runs, ``watch`` polls the connection
+and cancels the token once the client disconnects. The work then stops
+at the next checkpoint:
+
+- waiting for a bulkhead slot or memory: the wait is abandoned at once
+- entering any traced stage (``RequestTrace.stage``), which covers every
+  upstream call, CPU stage and file write
+- a CPU-pool job still queued behind others is withdrawn from the pool
+
+An upstream call already in flight runs to completion; the calls after it
+are not made. Requests with an ``Idempotency-Key`` are never cancelled,
+because a retry of the same key will collect their result.
+``CANCEL_ON_DISCONNECT=0`` turns this off.
+"""
+
+import asyncio
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+ENABLED = os.getenv("CANCEL_ON_DISCONNECT", "1").lower() not in {"0", "false", "no"}
+try:
+    POLL_SECONDS = max(0.05, float(os.getenv("CANCEL_POLL_SECONDS", "0.5")))
+except Exception:
+    POLL_SECONDS = 0.5
+
+
+class Cancelled(Exception):
+    def __init__(self, stage: str):
+        super().__init__(f"cancelled before {stage}")
+        self.stage = stage
+
+
+class CancelToken:
+    __slots__ = ("_event", "_callbacks")
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        """Called on the event loop; request threads only read the flag."""
+        if self._event.is_set():
+            return
+        self._event.set()
+        callbacks, self._callbacks = self._callbacks, []
+        for cb in callbacks:
+            cb()
+
+    def check(self, stage: str) -> None:
+        if self._event.is_set():
+            raise Cancelled(stage)
+
+    def on_cancel(self, cb: Callable[[], None]) -> Callable[[], None]:
+        """Run ``cb`` when cancelled (at once if already); returns a function that unregisters it."""
+        if self._event.is_set():
+            cb()
+            return lambda: None
+        self._callbacks.append(cb)
+
+        def remove() -> None:
+            try:
+                self._callbacks.remove(cb)
+            except ValueError:
+                pass
+
+        return remove
+
+
+async def _poll(request, token: CancelToken) -> None:
+    while not token.cancelled:
+        if await request.is_disconnected():
+            token.cancel()
+            return
+        await asyncio.sleep(POLL_SECONDS)
+
+
+def watch(request, token: CancelToken) -> Optional[asyncio.Task]:
+    """Cancel ``token`` when the client disconnects; None when this request must run to completion."""
+    if not ENABLED or request.headers.get("idempotency-key"):
+        return None
+    return asyncio.ensure_future(_poll(request, token))
+
+
+_local = threading.local()
+
+
+@contextmanager
+def bound(token: CancelToken):
+    """Make ``token`` the current thread's token, for code that has no trace (the CPU pool)."""
+    previous = getattr(_local, "token", None)
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = previous
+
+
+def current() -> Optional[CancelToken]:
+    return getattr(_local, "token", None)
@@ -0,0 +1,83 @@
+"""Opt-in production traffic capture for replay.
+
+With ``TRAFFIC_CAPTURE_DIR`` set, every generate/composite request appends
+one JSON line to ``<dir>/capture.jsonl`` (size-rotated). The line holds the
+request shape and timing: endpoint, theme, options, status, duration and
+stage times. Images are never stored. Each image is reduced to its format,
+dimensions, byte size and a truncated SHA-256, so identical uploads can be
+recognised without keeping any pixels. Free-text fields (composite hints,
+option strings) are truncated. ``bench/replay.py`` re-drives these traces.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from io import BytesIO
+from typing import Any, Dict, Optional
+
+from PIL import Image
+
+import jsonlog
+
+TRAFFIC_CAPTURE_DIR = os.getenv("TRAFFIC_CAPTURE_DIR", "")
+ENABLED = bool(TRAFFIC_CAPTURE_DIR)
+# Longest option string kept verbatim
+MAX_TEXT = 64
+
+_log: Optional[jsonlog.JsonlLog] = None
+_log_lock = threading.Lock()
+
+
+def _get_log() -> jsonlog.JsonlLog:
+    global _log
+    if _log is None:
+        # Concurrent first writes must not open two writers on one file
+        with _log_lock:
+            if _log is None:
+                _log = jsonlog.open_log(os.path.join(TRAFFIC_CAPTURE_DIR, "capture.jsonl"))
+    return _log
+
+
+def describe_image(data: bytes, role: str) -> Dict[str, Any]:
+    """Shape of an uploaded image: header-only parse, no pixel decode."""
+    info: Dict[str, Any] = {
+        "role": role,
+        "bytes": len(data),
+        "sha256": hashlib.sha256(data).hexdigest()[:16],
+    }
+    try:
+        with Image.open(BytesIO(data)) as img:
+            info["format"] = img.format
+            info["width"], info["height"] = img.size
+    except Exception:
+        info["format"] = None
+    return info
+
+
+def _redact(value: Any) -> Any:
+    if isinstance(value, str):
+        return value if len(value) <= MAX_TEXT else value[:MAX_TEXT] + "…"
+    if isinstance(value, dict):
+        return {str(k): _redact(v) for k, v in list(value.items())[:32]}
+    if isinstance(value, (list, tuple)):
+        return [_redact(v) for v in list(value)[:32]]
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    return str(value)[:MAX_TEXT]
+
+
+def record(trace, status: int, shape: Dict[str, Any]) -> None:
+    """Append one capture line for a finished request (no-op when disabled)."""
+    if not ENABLED:
+        return
+    rec = {
+        "ts": round(time.time() - trace.elapsed(), 4),
+        "endpoint": trace.endpoint,
+        "status": status,
+        "duration_s": round(trace.elapsed(), 4),
+        "stages_s": {k: round(v, 4) for k, v in trace.durations.items()},
+    }
+    rec.update(_redact(shape))
+    rec.update(trace.info)
+    _get_log().write(rec)
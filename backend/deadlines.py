@@ -0,0 +1,103 @@
+"""End-to-end request deadlines.
+
+Every generate/composite request gets a deadline when it arrives. The
+client sets it with ``X-Request-Timeout: <seconds>`` (capped at
+``DEADLINE_MAX_SECONDS``). Without the header, the default is
+``DEADLINE_SECONDS``, with per-theme or per-endpoint overrides from
+``DEADLINE_<KEY>_SECONDS`` (ID-photo themes and batches ship their own).
+The deadline is stored on the ``RequestTrace`` and applied at each point
+where time is spent:
+
+- admission: a queue wait is bounded by the time left minus one expected
+  upstream call; a request that cannot get that far is refused at once
+- upstream: each call's timeout is the time left (at most
+  ``UPSTREAM_TIMEOUT_SECONDS``), and a call is not started when less time
+  remains than a typical call takes. This applies to the 400 fallback too.
+- the variant and subject loops: once one image is ready, running out of
+  time returns what is done in place of failing
+- every traced stage: past the deadline, no further stage starts
+
+"A typical call" is a moving average of recent successful upstream call
+times, seeded with ``DEADLINE_UPSTREAM_ESTIMATE_SECONDS``. Running out of
+time raises ``Exceeded``, which the server turns into a 504.
+"""
+
+import os
+import threading
+import time
+from typing import Mapping, Optional
+
+HEADER = "x-request-timeout"
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return max(0.0, float(os.getenv(name, str(default))))
+    except Exception:
+        return default
+
+
+DEFAULT_SECONDS = _env_float("DEADLINE_SECONDS", 90.0)
+MAX_SECONDS = _env_float("DEADLINE_MAX_SECONDS", 600.0)
+UPSTREAM_TIMEOUT_SECONDS = _env_float("UPSTREAM_TIMEOUT_SECONDS", 60.0)
+# Regulated themes render one tightly specified shot; batches run several composites
+_DEFAULTS = {"passport": 60.0, "resume": 60.0, "composite_batch": 300.0}
+
+
+class Exceeded(Exception):
+    def __init__(self, stage: str):
+        super().__init__(f"deadline exceeded before {stage}")
+        self.stage = stage
+
+
+class _Estimate:
+    """Moving average of successful upstream call durations."""
+
+    def __init__(self, seed: float, alpha: float = 0.2):
+        self.value = seed
+        self.alpha = alpha
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.value += self.alpha * (seconds - self.value)
+
+
+UPSTREAM = _Estimate(_env_float("DEADLINE_UPSTREAM_ESTIMATE_SECONDS", 10.0))
+
+
+def budget(headers: Mapping[str, str], key: str) -> float:
+    """Seconds the request may take: the client's header, else the theme/endpoint default."""
+    raw = headers.get(HEADER)
+    if raw:
+        try:
+            return min(MAX_SECONDS, max(0.0, float(raw)))
+        except ValueError:
+            pass
+    return _env_float(f"DEADLINE_{key.upper()}_SECONDS", _DEFAULTS.get(key, DEFAULT_SECONDS))
+
+
+def start(trace, headers: Mapping[str, str]) -> None:
+    """Set the trace's deadline, counted from its arrival."""
+    trace.deadline = trace.started + budget(headers, trace.theme or trace.endpoint)
+
+
+def remaining(trace) -> float:
+    if trace.deadline is None:
+        return float("inf")
+    return trace.deadline - time.perf_counter()
+
+
+def queue_wait(trace) -> Optional[float]:
+    """Longest admission wait that still leaves time for one upstream call; None when unbounded."""
+    if trace.deadline is None:
+        return None
+    return remaining(trace) - UPSTREAM.value
+
+
+def upstream_timeout(trace) -> float:
+    """Timeout for the next upstream call; raises Exceeded when a typical call would not fit."""
+    left = remaining(trace)
+    if left < min(UPSTREAM.value, UPSTREAM_TIMEOUT_SECONDS):
+        raise Exceeded("upstream")
+    return min(UPSTREAM_TIMEOUT_SECONDS, left)
@@ -0,0 +1,236 @@
+"""Face detector backends for the cropping and identity stages.
+
+Every backend takes a BGR image (as decoded by ``cv2.imdecode``) and returns
+``FaceBox`` tuples in that image's pixel coordinates, largest face first.
+Backends that can locate eyes fill in ``eyes`` so ``enforce_id_crop`` can
+place the real eye line instead of estimating it from the box.
+
+Select the backend with ``FACE_DETECTOR``:
+- ``haar``: OpenCV Haar cascade (always available with OpenCV)
+- ``yunet``: OpenCV DNN YuNet detector (CPU, needs the ONNX model file)
+- ``auto`` (default): YuNet when its model is present, otherwise Haar
+"""
+
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import lazy
+import metrics
+
+# Imported on first use (see lazy.py)
+np = lazy.module("numpy")
+cv2 = lazy.module("cv2")
+
+
+def cv2_available() -> bool:
+    return lazy.available("numpy", "cv2")
+
+
+logger = logging.getLogger("ai_portrait_studio")
+
+FACE_DETECTOR = os.getenv("FACE_DETECTOR", "auto").lower()
+YUNET_MODEL_PATH = os.getenv(
+    "YUNET_MODEL_PATH",
+    os.path.join(os.path.dirname(__file__), "models", "face_detection_yunet_2023mar.onnx"),
+)
+# Detection runs on a downscaled copy; large photos only slow detection down
+# and push faces outside the detectors' preferred scale range.
+try:
+    DETECT_MAX_SIDE = max(160, int(os.getenv("FACE_DETECT_MAX_SIDE", "1024")))
+except Exception:
+    DETECT_MAX_SIDE = 1024
+
+
+Point = Tuple[float, float]
+
+
+class FaceBox(NamedTuple):
+    x: int
+    y: int
+    w: int
+    h: int
+    score: float = 1.0
+    # (right_eye, left_eye) in image coordinates, when the backend provides them
+    eyes: Optional[Tuple[Point, Point]] = None
+
+    @property
+    def eye_line_y(self) -> float:
+        """Y coordinate of the eye line; estimated from the box without landmarks."""
+        if self.eyes is not None:
+            return (self.eyes[0][1] + self.eyes[1][1]) / 2.0
+        return self.y + 0.38 * self.h
+
+
+def _downscale(img, max_side: int):
+    h, w = img.shape[:2]
+    longest = max(h, w)
+    if longest <= max_side:
+        return img, 1.0
+    scale = max_side / float(longest)
+    small = cv2.resize(img, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    return small, scale
+
+
+class FaceDetector:
+    """Base class; subclasses implement ``_detect`` on the downscaled image."""
+
+    name = "base"
+
+    def detect(self, img_bgr, min_size: int = 48) -> List[FaceBox]:
+        if img_bgr is None or img_bgr.size == 0:
+            return []
+        small, scale = _downscale(img_bgr, DETECT_MAX_SIDE)
+        min_small = max(8, int(min_size * scale))
+        faces = self._detect(small, min_small)
+        if scale != 1.0:
+            inv = 1.0 / scale
+            faces = [
+                FaceBox(
+                    int(f.x * inv), int(f.y * inv), int(f.w * inv), int(f.h * inv), f.score,
+                    None if f.eyes is None else tuple((px * inv, py * inv) for px, py in f.eyes),
+                )
+                for f in faces
+            ]
+        return sorted(faces, key=lambda f: f.w * f.h, reverse=True)
+
+    def _detect(self, img_bgr, min_size: int) -> List[FaceBox]:
+        raise NotImplementedError
+
+
+class HaarDetector(FaceDetector):
+    name = "haar"
+
+    def __init__(self, scale_factor: float = 1.1, min_neighbors: int = 5):
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self._cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+    def _detect(self, img_bgr, min_size: int) -> List[FaceBox]:
+        gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+        faces = self._cascade.detectMultiScale(
+            gray, scaleFactor=self.scale_factor, minNeighbors=self.min_neighbors, minSize=(min_size, min_size)
+        )
+        return [FaceBox(int(x), int(y), int(w), int(h)) for (x, y, w, h) in faces]
+
+
+class YuNetDetector(FaceDetector):
+    name = "yunet"
+
+    def __init__(self, model_path: str = YUNET_MODEL_PATH, score_threshold: float = 0.7, nms_threshold: float = 0.3):
+        self._net = cv2.FaceDetectorYN.create(model_path, "", (320, 320), score_threshold, nms_threshold, 50)
+        self._input_size = (320, 320)
+
+    def _detect(self, img_bgr, min_size: int) -> List[FaceBox]:
+        h, w = img_bgr.shape[:2]
+        if (w, h) != self._input_size:
+            self._net.setInputSize((w, h))
+            self._input_size = (w, h)
+        _, rows = self._net.detect(img_bgr)
+        if rows is None:
+            return []
+        out: List[FaceBox] = []
+        # row: x, y, w, h, right eye (x, y), left eye (x, y), nose, mouth corners, score
+        for r in rows:
+            fw, fh = int(r[2]), int(r[3])
+            if min(fw, fh) < min_size:
+                continue
+            out.append(FaceBox(
+                int(r[0]), int(r[1]), fw, fh, float(r[14]),
+                ((float(r[4]), float(r[5])), (float(r[6]), float(r[7]))),
+            ))
+        return out
+
+
+BACKENDS = {"haar": HaarDetector, "yunet": YuNetDetector}
+# Looser cascade settings the identity crop has always used: it finds more
+# small and low-contrast faces, at the cost of more false positives.
+HAAR_SENSITIVE = {"scale_factor": 1.08, "min_neighbors": 4}
+
+
+def yunet_available(model_path: str = YUNET_MODEL_PATH) -> bool:
+    return cv2_available() and hasattr(cv2, "FaceDetectorYN") and os.path.isfile(model_path)
+
+
+def resolve_backend(name: str = FACE_DETECTOR) -> Optional[str]:
+    """Map a configured backend name to one that can run here (None without OpenCV)."""
+    if not cv2_available():
+        return None
+    if name == "auto":
+        return "yunet" if yunet_available() else "haar"
+    if name == "yunet" and not yunet_available():
+        logger.warning("FACE_DETECTOR=yunet but model not found at %s; using haar", YUNET_MODEL_PATH)
+        return "haar"
+    if name not in BACKENDS:
+        logger.warning("Unknown FACE_DETECTOR=%s; using haar", name)
+        return "haar"
+    return name
+
+
+# Detector objects keep per-instance state (YuNet input size), so each call
+# checks one out for its own use. Idle instances sit in a process-wide free
+# list: the ones warm-up builds (``prewarm``) serve whichever request thread
+# comes first, instead of only the thread that built them.
+_free: Dict[str, List[FaceDetector]] = {}
+_free_lock = threading.Lock()
+
+
+def _key(name: Optional[str], sensitive: bool) -> Optional[str]:
+    backend = resolve_backend(name or FACE_DETECTOR)
+    if backend is None:
+        return None
+    return "haar-sensitive" if sensitive and backend == "haar" else backend
+
+
+def _build(key: str) -> FaceDetector:
+    det = HaarDetector(**HAAR_SENSITIVE) if key == "haar-sensitive" else BACKENDS[key]()
+    metrics.DETECTOR_BUILDS.inc(detector=key)
+    return det
+
+
+@contextmanager
+def checkout(name: Optional[str] = None, sensitive: bool = False) -> Iterator[Optional[FaceDetector]]:
+    """An idle detector instance (built when none is free), returned on exit; ``sensitive`` selects HAAR_SENSITIVE on Haar."""
+    key = _key(name, sensitive)
+    if key is None:
+        yield None
+        return
+    with _free_lock:
+        idle = _free.get(key)
+        det = idle.pop() if idle else None
+    if det is None:
+        det = _build(key)
+    try:
+        yield det
+    finally:
+        with _free_lock:
+            _free.setdefault(key, []).append(det)
+
+
+def prewarm(count: int, name: Optional[str] = None, sensitive: bool = False) -> int:
+    """Build idle instances until ``count`` are free; returns how many were built."""
+    key = _key(name, sensitive)
+    if key is None:
+        return 0
+    with _free_lock:
+        missing = count - len(_free.get(key, ()))
+    built = [_build(key) for _ in range(max(0, missing))]
+    with _free_lock:
+        _free.setdefault(key, []).extend(built)
+    return len(built)
+
+
+def detect_faces_bgr(img_bgr, min_size: int = 48, sensitive: bool = False) -> List[FaceBox]:
+    """Detect faces with the configured backend; empty list without OpenCV or on failure."""
+    if img_bgr is None:
+        return []
+    with checkout(sensitive=sensitive) as det:
+        if det is None:
+            return []
+        try:
+            return det.detect(img_bgr, min_size=min_size)
+        except Exception as e:
+            logger.warning("face detection failed (%s): %s", det.name, e)
+            return []
@@ -0,0 +1,86 @@
+"""Append-only generation event log for capacity planning.
+
+Every generate/composite request, including those refused before running,
+appends one JSON line to ``<EVENTS_DIR>/events.jsonl`` through the
+non-blocking, size-rotated writer in ``jsonlog``. The request thread only
+enqueues a dict. A line holds:
+
+- ``ts``, ``endpoint``, ``theme``, ``status``, ``duration_s``, ``stages_s``
+- ``composition``, ``shots`` (requested) and ``subjects`` (faces found), when known
+- ``inputs`` and ``outputs``: byte size, format and pixel size of each image
+- ``upstream``: the HTTP status of every upstream call, in order
+  (``error`` means a transport failure)
+- ``retries``: extra upstream calls by reason (``400_fallback``,
+  ``duplicate_variant``)
+- ``tokens``: summed ``usageMetadata`` counts (prompt, candidates, total)
+- ``partial``: true when the deadline cut the variants or subjects short
+
+Unlike ``capture.py``, nothing here identifies an upload: there are no
+hashes and no free text. ``bench/events_report.py`` aggregates these
+logs into per-theme latency and cost reports. ``EVENTS_LOG=0`` turns it
+off.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import ingest
+import jsonlog
+
+ENABLED = os.getenv("EVENTS_LOG", "1").lower() not in {"0", "false", "no"}
+EVENTS_DIR = os.getenv("EVENTS_DIR", os.path.join(os.path.dirname(__file__), "data", "events"))
+try:
+    MAX_MB = max(1, int(os.getenv("EVENTS_MAX_MB", "64")))
+except Exception:
+    MAX_MB = 64
+try:
+    BACKUPS = max(1, int(os.getenv("EVENTS_BACKUPS", "20")))
+except Exception:
+    BACKUPS = 20
+
+# trace.info keys copied into the event as-is
+_FIELDS = ("composition", "shots", "subjects", "inputs", "outputs", "upstream", "retries", "tokens", "batch_index", "partial",
+           "render", "local_failed", "preflight", "outcome")
+
+_log: Optional[jsonlog.JsonlLog] = None
+_log_lock = threading.Lock()
+
+
+def _get_log() -> jsonlog.JsonlLog:
+    global _log
+    if _log is None:
+        # Concurrent first writes must not open two writers on one file
+        with _log_lock:
+            if _log is None:
+                _log = jsonlog.open_log(os.path.join(EVENTS_DIR, "events.jsonl"), MAX_MB * 1024 * 1024, BACKUPS)
+    return _log
+
+
+def image_info(data: bytes, header: Optional[ingest.ImageHeader] = None, role: Optional[str] = None) -> Dict[str, Any]:
+    """Byte size, format and pixel size of one image; probes the header when not given."""
+    if header is None:
+        header = ingest.probe(data)
+    info: Dict[str, Any] = {"role": role} if role else {}
+    info.update(bytes=len(data), format=header.format if header else None,
+                width=header.width if header else None, height=header.height if header else None)
+    return info
+
+
+def record(trace, status: int) -> None:
+    """Append the event for a finished (or refused) request; no-op when disabled."""
+    if not ENABLED:
+        return
+    rec: Dict[str, Any] = {
+        "ts": round(time.time() - trace.elapsed(), 4),
+        "endpoint": trace.endpoint,
+        "theme": trace.theme,
+        "status": status,
+        "duration_s": round(trace.elapsed(), 4),
+        "stages_s": {k: round(v, 4) for k, v in trace.durations.items()},
+    }
+    for key in _FIELDS:
+        if key in trace.info:
+            rec[key] = trace.info[key]
+    _get_log().write(rec)
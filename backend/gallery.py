@@ -0,0 +1,188 @@
+"""Gallery index over saved outputs (SQLite, WAL).
+
+Every file ``_save_output`` writes is recorded in one row: id, URL,
+endpoint, theme, composition, creation time, pixel size, byte size and
+format. Listing never touches the outputs directory. Pages are served by
+keyset pagination over ``(created_ms, id)``: the cursor is the last row's
+key, and the next page is ``WHERE (created_ms, id) < cursor ORDER BY
+created_ms DESC, id DESC LIMIT n``. That is one index range scan, so a
+page costs the same at row 10 or row 10 000 000. A second index leads
+with ``theme`` for the theme filter. Time ranges narrow the same scans.
+
+WAL mode lets readers run alongside the single writer. Inserts go through
+one connection under a lock with ``synchronous=NORMAL``, which needs no
+fsync per commit. Each thread opens its own read connection. When the
+index is empty at startup and the outputs directory is not,
+``backfill`` records the existing files once, using their mtimes.
+"""
+
+import base64
+import binascii
+import logging
+import os
+import sqlite3
+import threading
+import time
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+logger = logging.getLogger("ai_portrait_studio")
+
+GALLERY_DB = os.getenv("GALLERY_DB", os.path.join(os.path.dirname(__file__), "data", "gallery.sqlite3"))
+MAX_PAGE = 200
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS outputs (
+        id TEXT PRIMARY KEY,
+        created_ms INTEGER NOT NULL,
+        endpoint TEXT NOT NULL,
+        theme TEXT NOT NULL DEFAULT '',
+        composition TEXT,
+        width INTEGER,
+        height INTEGER,
+        bytes INTEGER NOT NULL,
+        format TEXT NOT NULL,
+        url TEXT NOT NULL
+    ) WITHOUT ROWID""",
+    "CREATE INDEX IF NOT EXISTS outputs_created ON outputs (created_ms, id)",
+    "CREATE INDEX IF NOT EXISTS outputs_theme_created ON outputs (theme, created_ms, id)",
+)
+_COLUMNS = ("id", "created_ms", "endpoint", "theme", "composition", "width", "height", "bytes", "format", "url")
+
+
+class BadCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_ms: int, oid: str) -> str:
+    return base64.urlsafe_b64encode(f"{created_ms}:{oid}".encode("ascii")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("ascii")
+        created, oid = raw.split(":", 1)
+        return int(created), oid
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise BadCursor("Invalid cursor")
+
+
+class GalleryIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self._write_lock = threading.Lock()
+        self._writer: Optional[sqlite3.Connection] = None
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _write_conn(self) -> sqlite3.Connection:
+        # Called with the write lock held
+        if self._writer is None:
+            self._writer = self._connect()
+            for stmt in _SCHEMA:
+                self._writer.execute(stmt)
+        return self._writer
+
+    def _read_conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            with self._write_lock:
+                self._write_conn()  # make sure the schema exists
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def add_many(self, rows: List[Tuple]) -> None:
+        with self._write_lock:
+            conn = self._write_conn()
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO outputs ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                    rows,
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def add(self, oid: str, url: str, data: bytes, endpoint: str, theme: str = "",
+            composition: Optional[str] = None, created: Optional[float] = None) -> None:
+        """Record one saved output; pixel size and format come from its header."""
+        width = height = None
+        fmt = os.path.splitext(url)[1].lstrip(".").upper() or "PNG"
+        try:
+            with Image.open(BytesIO(data)) as img:
+                width, height = img.size
+                fmt = img.format or fmt
+        except Exception:
+            pass
+        created_ms = int((time.time() if created is None else created) * 1000)
+        self.add_many([(oid, created_ms, endpoint, theme or "", composition, width, height, len(data), fmt, url)])
+
+    def list(self, theme: Optional[str] = None, since: Optional[float] = None, until: Optional[float] = None,
+             limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Newest first. Returns (items, next_cursor); next_cursor is None on the last page."""
+        limit = max(1, min(MAX_PAGE, limit))
+        where, args = [], []
+        if theme is not None:
+            where.append("theme = ?")
+            args.append(theme)
+        if since is not None:
+            where.append("created_ms >= ?")
+            args.append(int(since * 1000))
+        if until is not None:
+            where.append("created_ms < ?")
+            args.append(int(until * 1000))
+        if cursor:
+            where.append("(created_ms, id) < (?, ?)")
+            args.extend(decode_cursor(cursor))
+        sql = f"SELECT {', '.join(_COLUMNS)} FROM outputs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_ms DESC, id DESC LIMIT ?"
+        rows = self._read_conn().execute(sql, (*args, limit + 1)).fetchall()
+        items = [dict(zip(_COLUMNS, row)) for row in rows[:limit]]
+        for item in items:
+            item["created"] = item.pop("created_ms") / 1000.0
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_cursor(last[1], last[0])
+        return items, next_cursor
+
+    def count(self) -> int:
+        return self._read_conn().execute("SELECT COUNT(*) FROM outputs").fetchone()[0]
+
+    def backfill(self, outputs_dir: str, url_prefix: str = "/outputs/", batch: int = 1000) -> int:
+        """Index files already in ``outputs_dir`` when the index is empty; returns rows added."""
+        if not os.path.isdir(outputs_dir) or self._read_conn().execute("SELECT 1 FROM outputs LIMIT 1").fetchone():
+            return 0
+        added, rows = 0, []
+        with os.scandir(outputs_dir) as it:
+            for entry in it:
+                if not entry.is_file() or entry.name.startswith("."):
+                    continue
+                oid, ext = os.path.splitext(entry.name)
+                st = entry.stat()
+                rows.append((oid, int(st.st_mtime * 1000), "unknown", "", None, None, None, st.st_size,
+                             ext.lstrip(".").upper() or "PNG", url_prefix + entry.name))
+                if len(rows) >= batch:
+                    self.add_many(rows)
+                    added, rows = added + len(rows), []
+        if rows:
+            self.add_many(rows)
+            added += len(rows)
+        if added:
+            logger.info("gallery: backfilled %d existing outputs from %s", added, outputs_dir)
+        return added
+
+
+INDEX = GalleryIndex(GALLERY_DB)
@@ -0,0 +1,104 @@
+"""Extract the generated image from a Gemini ``generateContent`` response.
+
+A response is a few kilobytes of JSON around one multi-megabyte base64
+string (``candidates[].content.parts[].inlineData.data``). ``resp.json()``
+decodes the whole body to ``str``, builds the dict tree around a second
+copy of that string, and ``b64decode`` then makes the image bytes from it.
+``extract`` works on the raw body instead:
+
+- it locates the first ``"inlineData": {`` key, then its ``"data"`` string
+- ``binascii.a2b_base64`` decodes that slice of the body through a
+  ``memoryview``, so the base64 text is never copied
+- ``mimeType`` and the small ``usageMetadata`` object are read on their own
+
+The result is the image bytes the decoder opens directly. Any body the scan
+cannot vouch for goes through a full parse instead: orjson when installed,
+else ``json``. That covers escaped characters in the data, keys in an
+unexpected order, and a missing field. Both paths return the same values.
+"""
+
+import binascii
+import json
+import re
+from typing import Any, Dict, NamedTuple, Optional
+
+import lazy
+
+_INLINE = re.compile(rb'(?<!\\)"inlineData"\s*:\s*\{')
+_DATA = re.compile(rb'"data"\s*:\s*"')
+_MIME = re.compile(rb'"mimeType"\s*:\s*"([^"\\]{1,100})"')
+_USAGE = re.compile(rb'(?<!\\)"usageMetadata"\s*:\s*(?=\{)')
+# The data key sits right after mimeType in practice; bound the look-around so a miss stays cheap
+_WINDOW = 512
+
+
+class InlineImage(NamedTuple):
+    data: Optional[bytes]  # decoded image, None when the response holds none
+    mime: Optional[str]
+    usage: Optional[Dict[str, Any]]
+
+
+def _loads(body: bytes) -> Any:
+    if lazy.available("orjson"):
+        return lazy.module("orjson").loads(body)
+    return json.loads(body)
+
+
+def _usage(body: bytes) -> Optional[Dict[str, Any]]:
+    # usageMetadata follows the candidates; search from the end
+    m = None
+    for m in _USAGE.finditer(body, max(0, len(body) - 64 * 1024)):
+        pass
+    if m is None:
+        return None
+    try:
+        value, _ = json.JSONDecoder().raw_decode(body[m.end():m.end() + 8192].decode("utf-8", "replace"))
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def _scan(body: bytes) -> Optional[InlineImage]:
+    """Fast path; None when the body is not in the expected shape."""
+    obj = _INLINE.search(body)
+    if obj is None:
+        return None
+    data = _DATA.search(body, obj.end(), obj.end() + _WINDOW)
+    if data is None:
+        return None
+    start = data.end()
+    end = body.find(b'"', start)
+    if end < 0 or body.find(b"\\", start, end) >= 0:
+        return None
+    mime = _MIME.search(body, obj.end(), data.start()) or _MIME.search(body, end, end + _WINDOW)
+    try:
+        image = binascii.a2b_base64(memoryview(body)[start:end])
+    except binascii.Error:
+        return None
+    if not image:
+        # The full parse skips empty parts and keeps looking
+        return None
+    return InlineImage(image, mime.group(1).decode("ascii", "replace") if mime else None, _usage(body))
+
+
+def _parse(body: bytes) -> InlineImage:
+    """Full JSON parse; the reference the scan must agree with."""
+    doc = _loads(body)
+    if not isinstance(doc, dict):
+        return InlineImage(None, None, None)
+    usage = doc.get("usageMetadata")
+    usage = usage if isinstance(usage, dict) else None
+    cands = doc.get("candidates")
+    for cand in cands if isinstance(cands, list) else []:
+        content = cand.get("content") if isinstance(cand, dict) else None
+        parts = content.get("parts") if isinstance(content, dict) else None
+        for part in parts if isinstance(parts, list) else []:
+            inline = part.get("inlineData") if isinstance(part, dict) else None
+            if isinstance(inline, dict) and isinstance(inline.get("data"), str) and inline["data"]:
+                return InlineImage(binascii.a2b_base64(inline["data"]), inline.get("mimeType"), usage)
+    return InlineImage(None, None, usage)
+
+
+def extract(body: bytes) -> InlineImage:
+    """First inline image of a generateContent response body. Raises ValueError on malformed JSON or base64."""
+    return _scan(body) or _parse(body)
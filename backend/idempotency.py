@@ -0,0 +1,134 @@
+"""``Idempotency-Key`` support for generate and composite.
+
+The first request with a given key runs as its own task. Any repeat of that
+key, while it is running or after it has finished, waits on the same task.
+A repeat therefore never triggers new upstream work or writes another output
+file. Keys are scoped per client and per endpoint. Each key is also bound to
+a SHA-256 fingerprint of the request body: reusing a key with a different
+body raises ``KeyReused``.
+
+Only successful results are kept. A failed execution passes its error to
+everyone attached to it and then drops the record, so the next retry runs
+afresh. Completed records expire ``IDEMPOTENCY_TTL_SECONDS`` after they
+finish. The store is an LRU bounded by entry count and by the approximate
+size of the stored results. In-flight records are never evicted.
+
+Like ``admission``, this runs on the event loop only and needs no locking.
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+import metrics
+
+try:
+    TTL_SECONDS = max(1.0, float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600")))
+except Exception:
+    TTL_SECONDS = 3600.0
+try:
+    MAX_ENTRIES = max(1, int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "1000")))
+except Exception:
+    MAX_ENTRIES = 1000
+try:
+    MAX_BYTES = max(1, int(os.getenv("IDEMPOTENCY_MAX_MB", "256"))) * 1024 * 1024
+except Exception:
+    MAX_BYTES = 256 * 1024 * 1024
+
+MAX_KEY_LENGTH = 255
+
+
+class KeyReused(Exception):
+    """The key was already used with a different request body."""
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "task", "expires", "size")
+
+    def __init__(self, fingerprint: str, task: "asyncio.Task"):
+        self.fingerprint = fingerprint
+        self.task = task
+        self.expires = float("inf")  # set when the task completes
+        self.size = 0
+
+
+def _approx_size(value: Any) -> int:
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_approx_size(k) + _approx_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_approx_size(v) for v in value)
+    return 8
+
+
+class IdempotencyStore:
+    def __init__(self, ttl: float = TTL_SECONDS, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _evict(self, now: float) -> None:
+        # Oldest first; in-flight entries are never dropped
+        for key, entry in list(self._entries.items()):
+            if not entry.task.done():
+                continue
+            over = len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            if over or entry.expires <= now:
+                self._drop(key)
+        metrics.IDEMPOTENCY_ENTRIES.set(len(self._entries))
+
+    def _on_done(self, key: str, entry: _Entry, task: "asyncio.Task") -> None:
+        if self._entries.get(key) is not entry:
+            return
+        if task.cancelled() or task.exception() is not None:
+            self._drop(key)
+        else:
+            entry.expires = time.monotonic() + self.ttl
+            entry.size = _approx_size(task.result())
+            self._bytes += entry.size
+        self._evict(time.monotonic())
+
+    async def run(
+        self, key: str, fingerprint: str, endpoint: str, fn: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        """Run ``fn`` once per key. Returns (result, replayed)."""
+        now = time.monotonic()
+        entry: Optional[_Entry] = self._entries.get(key)
+        if entry is not None and entry.expires <= now:
+            self._drop(key)
+            entry = None
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                raise KeyReused(key)
+            self._entries.move_to_end(key)
+            metrics.IDEMPOTENCY_HITS.inc(endpoint=endpoint, outcome="replayed" if entry.task.done() else "attached")
+            # shield: a waiter giving up must not cancel the shared execution
+            return await asyncio.shield(entry.task), True
+
+        task = asyncio.ensure_future(fn())
+        entry = self._entries[key] = _Entry(fingerprint, task)
+        task.add_done_callback(lambda t, k=key, e=entry: self._on_done(k, e, t))
+        self._evict(now)
+        return await asyncio.shield(task), False
+
+
+STORE = IdempotencyStore()
+
+
+def scoped_key(client: str, endpoint: str, key: str) -> str:
+    return f"{client}|{endpoint}|{key}"
+
+
+def fingerprint(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()
@@ -0,0 +1,328 @@
+"""Local ID-photo renderer for the regulated themes (passport, resume).
+
+The upstream call is the slow and paid part of an ID photo. Most of what
+these themes ask for is geometric and tonal work that runs on CPU in a few
+hundred milliseconds:
+
+1. face: the largest detected face anchors everything. No face or more
+   than one face is not an ID photo.
+2. segmentation: GrabCut on a downscaled copy of the crop window, seeded
+   from the face box. The inner face and the chest along the bottom edge
+   are foreground; the head and a torso trapezoid are probably foreground,
+   except where they match the colours of the border above the shoulders,
+   which is background. Blobs without a foreground seed are dropped, and
+   the mask is upscaled and feathered.
+3. tone: the subject's L channel (Lab) gets a capped contrast stretch, and
+   a gamma correction when the face is outside a usable brightness band.
+   Hue is left alone.
+4. background: the subject is composited onto the region's plain colour.
+5. crop: ``imaging.enforce_id_crop`` to the theme's 3:4 canvas, with the
+   region's head height and eye line.
+
+``render`` then checks the result against the region's rules:
+
+- one face in the photo
+- head height and eye line inside the region's bands
+- face centred
+- exposure
+- sharpness
+- enough source resolution
+- the frame fits inside the photo
+- a clean segmentation
+
+It reports every check that failed. The render is deterministic, so it
+returns one image whatever ``shots`` asks for.
+
+``ID_LOCAL_MODE`` sets what happens:
+
+- ``off`` (default): the local renderer is never tried
+- ``auto``: a failed render falls back to the upstream
+- ``only``: a failed render is refused with a 422
+
+Except in ``off``, ``options.local`` (true/false) overrides the mode for one
+request. Head height is crown to chin, estimated from the detector box,
+which stops near the hairline. The geometry checks map that box through
+the crop rather than detecting again: the new background changes what a
+cascade detector sees at the face edge, and it would cost another pass.
+"""
+
+import logging
+import os
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from PIL import Image
+
+import lazy
+from detectors import FaceBox, cv2_available, detect_faces_bgr
+from imaging import encode_png, enforce_id_crop, get_target_size
+from preflight import face_region
+
+np = lazy.module("numpy")
+cv2 = lazy.module("cv2")
+
+logger = logging.getLogger("ai_portrait_studio")
+
+MODE = os.getenv("ID_LOCAL_MODE", "off").lower()
+if MODE not in {"off", "auto", "only"}:
+    logger.warning("Unknown ID_LOCAL_MODE=%s; using off", MODE)
+    MODE = "off"
+try:
+    SEGMENT_MAX_SIDE = max(128, int(os.getenv("ID_LOCAL_SEGMENT_MAX_SIDE", "256")))
+except Exception:
+    SEGMENT_MAX_SIDE = 256
+try:
+    MIN_SHARPNESS = max(0.0, float(os.getenv("ID_LOCAL_MIN_SHARPNESS", "15")))
+except Exception:
+    MIN_SHARPNESS = 15.0
+
+THEMES = {"passport", "resume"}
+# Crown-to-chin height over detector box height
+_HEAD_PER_BOX = 1.35
+# A print needs real pixels: refuse to upscale the face more than this
+_MAX_UPSCALE = 2.5
+# Share of the frame allowed past the photo's edge (filled by replicating edge pixels)
+_MAX_FRAMING = 0.02
+_GRABCUT_ITERATIONS = 3
+# Lab distance under which a seeded pixel counts as the border colour
+_BG_DISTANCE = 12.0
+# Face median lightness (Lab L, 0-255) of a usable exposure, and the most contrast the tone step adds
+_FACE_LUMA = (95.0, 215.0)
+_MAX_GAIN = 1.3
+
+
+class Rule(NamedTuple):
+    background: Tuple[int, int, int]  # RGB
+    head: Tuple[float, float]  # crown-to-chin height, share of canvas height
+    eyes: Tuple[float, float]  # eye line from the top, share of canvas height
+
+
+# Passport bands follow each authority's published photo specs, mapped onto the 3:4 canvas
+REGIONS: Dict[str, Rule] = {
+    "US": Rule((255, 255, 255), (0.50, 0.69), (0.31, 0.44)),
+    "UK": Rule((235, 235, 235), (0.64, 0.76), (0.28, 0.45)),
+    "KR": Rule((255, 255, 255), (0.71, 0.80), (0.28, 0.45)),
+}
+_PASSPORT = Rule((255, 255, 255), (0.55, 0.80), (0.28, 0.45))
+_RESUME = Rule((242, 242, 242), (0.40, 0.70), (0.28, 0.45))
+
+
+def rule_for(theme: str, region: Optional[str]) -> Rule:
+    if theme == "resume":
+        return _RESUME
+    return REGIONS.get((region or "").upper(), _PASSPORT)
+
+
+def wanted(theme: str, options: Optional[Dict[str, Any]]) -> bool:
+    """Whether this request should try the local renderer first."""
+    if MODE == "off" or theme not in THEMES:
+        return False
+    choice = options.get("local") if isinstance(options, dict) else None
+    return choice if isinstance(choice, bool) else True
+
+
+def _segment(img, face: FaceBox, window: Tuple[int, int, int, int]):
+    """Soft subject mask (float32, 0..1) over ``window`` (x0, y0, x1, y1) of ``img``, zero outside it."""
+    h0, w0 = img.shape[:2]
+    x0, y0 = max(0, window[0]), max(0, window[1])
+    x1, y1 = min(w0, window[2]), min(h0, window[3])
+    roi = img[y0:y1, x0:x1]
+    rh, rw = roi.shape[:2]
+    s = min(1.0, SEGMENT_MAX_SIDE / float(max(rh, rw)))
+    small = cv2.resize(roi, (max(1, int(rw * s)), max(1, int(rh * s))), interpolation=cv2.INTER_AREA) if s < 1 else roi
+    h, w = small.shape[:2]
+    fx, fy, fw, fh = (face.x - x0) * s, (face.y - y0) * s, face.w * s, face.h * s
+    cx = fx + fw / 2
+
+    mask = np.full((h, w), cv2.GC_PR_BGD, np.uint8)
+    b = max(2, int(0.02 * max(h, w)))
+    shoulders = int(min(h, max(0, fy + 1.15 * fh)))
+    mask[:b, :] = cv2.GC_BGD
+    mask[:shoulders, :b] = cv2.GC_BGD
+    mask[:shoulders, w - b:] = cv2.GC_BGD
+    # Head with room for hair, then neck and torso widening to the bottom edge
+    cv2.ellipse(mask, (int(cx), int(fy + fh * 0.4)), (int(fw * 0.7), int(fh * 0.8)), 0, 0, 360, cv2.GC_PR_FGD, -1)
+    torso = np.array([(cx - 0.3 * fw, fy + fh), (cx + 0.3 * fw, fy + fh), (cx + 0.3 * fw, fy + 1.3 * fh),
+                      (cx + 1.6 * fw, h), (cx - 1.6 * fw, h), (cx - 0.3 * fw, fy + 1.3 * fh)], np.int32)
+    cv2.fillPoly(mask, [torso], cv2.GC_PR_FGD)
+    cv2.ellipse(mask, (int(cx), int(fy + fh * 0.55)), (int(fw * 0.3), int(fh * 0.35)), 0, 0, 360, cv2.GC_FGD, -1)
+    # Seeded areas the colour of the border are background showing around the head and neck; left in,
+    # they teach the foreground model the background colour
+    lab = cv2.cvtColor(small, cv2.COLOR_BGR2LAB).astype(np.float32)
+    border = np.concatenate([lab[:b].reshape(-1, 3), lab[:shoulders, :b].reshape(-1, 3), lab[:shoulders, w - b:].reshape(-1, 3)])
+    k = min(3, len(border))
+    _, _, centres = cv2.kmeans(border, k, None, (cv2.TERM_CRITERIA_MAX_ITER, 5, 1.0), 1, cv2.KMEANS_PP_CENTERS)
+    near = np.min(np.linalg.norm(lab[:, :, None, :] - centres[None, None], axis=3), axis=2) < _BG_DISTANCE
+    mask[near & (mask == cv2.GC_PR_FGD)] = cv2.GC_PR_BGD
+    # The chest along the bottom edge: a head-and-shoulders frame always has it there
+    mask[int(h * 0.9):, int(max(0, cx - 0.7 * fw)):int(max(0, cx + 0.7 * fw)) + 1] = cv2.GC_FGD
+
+    bgd, fgd = np.zeros((1, 65), np.float64), np.zeros((1, 65), np.float64)
+    cv2.grabCut(small, mask, None, bgd, fgd, _GRABCUT_ITERATIONS, cv2.GC_INIT_WITH_MASK)
+    fg = np.where((mask == cv2.GC_FGD) | (mask == cv2.GC_PR_FGD), 255, 0).astype(np.uint8)
+    # Keep the blobs holding a seed (face, chest); stray background patches go
+    _, labels = cv2.connectedComponents(fg)
+    seeded = np.unique(labels[mask == cv2.GC_FGD])
+    fg = np.where(np.isin(labels, seeded[seeded > 0]), 255, 0).astype(np.uint8)
+    # Pull the edge in a pixel so the old background does not show as a fringe
+    fg = cv2.erode(fg, np.ones((3, 3), np.uint8))
+    if s < 1:
+        fg = cv2.resize(fg, (rw, rh), interpolation=cv2.INTER_LINEAR)
+    blur = max(3, int(0.006 * max(rh, rw)) | 1)
+    alpha = np.zeros((h0, w0), np.float32)
+    alpha[y0:y1, x0:x1] = cv2.GaussianBlur(fg, (blur, blur), 0).astype(np.float32) / 255.0
+    return alpha
+
+
+def _normalize_tone(img, alpha, face: FaceBox):
+    lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
+    lum = lab[:, :, 0].astype(np.float32)
+    subject = lum[alpha > 0.5]
+    if subject.size:
+        # Restore contrast lost to haze or flat light, without stretching a well-exposed photo
+        lo, hi = np.percentile(subject, (1, 99))
+        gain = min(_MAX_GAIN, 239.0 / max(hi - lo, 1.0))
+        if gain > 1.0:
+            mid_tone = (lo + hi) / 2.0
+            lum = np.clip(mid_tone + (lum - mid_tone) * gain, 0, 255)
+    rows, cols = face_region(img.shape, face)
+    mid = float(np.median(lum[rows, cols])) if lum[rows, cols].size else 0.0
+    # Only an under- or over-exposed face is moved, to the nearest edge of the band;
+    # skin tones inside it are left as they are
+    target = min(max(mid, _FACE_LUMA[0] + 10), _FACE_LUMA[1] - 10)
+    if 0 < mid < 255 and target != mid:
+        gamma = float(np.log(target / 255.0) / np.log(mid / 255.0))
+        lum = 255.0 * (lum / 255.0) ** gamma
+    lab[:, :, 0] = np.clip(lum, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+
+
+def _shift(face: FaceBox, dx: int, dy: int) -> FaceBox:
+    eyes = face.eyes and tuple((x + dx, y + dy) for x, y in face.eyes)
+    return face._replace(x=face.x + dx, y=face.y + dy, eyes=eyes)
+
+
+def _targets(rule: Rule) -> Tuple[float, float]:
+    """(face box share of canvas height, eye line from top) at the middle of the rule's bands."""
+    return sum(rule.head) / 2 / _HEAD_PER_BOX, sum(rule.eyes) / 2
+
+
+def _framing(face: FaceBox, box_ratio: float, eye_line: float, tw: int, th: int) -> Tuple[float, Tuple[int, int, int, int]]:
+    """Upscale factor and the source window (x0, y0, x1, y1) the crop will cover."""
+    scale = box_ratio * th / max(face.h, 1)
+    cx = face.x + face.w / 2
+    x0 = cx - tw / 2 / scale
+    y0 = face.eye_line_y - eye_line * th / scale
+    return scale, (int(x0), int(y0), int(x0 + tw / scale), int(y0 + th / scale))
+
+
+def _placed(face: FaceBox, shape, scale: float, eye_line: float, tw: int, th: int) -> FaceBox:
+    """``face`` in the canvas ``enforce_id_crop`` cuts from an image of ``shape``, clamp to the edges included."""
+    new_h, new_w = int(shape[0] * scale), int(shape[1] * scale)
+    crop_x = max(0, min(int((face.x + face.w / 2) * scale) - tw // 2, new_w - tw))
+    crop_y = max(0, min(int(face.eye_line_y * scale - eye_line * th), new_h - th))
+    eyes = face.eyes and tuple((x * scale - crop_x, y * scale - crop_y) for x, y in face.eyes)
+    return face._replace(x=int(face.x * scale) - crop_x, y=int(face.y * scale) - crop_y,
+                         w=int(face.w * scale), h=int(face.h * scale), eyes=eyes)
+
+
+def check(out_bgr, face: FaceBox, rule: Rule, alpha_window, scale: float, framing: float) -> Tuple[List[str], Dict[str, float]]:
+    """Failed checks (empty when compliant) and the measurements behind them. ``face`` is in canvas coordinates."""
+    th, tw = out_bgr.shape[:2]
+    failed: List[str] = []
+    measures: Dict[str, float] = {"upscale": round(scale, 3), "framing": round(framing, 3)}
+
+    head = face.h * _HEAD_PER_BOX / th
+    eyes = face.eye_line_y / th
+    offset = abs((face.x + face.w / 2) / tw - 0.5)
+    measures.update(head=round(head, 3), eyes=round(eyes, 3), offset=round(offset, 3))
+    if not rule.head[0] <= head <= rule.head[1]:
+        failed.append("head_size")
+    if not rule.eyes[0] <= eyes <= rule.eyes[1]:
+        failed.append("eye_line")
+    if offset > 0.05:
+        failed.append("centering")
+
+    rows, cols = face_region(out_bgr.shape, face)
+    gray = cv2.cvtColor(out_bgr[rows, cols], cv2.COLOR_BGR2GRAY)
+    if gray.size:
+        lum = cv2.cvtColor(out_bgr[rows, cols], cv2.COLOR_BGR2LAB)[:, :, 0]
+        mid, clipped = float(np.median(lum)), float(np.mean(lum >= 250))
+        # Sharpness at a fixed face width so it does not depend on the canvas
+        sample = cv2.resize(gray, (128, max(1, int(128 * gray.shape[0] / gray.shape[1]))), interpolation=cv2.INTER_AREA)
+        sharpness = float(cv2.Laplacian(sample, cv2.CV_64F).var())
+        measures.update(face_luma=round(mid, 1), clipped=round(clipped, 4), sharpness=round(sharpness, 1))
+        if not _FACE_LUMA[0] <= mid <= _FACE_LUMA[1] or clipped > 0.03:
+            failed.append("exposure")
+        if sharpness < MIN_SHARPNESS:
+            failed.append("blur")
+
+    # Segmentation: the face must be solid subject, the subject a plausible share of the frame,
+    # and the strips beside the head (above the shoulders) background
+    if alpha_window.size:
+        ah, aw = alpha_window.shape[:2]
+        fx0, fy0 = (face.x / tw) * aw, (face.y / th) * ah
+        fx1, fy1 = ((face.x + face.w) / tw) * aw, ((face.y + face.h) / th) * ah
+        core = alpha_window[int(fy0 + (fy1 - fy0) * 0.3):int(fy0 + (fy1 - fy0) * 0.8),
+                            int(fx0 + (fx1 - fx0) * 0.25):int(fx0 + (fx1 - fx0) * 0.75)]
+        side = max(1, int(aw * 0.08))
+        beside = np.concatenate([alpha_window[:int(fy1), :side].ravel(), alpha_window[:int(fy1), aw - side:].ravel()])
+        share = float(alpha_window.mean())
+        measures.update(subject_share=round(share, 3))
+        if (core.size and core.mean() < 0.9) or not 0.2 <= share <= 0.85 or (beside.size and beside.mean() > 0.15):
+            failed.append("segmentation")
+    return failed, measures
+
+
+def render(img_bytes: bytes, theme: str, region: Optional[str] = None,
+           faces: Optional[List[FaceBox]] = None) -> Tuple[Optional[bytes], List[str], Dict[str, float]]:
+    """Render an ID photo locally: (png, failed checks, measurements). png is None when a check failed.
+
+    ``faces`` are the faces already detected in ``img_bytes``, if any were looked for.
+    """
+    if not cv2_available():
+        return None, ["opencv"], {}
+    img = cv2.imdecode(np.frombuffer(img_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None, ["decode"], {}
+    if faces is None:
+        faces = detect_faces_bgr(img, min_size=48)
+    if len(faces) != 1:
+        return None, ["face" if not faces else "faces"], {}
+    face = faces[0]
+    rule = rule_for(theme, region)
+    tw, th = get_target_size(theme, None)
+    box_ratio, eye_line = _targets(rule)
+    scale, window = _framing(face, box_ratio, eye_line, tw, th)
+    shape = img.shape
+    x0, y0, x1, y1 = window
+    # How far the frame reaches past the photo, as a share of the frame height
+    framing = max(0, -x0, -y0, x1 - shape[1], y1 - shape[0]) / float(y1 - y0)
+    if scale > _MAX_UPSCALE or framing > _MAX_FRAMING:
+        # Geometry alone rules the photo out; skip the pixel work
+        failed = ["resolution"] * (scale > _MAX_UPSCALE) + ["framing"] * (framing > _MAX_FRAMING)
+        return None, failed, {"upscale": round(scale, 3), "framing": round(framing, 3)}
+
+    # Only the crop window (plus a margin for the feathered edge) is ever looked at again
+    margin = int(0.1 * (x1 - x0))
+    rx0, ry0 = max(0, x0 - margin), max(0, y0 - margin)
+    rx1, ry1 = min(shape[1], x1 + margin), min(shape[0], y1 + margin)
+    img = img[ry0:ry1, rx0:rx1]
+    face = _shift(face, -rx0, -ry0)
+    window = (x0 - rx0, y0 - ry0, x1 - rx0, y1 - ry0)
+
+    alpha = _segment(img, face, window)
+    toned = _normalize_tone(img, alpha, face)
+    bg = np.array(rule.background[::-1], np.float32)
+    a = alpha[:, :, None]
+    composed = (toned.astype(np.float32) * a + bg * (1.0 - a)).astype(np.uint8)
+    out = enforce_id_crop(Image.fromarray(composed[:, :, ::-1]), tw, th, head_ratio=box_ratio, eye_line_from_top=eye_line,
+                          face=face)
+    out = out.convert("RGB")
+
+    x0, y0, x1, y1 = window
+    alpha_window = alpha[max(0, y0):max(0, y1), max(0, x0):max(0, x1)]
+    placed = _placed(face, composed.shape, scale, eye_line, tw, th)
+    failed, measures = check(np.asarray(out)[:, :, ::-1].copy(), placed, rule, alpha_window, scale, framing)
+    if failed:
+        return None, failed, measures
+    return encode_png(out), [], measures
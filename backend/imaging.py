@@ -0,0 +1,299 @@
+"""CPU-bound image stages of the generate/composite pipelines.
+
+These are plain module-level functions over bytes so they can run either in
+the request thread or in a worker process (see ``workers.py``).
+"""
+
+import logging
+import time
+from io import BytesIO
+from typing import List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+import ingest
+import lazy
+from detectors import FaceBox, cv2_available, detect_faces_bgr
+
+# Optional deps for regulated cropping (OpenCV), imported on first use
+np = lazy.module("numpy")
+cv2 = lazy.module("cv2")
+
+
+logger = logging.getLogger("ai_portrait_studio")
+
+
+def _decode_bgr(img_bytes: bytes):
+    arr = np.frombuffer(img_bytes, dtype=np.uint8)
+    return cv2.imdecode(arr, cv2.IMREAD_COLOR)
+
+
+# EXIF tag 0x0112
+_ORIENTATION = 274
+
+
+def ingest_input(img_bytes: bytes, mime: str, max_side: int = ingest.WORKING_MAX_SIDE) -> Tuple[bytes, str]:
+    """Produce the working-resolution image every later stage uses.
+
+    JPEGs are decoded in draft mode, so libjpeg scales them by 1/2, 1/4 or
+    1/8 in the DCT domain on the way in. A 48 MP photo is decoded at about
+    0.75 MP instead of 48 MP, then LANCZOS only covers the last factor of
+    up to 2. EXIF orientation is applied, so rotated phone photos reach the
+    detector upright. Inputs that are already small, upright and correctly
+    labelled PNG/JPEG are returned untouched. On any failure the original
+    bytes are passed through.
+    """
+    try:
+        img = Image.open(BytesIO(img_bytes))
+        w, h = img.size
+        tw, th = ingest.working_size(w, h, max_side)
+        orientation = img.getexif().get(_ORIENTATION, 1)
+        if (tw, th) == (w, h) and orientation in (0, 1) and Image.MIME.get(img.format) == mime:
+            return img_bytes, mime
+        if img.format == "JPEG":
+            img.draft("RGB", (tw, th))
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        if max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+        buf = BytesIO()
+        img.save(buf, format="JPEG", quality=90)
+        return buf.getvalue(), "image/jpeg"
+    except Exception as e:
+        logger.warning("ingest_input failed: %s", e)
+        return img_bytes, mime
+
+
+# Multi-subject support: detect multiple faces (largest first)
+def detect_faces(image_bytes: bytes) -> List[FaceBox]:
+    if not cv2_available():
+        return []
+    try:
+        img_cv = _decode_bgr(image_bytes)
+        if img_cv is None:
+            return []
+        return detect_faces_bgr(img_cv, min_size=48)
+    except Exception:
+        return []
+
+
+# Identity face crop sent alongside the input to improve consistency
+def make_identity_crop(img_bytes: bytes) -> Optional[Tuple[bytes, str]]:
+    if not cv2_available():
+        return None
+    try:
+        cvimg = _decode_bgr(img_bytes)
+        if cvimg is None:
+            return None
+        faces = detect_faces_bgr(cvimg, min_size=48, sensitive=True)
+        if len(faces) == 0:
+            return None
+        x, y, w, h = faces[0][:4]
+        pad = int(max(w,h)*0.45)
+        x0 = max(0, x-pad); y0 = max(0, y-pad)
+        x1 = min(cvimg.shape[1], x+w+pad); y1 = min(cvimg.shape[0], y+h+pad)
+        crop = cvimg[y0:y1, x0:x1]
+        # Resize to manageable ref size
+        ref_w = 512
+        ch, cw = crop.shape[:2]
+        if cw > ref_w:
+            scale = ref_w/float(cw)
+            crop = cv2.resize(crop, (ref_w, int(ch*scale)), interpolation=cv2.INTER_LANCZOS4)
+        _, enc = cv2.imencode('.jpg', crop, [int(cv2.IMWRITE_JPEG_QUALITY), 90])
+        return enc.tobytes(), 'image/jpeg'
+    except Exception:
+        return None
+
+
+def crop_subject(img_bytes: bytes, face: FaceBox) -> Optional[bytes]:
+    """PNG crop around one face, expanded to include shoulders (multi-subject path)."""
+    if not cv2_available():
+        return None
+    img_cv_src = _decode_bgr(img_bytes)
+    if img_cv_src is None:
+        return None
+    h0, w0 = img_cv_src.shape[:2]
+    x, y, w, h = face[:4]
+    cx, cy = x + w/2, y + h/2
+    box_w = int(w * 2.0)
+    box_h = int(h * 2.4)
+    x0 = max(0, int(cx - box_w/2))
+    y0 = max(0, int(cy - box_h*0.45))
+    x1 = min(w0, x0 + box_w)
+    y1 = min(h0, y0 + box_h)
+    crop_cv = img_cv_src[y0:y1, x0:x1]
+    _, enc = cv2.imencode('.png', crop_cv)
+    return enc.tobytes()
+
+
+def analyze_face(img_bytes: bytes) -> Optional[Tuple[int, int, int, int]]:
+    """Largest face box (x, y, w, h) in an encoded image, or None."""
+    faces = detect_faces(img_bytes)
+    if not faces:
+        return None
+    return tuple(int(v) for v in faces[0][:4])
+
+
+def face_closeup(img_bytes: bytes, box: Tuple[int, int, int, int], pad_ratio: float = 0.4) -> Optional[bytes]:
+    """PNG close crop of a face box, expanded for hairline/chin."""
+    if not cv2_available():
+        return None
+    cvimg = _decode_bgr(img_bytes)
+    if cvimg is None:
+        return None
+    ux, uy, uw, uh = box
+    pad = int(max(uw, uh)*pad_ratio)
+    x0 = max(0, ux - pad)
+    y0 = max(0, uy - pad)
+    x1 = min(cvimg.shape[1], ux + uw + pad)
+    y1 = min(cvimg.shape[0], uy + uh + pad)
+    _, enc = cv2.imencode('.png', cvimg[y0:y1, x0:x1])
+    return enc.tobytes()
+
+
+# Process output image to target aspect/size per theme and composition
+def get_target_size(theme: str, comp: Optional[str]):
+    if theme == "passport":
+        return (900, 1200)  # 3:4 regulated
+    if theme == "resume":
+        return (900, 1200)  # 3:4 common ID/resume portrait aspect
+    # Composition-driven sizes
+    if comp == "full" or comp == "three_quarter":
+        return (1080, 1620)  # 2:3 tall
+    if comp == "half":
+        return (1024, 1280)  # 4:5
+    if comp == "close":
+        return (900, 1200)   # 3:4 tight portrait
+    # Fallback by theme
+    if theme in {"model", "kpop", "actor", "travel", "activity", "profession", "aerial_set"}:
+        return (1080, 1620)
+    return (1024, 1280)
+
+
+def resize_cover(img: Image.Image, tw: int, th: int) -> Image.Image:
+    w, h = img.size
+    if w == 0 or h == 0:
+        return img
+    scale = max(tw / w, th / h)
+    nw, nh = int(w * scale), int(h * scale)
+    img2 = img.resize((nw, nh), Image.LANCZOS)
+    left = max(0, (nw - tw) // 2)
+    top = max(0, (nh - th) // 2)
+    box = (left, top, left + tw, top + th)
+    img3 = img2.crop(box)
+    return img3
+
+
+def enforce_id_crop(pil_img: Image.Image, target_w: int, target_h: int, head_ratio: float = 0.65, eye_line_from_top: float = 0.43,
+                    face: Optional[FaceBox] = None) -> Image.Image:
+    """Crop so the face box is ``head_ratio`` of the height with the eye line at ``eye_line_from_top``.
+
+    ``face`` is a box already found in ``pil_img``; without it the largest detected face is used.
+    """
+    if not cv2_available():
+        # Fallback without OpenCV: simple cover crop
+        return resize_cover(pil_img.convert("RGBA"), target_w, target_h)
+    # Convert PIL -> CV2
+    img = np.array(pil_img.convert("RGB"))
+    img_cv = img[:, :, ::-1]
+    h0, w0 = img_cv.shape[:2]
+    if face is None:
+        # Detect face (largest)
+        faces_loc = detect_faces_bgr(img_cv, min_size=int(min(w0, h0)*0.15))
+        if len(faces_loc) == 0:
+            # fallback: simple cover center crop
+            return resize_cover(pil_img.convert("RGBA"), target_w, target_h)
+        # pick largest
+        face = faces_loc[0]
+    x, y, w, h = face[:4]
+    # Desired head height in final
+    desired_head_h = head_ratio * target_h
+    scale = desired_head_h / max(h, 1)
+    # Resize original by scale
+    new_w, new_h = int(w0 * scale), int(h0 * scale)
+    img_scaled = cv2.resize(img_cv, (new_w, new_h), interpolation=cv2.INTER_LANCZOS4)
+    # Face center in scaled image
+    cx = int((x + w/2) * scale)
+    # Eye line from landmarks when the detector provides them, else ~0.38 of face height
+    eyes_y_scaled = int(face.eye_line_y * scale)
+    # Compute crop top-left so that eye line sits at specified position
+    crop_x = cx - target_w // 2
+    crop_y = int(eyes_y_scaled - eye_line_from_top * target_h)
+    # Clamp
+    crop_x = max(0, min(crop_x, new_w - target_w))
+    crop_y = max(0, min(crop_y, new_h - target_h))
+    # If scaled image smaller than target, pad
+    if new_w < target_w or new_h < target_h:
+        pad_w = max(0, target_w - new_w)
+        pad_h = max(0, target_h - new_h)
+        img_scaled = cv2.copyMakeBorder(img_scaled, pad_h//2, pad_h - pad_h//2, pad_w//2, pad_w - pad_w//2, cv2.BORDER_REPLICATE)
+        new_h, new_w = img_scaled.shape[:2]
+        crop_x = max(0, min(crop_x, new_w - target_w))
+        crop_y = max(0, min(crop_y, new_h - target_h))
+    crop = img_scaled[crop_y:crop_y+target_h, crop_x:crop_x+target_w]
+    if crop.shape[0] != target_h or crop.shape[1] != target_w:
+        crop = cv2.resize(crop, (target_w, target_h), interpolation=cv2.INTER_LANCZOS4)
+    pil_out = Image.fromarray(crop[:, :, ::-1])
+    return pil_out
+
+
+def encode_png(img: Image.Image) -> bytes:
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def decode_model_image(out_bytes: bytes) -> Image.Image:
+    out_img = Image.open(BytesIO(out_bytes))
+    out_img.load()
+    return out_img
+
+
+def postprocess_output(out_bytes: bytes, theme: str, comp_key: Optional[str]) -> Tuple[bytes, float, float]:
+    """Decode a model image, fit it to the theme's canvas and encode it as PNG.
+
+    Returns (png_bytes, postprocess_seconds, encode_seconds). Raises
+    ValueError when the model image cannot be decoded.
+    """
+    t0 = time.perf_counter()
+    try:
+        out_img = decode_model_image(out_bytes)
+    except Exception as e:
+        raise ValueError(f"Failed to decode model image: {e}")
+    try:
+        tw, th = get_target_size(theme, comp_key)
+        if theme in {"passport", "resume"}:
+            # Make head smaller in the frame to include shoulders/chest
+            # Passport: tighter but still chest-up; Resume: slightly looser
+            out_img = enforce_id_crop(
+                out_img,
+                tw,
+                th,
+                head_ratio=0.45 if theme == "passport" else 0.50,
+                eye_line_from_top=0.43,
+            )
+        else:
+            out_img = resize_cover(out_img.convert("RGBA"), tw, th)
+    except Exception:
+        pass
+    t1 = time.perf_counter()
+    png = encode_png(out_img)
+    return png, t1 - t0, time.perf_counter() - t1
+
+
+def postprocess_composite(out_bytes: bytes, tw: int = 1024, th: int = 1280) -> Tuple[bytes, float, float]:
+    """Post-process a composite result to a consistent portrait size (PNG).
+
+    Same return convention as ``postprocess_output``.
+    """
+    t0 = time.perf_counter()
+    try:
+        out_img = decode_model_image(out_bytes)
+    except Exception as e:
+        raise ValueError(f"Failed to decode model image: {e}")
+    try:
+        out_img = resize_cover(out_img.convert("RGBA"), tw, th)
+    except Exception:
+        pass
+    t1 = time.perf_counter()
+    png = encode_png(out_img)
+    return png, t1 - t0, time.perf_counter() - t1
@@ -0,0 +1,147 @@
+"""Input limits, working resolution and memory estimates for uploaded images.
+
+``probe`` reads only the image header (format and dimensions), so a
+40 000 x 40 000 upload is rejected with nothing decoded. ``probe_b64``
+does the same from a short prefix of the base64 payload, so the async
+endpoint can check pixel limits and size its memory reservation before a
+slot is taken or the full payload is decoded.
+
+Every stage after ingest works on the working-resolution image produced
+by ``imaging.ingest_input``: at most ``INGEST_MAX_SIDE`` pixels on the
+long side, upright according to EXIF orientation. ``working_size`` and
+``jpeg_draft_scale`` describe that image and how much libjpeg shrinks the
+input while decoding it.
+
+``estimate_peak`` models what one request keeps alive at its worst point:
+the base64 text and the decoded bytes, the ingest decode, RGB/BGR copies of
+the working image, the upstream JSON payload, and the output canvases. The
+result is a conservative byte count used by ``admission.MEMORY``.
+"""
+
+import base64
+import binascii
+import os
+from io import BytesIO
+from typing import Iterable, NamedTuple, Optional, Sequence, Tuple
+
+from PIL import Image
+
+try:
+    MAX_INPUT_MEGAPIXELS = max(1.0, float(os.getenv("MAX_INPUT_MEGAPIXELS", "50")))
+except Exception:
+    MAX_INPUT_MEGAPIXELS = 50.0
+
+try:
+    WORKING_MAX_SIDE = max(256, int(os.getenv("INGEST_MAX_SIDE", "1600")))
+except Exception:
+    WORKING_MAX_SIDE = 1600
+
+# Keep PIL's decompression-bomb guard (which refuses at twice this value) from
+# rejecting images this service is configured to accept
+if Image.MAX_IMAGE_PIXELS is not None:
+    Image.MAX_IMAGE_PIXELS = max(Image.MAX_IMAGE_PIXELS, int(MAX_INPUT_MEGAPIXELS * 1_000_000))
+
+# Enough base64 to reach the JPEG SOF marker past typical EXIF/ICC segments
+PROBE_PREFIX_CHARS = 512 * 1024
+
+# Largest output canvas (1080x1620 RGBA) and a finished variant (PNG + base64)
+OUTPUT_CANVAS_BYTES = 1080 * 1620 * 4
+OUTPUT_RESULT_BYTES = 6 * 1024 * 1024
+# Assumed encoded bytes per pixel when the header could not be probed
+FALLBACK_BYTES_PER_PIXEL = 0.3
+
+
+class ImageHeader(NamedTuple):
+    format: Optional[str]
+    width: int
+    height: int
+
+    @property
+    def megapixels(self) -> float:
+        return self.width * self.height / 1_000_000
+
+
+class TooManyPixels(Exception):
+    def __init__(self, header: Optional[ImageHeader]):
+        size = f"{header.width}x{header.height} ({header.megapixels:.1f} MP" if header else "(decompression bomb"
+        super().__init__(f"Image too large: {size}, max {MAX_INPUT_MEGAPIXELS:g} MP)")
+        self.header = header
+
+
+def probe(data: bytes) -> Optional[ImageHeader]:
+    """Format and size from the header only; None when unreadable.
+
+    Raises TooManyPixels when PIL's bomb guard refuses even to open it.
+    """
+    try:
+        with Image.open(BytesIO(data)) as img:
+            return ImageHeader(img.format, img.size[0], img.size[1])
+    except Image.DecompressionBombError:
+        raise TooManyPixels(None)
+    except Exception:
+        return None
+
+
+def _strip_data_url(b64: str) -> str:
+    if b64.startswith("data:"):
+        parts = b64.split(",", 1)
+        return parts[1] if len(parts) == 2 else b64
+    return b64
+
+
+def probe_b64(b64: str) -> Optional[ImageHeader]:
+    """``probe`` over a decoded prefix of a base64 payload."""
+    if not isinstance(b64, str):
+        return None
+    prefix = _strip_data_url(b64)[:PROBE_PREFIX_CHARS]
+    prefix = prefix[: len(prefix) - len(prefix) % 4]
+    try:
+        data = base64.b64decode(prefix)
+    except (binascii.Error, ValueError):
+        return None
+    return probe(data)
+
+
+def check_pixels(header: Optional[ImageHeader]) -> None:
+    if header is not None and header.megapixels > MAX_INPUT_MEGAPIXELS:
+        raise TooManyPixels(header)
+
+
+def working_size(width: int, height: int, max_side: int = WORKING_MAX_SIDE) -> Tuple[int, int]:
+    scale = min(1.0, max_side / float(max(width, height, 1)))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def jpeg_draft_scale(width: int, height: int, max_side: int = WORKING_MAX_SIDE) -> int:
+    """Reduction (1, 2, 4 or 8) libjpeg applies in draft mode; mirrors ``JpegImageFile.draft``."""
+    ww, wh = working_size(width, height, max_side)
+    ratio = min(width // ww, height // wh)
+    for s in (8, 4, 2):
+        if ratio >= s:
+            return s
+    return 1
+
+
+def ingest_decode_pixels(header: Optional[ImageHeader]) -> int:
+    """Pixels materialised while ingesting this input (before the final resize)."""
+    if header is None:
+        return 0
+    pixels = header.width * header.height
+    if header.format == "JPEG":
+        return pixels // jpeg_draft_scale(header.width, header.height) ** 2
+    return pixels
+
+
+def estimate_peak(b64_lengths: Sequence[int], headers: Iterable[Optional[ImageHeader]], outputs: int = 1) -> int:
+    """Conservative peak bytes held by one request (see module docstring)."""
+    total = 0
+    for n, header in zip(b64_lengths, headers):
+        raw = n * 3 // 4
+        if header is None:
+            side = int((raw / FALLBACK_BYTES_PER_PIXEL) ** 0.5)
+            header = ImageHeader(None, side, side)
+        ww, wh = working_size(header.width, header.height)
+        working = ww * wh
+        # text + decoded bytes, ingest decode, RGB/BGR copies of the working image, upstream payload
+        total += n + raw + 3 * ingest_decode_pixels(header) + 2 * 3 * working + 3 * min(raw, working)
+    return total + OUTPUT_CANVAS_BYTES + max(1, outputs) * OUTPUT_RESULT_BYTES
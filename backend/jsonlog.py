@@ -0,0 +1,64 @@
+"""Non-blocking, size-rotated JSON-lines log files.
+
+``JsonlLog.write(record)`` only enqueues; a ``QueueListener`` thread
+serializes records into a ``RotatingFileHandler``. Request threads never
+wait on disk I/O.
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from typing import Any, Dict, List
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.msg, separators=(",", ":"), default=str)
+
+
+class JsonlLog:
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024, backups: int = 10):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        handler.setFormatter(_JsonFormatter())
+        self._listener = logging.handlers.QueueListener(self._queue, handler)
+        self._listener.start()
+        self._closed = False
+
+    def write(self, record: Dict[str, Any]) -> None:
+        if self._closed:
+            return
+        # LogRecord carries the dict through the queue untouched; the listener formats it
+        self._queue.put_nowait(logging.LogRecord("jsonl", logging.INFO, "", 0, record, None, None))
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._listener.stop()
+            for h in self._listener.handlers:
+                h.close()
+
+
+_open_logs: List[JsonlLog] = []
+_open_lock = threading.Lock()
+
+
+def open_log(path: str, max_bytes: int = 64 * 1024 * 1024, backups: int = 10) -> JsonlLog:
+    log = JsonlLog(path, max_bytes, backups)
+    with _open_lock:
+        _open_logs.append(log)
+    return log
+
+
+def close_all() -> None:
+    """Flush and close every log opened via ``open_log`` (app shutdown)."""
+    with _open_lock:
+        logs = list(_open_logs)
+        _open_logs.clear()
+    for log in logs:
+        log.close()
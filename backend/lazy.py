@@ -0,0 +1,61 @@
+"""Deferred imports for heavy optional dependencies (numpy, OpenCV).
+
+``module("cv2")`` returns a proxy that imports the real module on first
+attribute access, so ``import server`` does not pay for OpenCV. The warm-up
+phase (see ``warmup.py``), or else the first request that needs it, loads
+it instead. ``available(...)`` replaces the old import-time ``try/except``:
+it tries the imports once and caches the answer.
+"""
+
+import importlib
+import threading
+from typing import Dict
+
+_lock = threading.Lock()
+_available: Dict[str, bool] = {}
+
+
+class LazyModule:
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        mod = self.__dict__["_module"]
+        if mod is None:
+            with _lock:
+                mod = self.__dict__["_module"]
+                if mod is None:
+                    mod = importlib.import_module(self.__dict__["_name"])
+                    self.__dict__["_module"] = mod
+        return mod
+
+    def __getattr__(self, attr: str):
+        value = getattr(self._load(), attr)
+        # Cache on the proxy so later lookups are plain attribute hits
+        self.__dict__[attr] = value
+        return value
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.__dict__["_module"] is not None else "not loaded"
+        return f"<lazy module {self.__dict__['_name']!r} ({state})>"
+
+
+def module(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+def available(*names: str) -> bool:
+    """True when every named module imports cleanly (imports them on first call)."""
+    for name in names:
+        ok = _available.get(name)
+        if ok is None:
+            try:
+                importlib.import_module(name)
+                ok = True
+            except Exception:
+                ok = False
+            _available[name] = ok
+        if not ok:
+            return False
+    return True
@@ -0,0 +1,376 @@
+"""In-process Prometheus-style metrics served at ``/metrics``.
+
+Counters and histograms keep a dict of label-tuple -> values under one lock
+per metric, so recording costs a dict lookup and a bisect. ``render()``
+produces the Prometheus text exposition format (version 0.0.4).
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cancel
+import deadlines
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Bytes; 64 KiB up to 4 GiB
+BYTE_BUCKETS = tuple(float(64 * 1024 * 4 ** i) for i in range(9))
+# Bytes; 16 KiB up to 16 MiB in doublings, fine enough to see payload budgets
+PAYLOAD_BUCKETS = tuple(float(16 * 1024 * 2 ** i) for i in range(11))
+
+# Seconds; spans sub-millisecond CPU stages up to slow upstream calls
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0,
+)
+
+_REGISTRY: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, doc, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            items = list(self._values.items())
+        for key, v in items:
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_value(v)}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, doc, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            items = list(self._values.items())
+        for key, v in items:
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_value(v)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[i] += 1
+            row[-1] += value
+
+    @contextmanager
+    def time(self, **labels: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        for key, row in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), row[:-1]):
+                cumulative += count
+                le = f'le="{_fmt_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {_fmt_value(row[-1])}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Pipeline metrics ---------------------------------------------------------
+
+STAGES = ("queue", "decode", "preprocess", "detect", "upstream", "postprocess", "encode", "persist")
+
+STAGE_SECONDS = Histogram(
+    "portrait_stage_seconds", "Time spent per pipeline stage, summed per request.", ("endpoint", "theme", "stage")
+)
+STAGE_BYTES = Histogram(
+    "portrait_stage_bytes", "Bytes allocated for a stage's main buffers (decoded images, payloads), summed per request.",
+    ("endpoint", "stage"), buckets=BYTE_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "portrait_request_seconds", "End-to-end handler latency.", ("endpoint", "theme", "status")
+)
+UPSTREAM_RESPONSES = Counter(
+    "portrait_upstream_responses_total", "Upstream responses by HTTP status (error = transport failure).",
+    ("endpoint", "status"),
+)
+UPSTREAM_RETRIES = Counter(
+    "portrait_upstream_retries_total", "Extra upstream calls beyond one per delivered image.",
+    ("endpoint", "theme", "reason"),
+)
+FALLBACKS_400 = Counter(
+    "portrait_upstream_400_fallbacks_total", "Retries with the minimal payload after a 400 response.",
+    ("endpoint", "theme"),
+)
+DUPLICATE_VARIANTS = Counter(
+    "portrait_duplicate_variants_total", "Generated variants dropped as duplicates.", ("theme",)
+)
+WARMUP_SECONDS = Gauge("portrait_warmup_seconds", "Duration of each startup warm-up phase.", ("phase",))
+DETECTOR_BUILDS = Counter(
+    "portrait_detector_builds_total", "Face detector instances built (cascade / model load), by detector.", ("detector",)
+)
+UPSTREAM_TOKENS = Counter(
+    "portrait_upstream_tokens_total", "Token counts reported in upstream usageMetadata.",
+    ("endpoint", "theme", "kind"),
+)
+
+_USAGE_FIELDS = (
+    ("promptTokenCount", "prompt"),
+    ("candidatesTokenCount", "candidates"),
+    ("totalTokenCount", "total"),
+)
+
+
+def record_usage(endpoint: str, theme: str, usage) -> None:
+    if not isinstance(usage, dict):
+        return
+    for field, kind in _USAGE_FIELDS:
+        n = usage.get(field)
+        if isinstance(n, (int, float)) and n > 0:
+            UPSTREAM_TOKENS.inc(n, endpoint=endpoint, theme=theme, kind=kind)
+
+
+class RequestTrace:
+    """Per-request stage timer.
+
+    Stage times accumulate while the request runs (a stage may be entered
+    several times, e.g. one upstream call per variant) and are observed into
+    STAGE_SECONDS once per request in ``finish``. Entering a stage is also
+    a checkpoint: it raises ``cancel.Cancelled`` once the request's token is
+    cancelled, and ``deadlines.Exceeded`` past the request's deadline.
+    """
+
+    __slots__ = ("endpoint", "theme", "started", "durations", "allocated", "info", "token", "deadline")
+
+    def __init__(self, endpoint: str, theme: str = ""):
+        self.endpoint = endpoint
+        self.theme = theme
+        self.started = time.perf_counter()
+        self.durations: Dict[str, float] = {}
+        self.allocated: Dict[str, int] = {}
+        # Request-shape annotations (face count, image shapes, upstream outcomes) for capture and events
+        self.info: Dict[str, object] = {}
+        self.token = cancel.CancelToken()
+        # perf_counter() time by which the request must be done (deadlines.start); None = no deadline
+        self.deadline: Optional[float] = None
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+
+    def alloc(self, stage: str, nbytes: int) -> None:
+        self.allocated[stage] = self.allocated.get(stage, 0) + int(nbytes)
+
+    @contextmanager
+    def stage(self, name: str):
+        self.token.check(name)
+        t0 = time.perf_counter()
+        if self.deadline is not None and t0 >= self.deadline:
+            raise deadlines.Exceeded(name)
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def upstream(self, status: str) -> None:
+        """Count one upstream call's outcome, globally and for this request."""
+        UPSTREAM_RESPONSES.inc(endpoint=self.endpoint, status=status)
+        self.info.setdefault("upstream", []).append(status)
+
+    def retry(self, reason: str) -> None:
+        UPSTREAM_RETRIES.inc(endpoint=self.endpoint, theme=self.theme, reason=reason)
+        retries = self.info.setdefault("retries", {})
+        retries[reason] = retries.get(reason, 0) + 1
+
+    def usage(self, usage) -> None:
+        """Token counts from an upstream ``usageMetadata`` block."""
+        record_usage(self.endpoint, self.theme, usage)
+        if not isinstance(usage, dict):
+            return
+        tokens = self.info.setdefault("tokens", {})
+        for field, kind in _USAGE_FIELDS:
+            n = usage.get(field)
+            if isinstance(n, (int, float)) and n > 0:
+                tokens[kind] = tokens.get(kind, 0) + n
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """Server-Timing header value: one metric per stage plus the total, in ms."""
+        entries = [f"{stage};dur={self.durations[stage] * 1000:.1f}" for stage in STAGES if stage in self.durations]
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(entries)
+
+    def finish(self, status: int) -> None:
+        for stage, seconds in self.durations.items():
+            STAGE_SECONDS.observe(seconds, endpoint=self.endpoint, theme=self.theme, stage=stage)
+        for stage, nbytes in self.allocated.items():
+            STAGE_BYTES.observe(nbytes, endpoint=self.endpoint, stage=stage)
+        REQUEST_SECONDS.observe(self.elapsed(), endpoint=self.endpoint, theme=self.theme, status=str(status))
+
+
+# --- Admission / rate-limit / idempotency metrics -----------------------------
+
+ADMISSION_ACTIVE = Gauge("portrait_admission_active", "Requests holding a slot, per bulkhead pool.", ("pool",))
+ADMISSION_QUEUE_DEPTH = Gauge("portrait_admission_queue_depth", "Requests waiting for a slot.", ("pool",))
+ADMISSION_WAIT_SECONDS = Histogram(
+    "portrait_admission_wait_seconds", "Time spent queued before admission.", ("pool",)
+)
+ADMISSION_REJECTED = Counter(
+    "portrait_admission_rejected_total", "Requests refused while queuing: 503 for queue_full or timeout, 504 for deadline.", ("pool", "reason")
+)
+RATE_LIMITED = Counter("portrait_rate_limited_total", "Requests refused with 429 by per-client limits.", ("endpoint",))
+RATE_LIMIT_CLIENTS = Gauge("portrait_rate_limit_clients", "Client buckets currently tracked.", ("endpoint",))
+IDEMPOTENCY_HITS = Counter(
+    "portrait_idempotency_hits_total", "Requests served from an existing Idempotency-Key execution.",
+    ("endpoint", "outcome"),
+)
+IDEMPOTENCY_ENTRIES = Gauge("portrait_idempotency_entries", "Idempotency records held (in-flight and completed).")
+MEMORY_BUDGET_LIMIT = Gauge("portrait_memory_budget_bytes", "Process-wide memory budget for admitted requests.")
+MEMORY_BUDGET_IN_USE = Gauge("portrait_memory_budget_in_use_bytes", "Estimated peak bytes reserved by running requests.")
+MEMORY_ESTIMATE_BYTES = Histogram(
+    "portrait_request_estimated_peak_bytes", "Estimated peak footprint per request.", buckets=BYTE_BUCKETS
+)
+PROCESS_RSS = Gauge("portrait_process_resident_bytes", "Resident set size of the API process (sampled on scrape).")
+UPSTREAM_PART_BYTES = Histogram(
+    "portrait_upstream_part_bytes", "Encoded bytes of each inline image part sent upstream.",
+    ("endpoint", "part"), buckets=PAYLOAD_BUCKETS,
+)
+COMPOSITE_TEMPLATES = Counter(
+    "portrait_composite_template_total", "Composite requests naming a template_id, by lookup outcome.", ("outcome",)
+)
+CANCELLED = Counter(
+    "portrait_cancelled_total",
+    "Requests abandoned after the client disconnected, by the stage they stopped before (queue = still waiting).",
+    ("endpoint", "stage"),
+)
+DEADLINE_EXCEEDED = Counter(
+    "portrait_deadline_exceeded_total",
+    "Requests that ran out of time, by the stage that would not fit; outcome=partial returned the images done so far.",
+    ("endpoint", "stage", "outcome"),
+)
+OUTPUT_ARCHIVES = Counter("portrait_output_archive_entries_total", "Saved outputs streamed in ZIP downloads.")
+UPSTREAM_POOL_CALLS = Counter(
+    "portrait_upstream_pool_calls_total", "Upstream calls per pool member by HTTP status (error = transport failure).",
+    ("upstream", "status"),
+)
+UPSTREAM_POOL_TOKENS = Counter(
+    "portrait_upstream_pool_tokens_total", "Total tokens reported in usageMetadata, per pool member.", ("upstream",)
+)
+UPSTREAM_POOL_COOLDOWNS = Counter(
+    "portrait_upstream_pool_cooldowns_total", "Times a pool member was taken out of rotation (429 or repeated failures).",
+    ("upstream", "reason"),
+)
+UPSTREAM_POOL_EXHAUSTED = Counter(
+    "portrait_upstream_pool_exhausted_total", "Calls that found no pool member in rotation."
+)
+UPSTREAM_POOL_INFLIGHT = Gauge("portrait_upstream_pool_inflight", "Upstream calls in flight per pool member.", ("upstream",))
+UPSTREAM_POOL_HEADROOM = Gauge(
+    "portrait_upstream_pool_headroom",
+    "Free share of a pool member's per-minute quota, 1 when untracked (sampled on scrape).", ("upstream",),
+)
+UPSTREAM_POOL_AVAILABLE = Gauge(
+    "portrait_upstream_pool_available", "1 while a pool member is in rotation (sampled on scrape).", ("upstream",)
+)
+LOCAL_RENDERS = Counter(
+    "portrait_local_renders_total",
+    "Local ID-photo renders by outcome: ok, or the first check that failed (the request then went upstream or got a 422).",
+    ("theme", "outcome"),
+)
+PREFLIGHT_ISSUES = Counter(
+    "portrait_preflight_issues_total", "Input photo issues found by preflight, by check and severity (error = refused).",
+    ("theme", "check", "severity"),
+)
@@ -0,0 +1,152 @@
+"""Upstream payload planning: resolution and codec for every image part.
+
+Upload time to the model is a large share of request latency from distant
+regions, and bytes beyond what the model can use are wasted. Gemini
+downsamples image inputs into 768 px tiles, and the outputs here are at
+most 1080x1620. So the planner fits every inline image part to a budget:
+a maximum long side and a maximum encoded size.
+
+Parts:
+- ``main``: the generate input, or the user portrait in a composite
+- ``subject``: one person cropped from a multi-subject photo
+- ``identity``: a face close-up sent alongside the main image
+- ``scene``: the composite reference scene
+
+``PART_BUDGETS`` holds the defaults, and ``THEME_BUDGETS`` overrides them
+where a theme needs more or less detail. ID photos keep the face sharp;
+stylised themes (anime, meme, animal) get less. ``PAYLOAD_BUDGET_SCALE``
+scales every budget: the side by the factor, the bytes by its square.
+``PAYLOAD_PLANNER=0`` sends the parts exactly as the pipeline produced them.
+
+``fit`` passes a part through unchanged when it is already within budget.
+Otherwise it downscales to the side limit and encodes with
+``PAYLOAD_CODEC``: JPEG by default, or WebP when Pillow has it. It then
+steps down the quality ladder, and after that the size, until the bytes
+fit.
+"""
+
+import logging
+import os
+from io import BytesIO
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from PIL import Image, features
+
+logger = logging.getLogger("ai_portrait_studio")
+
+ENABLED = os.getenv("PAYLOAD_PLANNER", "1").lower() not in {"0", "false", "no"}
+try:
+    BUDGET_SCALE = max(0.1, float(os.getenv("PAYLOAD_BUDGET_SCALE", "1.0")))
+except Exception:
+    BUDGET_SCALE = 1.0
+
+_CODECS = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+CODEC = os.getenv("PAYLOAD_CODEC", "jpeg").lower()
+if CODEC not in _CODECS or (CODEC == "webp" and not features.check("webp")):
+    CODEC = "jpeg"
+
+# Formats the upstream accepts as-is when a part is already within budget
+PASSTHROUGH_MIME = {"image/jpeg", "image/png", "image/webp"}
+
+QUALITY_LADDER = (90, 85, 80, 72)
+# Each further step shrinks the image by this factor once the ladder is exhausted
+SHRINK_STEP = 0.8
+MIN_SIDE = 256
+
+
+class Budget(NamedTuple):
+    max_side: int
+    max_bytes: int
+
+    def scaled(self, factor: float) -> "Budget":
+        return Budget(max(MIN_SIDE, int(self.max_side * factor)), max(16 * 1024, int(self.max_bytes * factor * factor)))
+
+
+PART_BUDGETS: Dict[str, Budget] = {
+    "main": Budget(1280, 600 * 1024),
+    "subject": Budget(1024, 400 * 1024),
+    "identity": Budget(512, 120 * 1024),
+    "scene": Budget(1536, 800 * 1024),
+}
+
+_ID_PHOTO = {"main": Budget(1280, 700 * 1024), "identity": Budget(640, 160 * 1024)}
+_TALL_PHOTOREAL = {"main": Budget(1536, 800 * 1024)}
+_STYLISED = {"main": Budget(1024, 400 * 1024)}
+
+THEME_BUDGETS: Dict[str, Dict[str, Budget]] = {
+    "passport": _ID_PHOTO,
+    "resume": _ID_PHOTO,
+    # 1080x1620 photoreal outputs
+    "model": _TALL_PHOTOREAL,
+    "kpop": _TALL_PHOTOREAL,
+    "actor": _TALL_PHOTOREAL,
+    "lookbook": _TALL_PHOTOREAL,
+    "wedding": _TALL_PHOTOREAL,
+    # Stylised renderings keep likeness from coarse features
+    "anime": _STYLISED,
+    "fantasy_anime": _STYLISED,
+    "meme": _STYLISED,
+    "animal": _STYLISED,
+}
+
+
+def budget_for(theme: Optional[str], part: str, scale: Optional[float] = None) -> Budget:
+    budget = THEME_BUDGETS.get(theme or "", {}).get(part) or PART_BUDGETS[part]
+    scale = BUDGET_SCALE if scale is None else scale
+    return budget.scaled(scale) if scale != 1.0 else budget
+
+
+def _encode(img: Image.Image, codec: str, quality: int) -> bytes:
+    fmt, _ = _CODECS[codec]
+    buf = BytesIO()
+    if fmt == "JPEG":
+        img.save(buf, format=fmt, quality=quality, optimize=True)
+    else:
+        img.save(buf, format=fmt, quality=quality, method=4)
+    return buf.getvalue()
+
+
+def _flatten(img: Image.Image) -> Image.Image:
+    # The model reads photos; transparency carries nothing, so composite onto white
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        base = Image.new("RGB", rgba.size, (255, 255, 255))
+        base.paste(rgba, mask=rgba.getchannel("A"))
+        return base
+    return img.convert("RGB")
+
+
+def fit(img_bytes: bytes, mime: str, budget: Budget, codec: str = CODEC) -> Tuple[bytes, str]:
+    """Encoded image within ``budget``; on any failure the input is returned unchanged."""
+    try:
+        img = Image.open(BytesIO(img_bytes))
+        w, h = img.size
+        if max(w, h) <= budget.max_side and len(img_bytes) <= budget.max_bytes and mime in PASSTHROUGH_MIME:
+            return img_bytes, mime
+        if img.format == "JPEG":
+            img.draft("RGB", (budget.max_side, budget.max_side))
+        img = _flatten(img)
+        side = min(budget.max_side, max(img.size))
+        best = None
+        while True:
+            if max(img.size) > side:
+                img.thumbnail((side, side), Image.LANCZOS)
+            for quality in QUALITY_LADDER:
+                best = _encode(img, codec, quality)
+                if len(best) <= budget.max_bytes:
+                    return best, _CODECS[codec][1]
+            if side <= MIN_SIDE:
+                break
+            side = max(MIN_SIDE, int(side * SHRINK_STEP))
+        # Smallest we are willing to go; still better than the original
+        return best, _CODECS[codec][1]
+    except Exception as e:
+        logger.warning("payload fit failed: %s", e)
+        return img_bytes, mime
+
+
+def plan(img_bytes: bytes, mime: str, theme: Optional[str], part: str) -> Tuple[bytes, str]:
+    """``fit`` with the configured budget for this theme and part (no-op when disabled)."""
+    if not ENABLED:
+        return img_bytes, mime
+    return fit(img_bytes, mime, budget_for(theme, part))
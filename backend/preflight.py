@@ -0,0 +1,191 @@
+"""Input quality gate run on the working image before any upstream call.
+
+A faceless, blurry or badly exposed upload used to cost a full upstream
+round trip, after which the ID crop found no face and fell back to a centre
+crop, and the user retried. ``run`` decodes the working image once, finds
+the faces (which the rest of the pipeline reuses), and measures:
+
+- face: at least one face, and its box height in working-image pixels
+- blur: Laplacian variance of the face at a fixed 128 px width (the
+  middle of the frame without a face) over its squared mean luma, so it
+  depends on neither resolution nor exposure
+- exposure: median luma of the face (of the frame without one) and the
+  share of the face at 250 or above
+- orientation: with no upright face, the frame is tried at 90, 180 and 270
+  degrees on a small copy; a face found there means the photo is sideways
+  (no EXIF orientation to undo it). With eye landmarks (YuNet), a tilted
+  head is a warning.
+
+Limits are per theme: strict for passport/resume, looser for composite
+user photos, and warn-mostly for the creative themes. Each finding is an
+``Issue`` with a severity. ``PREFLIGHT_MODE`` sets what errors do:
+
+- ``enforce`` (default): any error refuses the request with a 422 listing
+  the issues; warnings travel with the result
+- ``warn``: errors are reported as warnings
+- ``off``: only the faces are detected
+"""
+
+import math
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import lazy
+from detectors import FaceBox, cv2_available, detect_faces_bgr
+
+np = lazy.module("numpy")
+cv2 = lazy.module("cv2")
+
+MODE = os.getenv("PREFLIGHT_MODE", "enforce").lower()
+if MODE not in {"enforce", "warn", "off"}:
+    MODE = "enforce"
+
+# Long side of the copy used for the frame histogram and the rotated face search
+_SMALL_SIDE = 480
+# Face sample width for sharpness, and the lowest mean luma it normalises by
+_SAMPLE_WIDTH = 128
+_SHARPNESS_MEAN_FLOOR = 64.0
+# Head roll (degrees) from the eye line that counts as tilted
+_MAX_TILT = 12.0
+
+
+class Limits(NamedTuple):
+    no_face: str  # severity when no face is found
+    face_px: Tuple[float, float]  # error below, warning below (face box height)
+    sharpness: Tuple[float, float]  # error below, warning below
+    luma: Tuple[Tuple[float, float], Tuple[float, float]]  # error outside, warning outside (median luma)
+    clipped: Tuple[float, float]  # error above, warning above (share of face at 250+)
+    rotated: str  # severity of a sideways photo
+
+
+REGULATED = Limits("error", (64, 128), (2.5, 6), ((35, 235), (70, 210)), (0.25, 0.05), "error")
+COMPOSITE = Limits("error", (32, 96), (1.5, 4), ((25, 240), (55, 220)), (0.35, 0.10), "error")
+DEFAULT = Limits("warning", (0, 64), (0.75, 2.5), ((15, 245), (45, 225)), (0.50, 0.15), "warning")
+
+
+class Issue(NamedTuple):
+    check: str
+    severity: str  # "error" or "warning"
+    message: str
+    value: float
+    limit: float
+
+
+class Report(NamedTuple):
+    faces: List[FaceBox]
+    issues: List[Issue]
+    measures: Dict[str, float]
+
+    @property
+    def errors(self) -> List[Issue]:
+        return [i for i in self.issues if i.severity == "error"]
+
+    @property
+    def warnings(self) -> List[Issue]:
+        return [i for i in self.issues if i.severity == "warning"]
+
+
+def limits_for(theme: str) -> Limits:
+    if theme in {"passport", "resume"}:
+        return REGULATED
+    if theme == "composite":
+        return COMPOSITE
+    return DEFAULT
+
+
+def face_region(shape, face: FaceBox) -> Tuple[slice, slice]:
+    """Inner face (cheeks, eyes, nose), free of hair and background."""
+    h, w = shape[:2]
+    x, y, fw, fh = face[:4]
+    return (slice(max(0, int(y + fh * 0.25)), min(h, int(y + fh * 0.85))),
+            slice(max(0, int(x + fw * 0.2)), min(w, int(x + fw * 0.8))))
+
+
+def sharpness(gray) -> float:
+    """Laplacian variance of ``gray`` at a fixed width over its squared mean (x 1e4), so neither size nor exposure moves it."""
+    if not gray.size:
+        return 0.0
+    sample = cv2.resize(gray, (_SAMPLE_WIDTH, max(1, int(_SAMPLE_WIDTH * gray.shape[0] / gray.shape[1]))),
+                        interpolation=cv2.INTER_AREA).astype(np.float32)
+    # Below the floor, JPEG noise in a dark photo would read as detail
+    mean = max(_SHARPNESS_MEAN_FLOOR, float(sample.mean()))
+    return float(cv2.Laplacian(sample, cv2.CV_32F).var()) / (mean * mean) * 1e4
+
+
+def _rotation(small) -> int:
+    """Clockwise degrees that bring a sideways face upright, 0 when none is found."""
+    for degrees, code in ((90, cv2.ROTATE_90_CLOCKWISE), (270, cv2.ROTATE_90_COUNTERCLOCKWISE), (180, cv2.ROTATE_180)):
+        if detect_faces_bgr(cv2.rotate(small, code), min_size=24):
+            return degrees
+    return 0
+
+
+def _grade(issues: List[Issue], check: str, value: float, bounds: Tuple[float, float], below: bool, message: str) -> None:
+    """Append an error or warning when ``value`` is past ``bounds`` (error, warning)."""
+    for severity, limit in zip(("error", "warning"), bounds):
+        if (value < limit) if below else (value > limit):
+            issues.append(Issue(check, severity, message, round(value, 3), limit))
+            return
+
+
+def run(img_bytes: bytes, theme: str, faces: Optional[List[FaceBox]] = None) -> Report:
+    """Faces and quality issues of an encoded working image."""
+    if not cv2_available():
+        return Report([], [], {})
+    img = cv2.imdecode(np.frombuffer(img_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return Report([], [], {})
+    if faces is None:
+        faces = detect_faces_bgr(img, min_size=48)
+    if MODE == "off":
+        return Report(faces, [], {})
+
+    limits = limits_for(theme)
+    issues: List[Issue] = []
+    measures: Dict[str, float] = {"faces": len(faces)}
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape
+    if faces:
+        face = faces[0]
+        region = gray[face_region(gray.shape, face)]
+        measures["face_px"] = face.h
+        _grade(issues, "face_size", face.h, limits.face_px, True, "Face is too small; move closer or use a larger photo")
+        if face.eyes is not None:
+            (rx, ry), (lx, ly) = face.eyes
+            tilt = abs(math.degrees(math.atan2(ly - ry, lx - rx)))
+            tilt = min(tilt, 180.0 - tilt)
+            measures["tilt"] = round(tilt, 1)
+            if tilt > _MAX_TILT:
+                issues.append(Issue("tilt", "warning", "Head is tilted; hold the camera level", measures["tilt"], _MAX_TILT))
+    else:
+        s = min(1.0, _SMALL_SIDE / float(max(h, w)))
+        small = cv2.resize(img, (max(1, int(w * s)), max(1, int(h * s))), interpolation=cv2.INTER_AREA) if s < 1 else img
+        rotate = _rotation(small)
+        measures["rotate"] = rotate
+        if rotate:
+            issues.append(Issue("orientation", limits.rotated, f"Photo is sideways; rotate it {rotate} degrees clockwise",
+                                rotate, 0))
+            return Report(faces, _demote(issues), measures)
+        issues.append(Issue("face", limits.no_face, "No face found; use a clear, front-facing photo", 0, 1))
+        region = gray[h // 4:h - h // 4, w // 4:w - w // 4]
+
+    # One histogram serves the median and the clipped share
+    hist = np.bincount(region.ravel(), minlength=256)
+    total = max(1, int(hist.sum()))
+    median = float(np.searchsorted(np.cumsum(hist), total / 2.0))
+    clipped = float(hist[250:].sum()) / total
+    measures.update(luma=median, clipped=round(clipped, 4), sharpness=round(sharpness(region), 1))
+
+    _grade(issues, "blur", measures["sharpness"], limits.sharpness, True, "Photo is blurry; hold still and focus on the face")
+    (err_lo, err_hi), (warn_lo, warn_hi) = limits.luma
+    _grade(issues, "exposure", median, (err_lo, warn_lo), True, "Photo is too dark; use more even light")
+    _grade(issues, "exposure", median, (err_hi, warn_hi), False, "Photo is too bright; avoid direct light on the face")
+    if faces:
+        _grade(issues, "highlights", clipped, limits.clipped, False, "Part of the face is washed out; avoid flash and direct light")
+    return Report(faces, _demote(issues), measures)
+
+
+def _demote(issues: List[Issue]) -> List[Issue]:
+    if MODE == "warn":
+        return [i._replace(severity="warning") for i in issues]
+    return issues
@@ -0,0 +1,216 @@
+"""Sampled request profiling for generate/composite.
+
+A profiled request gets a stack sampler (a thread that snapshots the request
+thread's frames every ``PROFILE_INTERVAL_MS``) and a tracemalloc peak-memory
+window. Requests are profiled from the start with probability
+``PROFILE_SAMPLE_RATE``. Every other request arms a timer: if it is still
+running after ``PROFILE_SLOW_SECONDS``, profiling starts then and covers the
+slow tail. Results go to ``PROFILE_DIR`` as a JSON summary plus a
+``.folded`` file of collapsed stacks for flamegraph tools.
+
+tracemalloc is process-wide: while several profiled requests overlap, the
+reported peak covers all of them.
+"""
+
+import heapq
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from typing import Optional
+
+logger = logging.getLogger("ai_portrait_studio")
+
+try:
+    PROFILE_SAMPLE_RATE = min(1.0, max(0.0, float(os.getenv("PROFILE_SAMPLE_RATE", "0"))))
+except Exception:
+    PROFILE_SAMPLE_RATE = 0.0
+try:
+    PROFILE_SLOW_SECONDS = max(0.0, float(os.getenv("PROFILE_SLOW_SECONDS", "0")))
+except Exception:
+    PROFILE_SLOW_SECONDS = 0.0
+try:
+    PROFILE_INTERVAL_MS = max(1.0, float(os.getenv("PROFILE_INTERVAL_MS", "5")))
+except Exception:
+    PROFILE_INTERVAL_MS = 5.0
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(__file__), "profiles"))
+# Frames kept per sample (innermost last)
+MAX_STACK_DEPTH = 64
+
+
+_tm_lock = threading.Lock()
+_tm_users = 0
+
+
+def _tracemalloc_acquire() -> None:
+    global _tm_users
+    with _tm_lock:
+        if _tm_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        _tm_users += 1
+
+
+def _tracemalloc_release() -> int:
+    """Return the traced peak (bytes) and stop tracing when the last user leaves."""
+    global _tm_users
+    with _tm_lock:
+        _, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        _tm_users = max(0, _tm_users - 1)
+        if _tm_users == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+    return peak
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, target_ident: int, interval: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.target_ident = target_ident
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.target_ident)
+            if frame is None:
+                continue
+            self.stacks[_collapse(frame)] += 1
+            self.samples += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join(timeout=1.0)
+
+
+class Profile:
+    """Profiling state for one request; see ``start``/``finish``."""
+
+    def __init__(self, trace):
+        self.trace = trace
+        self.ident = threading.get_ident()
+        self.trigger: Optional[str] = None
+        self.started_at = 0.0
+        self._sampler: Optional[_Sampler] = None
+        self._lock = threading.Lock()
+        self._done = False
+
+    def _begin(self, trigger: str) -> None:
+        with self._lock:
+            if self._done or self.trigger is not None:
+                return
+            self.trigger = trigger
+            self.started_at = self.trace.elapsed()
+            _tracemalloc_acquire()
+            self._sampler = _Sampler(self.ident, PROFILE_INTERVAL_MS / 1000.0)
+            self._sampler.start()
+
+    def finish(self, status: int) -> None:
+        with self._lock:
+            self._done = True
+            if self.trigger is None:
+                return
+            self._sampler.stop()
+            peak = _tracemalloc_release()
+        try:
+            self._write(status, peak)
+        except Exception as e:
+            logger.warning("failed to write profile: %s", e)
+
+    def _write(self, status: int, peak: int) -> None:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        trace = self.trace
+        stem = f"{time.strftime('%Y%m%dT%H%M%S')}-{trace.endpoint}-{trace.theme or 'none'}-{uuid.uuid4().hex[:8]}"
+        summary = {
+            "endpoint": trace.endpoint,
+            "theme": trace.theme,
+            "status": status,
+            "trigger": self.trigger,
+            "elapsed_s": round(trace.elapsed(), 4),
+            "profiled_from_s": round(self.started_at, 4),
+            "stages_s": {k: round(v, 4) for k, v in trace.durations.items()},
+            "tracemalloc_peak_bytes": peak,
+            "samples": self._sampler.samples,
+            "interval_ms": PROFILE_INTERVAL_MS,
+            "top_stacks": [
+                {"count": n, "stack": stack} for stack, n in self._sampler.stacks.most_common(20)
+            ],
+        }
+        with open(os.path.join(PROFILE_DIR, stem + ".json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        with open(os.path.join(PROFILE_DIR, stem + ".folded"), "w") as f:
+            for stack, n in self._sampler.stacks.items():
+                f.write(f"{stack} {n}\n")
+        logger.info("profile written %s (trigger=%s, %.2fs)", stem, self.trigger, trace.elapsed())
+
+
+class _Watchdog(threading.Thread):
+    """One thread that starts profiling on requests outliving PROFILE_SLOW_SECONDS."""
+
+    def __init__(self):
+        super().__init__(name="profile-watchdog", daemon=True)
+        self._cond = threading.Condition()
+        self._heap = []  # (due, seq, profile)
+        self._seq = 0
+
+    def watch(self, prof: Profile, delay: float) -> None:
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._heap, (time.monotonic() + delay, self._seq, prof))
+            self._cond.notify()
+
+    def run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                due, _, prof = self._heap[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                heapq.heappop(self._heap)
+            if not prof._done:
+                prof._begin("slow")
+
+
+_watchdog: Optional[_Watchdog] = None
+_watchdog_lock = threading.Lock()
+
+
+def _get_watchdog() -> _Watchdog:
+    global _watchdog
+    if _watchdog is None:
+        with _watchdog_lock:
+            if _watchdog is None:
+                _watchdog = _Watchdog()
+                _watchdog.start()
+    return _watchdog
+
+
+def start(trace) -> Optional[Profile]:
+    """Start profiling for the current request thread, or None when disabled."""
+    if PROFILE_SAMPLE_RATE <= 0 and PROFILE_SLOW_SECONDS <= 0:
+        return None
+    prof = Profile(trace)
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        prof._begin("sampled")
+    elif PROFILE_SLOW_SECONDS > 0:
+        _get_watchdog().watch(prof, PROFILE_SLOW_SECONDS)
+    return prof
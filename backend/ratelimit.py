@@ -0,0 +1,144 @@
+"""Per-client token-bucket rate limits.
+
+A client is identified by its ``X-API-Key`` header, or by its IP address if
+there is no key. ``X-Forwarded-For`` is used for the IP only when
+``RATE_LIMIT_TRUST_PROXY`` is set. Generate and composite have separate
+budgets: a sustained rate per minute plus a burst allowance. A generate
+request costs one token per requested shot, since each shot is an upstream
+call.
+
+Buckets live in an ``OrderedDict`` of ``key -> [tokens, updated_at]`` in
+least-recently-used order. A bucket idle long enough to refill completely
+is indistinguishable from a new one, so it is dropped. The table is also
+capped at ``RATE_LIMIT_MAX_CLIENTS``. Memory therefore stays flat however
+many distinct IPs show up.
+
+``FAIR_QUEUE_WEIGHTS`` (``apikey=weight,...``) gives selected API keys a
+larger share of a saturated admission pool. Everyone else has weight 1.
+
+Like ``admission``, this runs on the event loop only and needs no locking.
+"""
+
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import metrics
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return max(0.0, float(os.getenv(name, str(default))))
+    except Exception:
+        return default
+
+
+TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "0").lower() in {"1", "true", "yes"}
+try:
+    MAX_CLIENTS = max(1, int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "100000")))
+except Exception:
+    MAX_CLIENTS = 100000
+
+
+def _hash_key(api_key: str) -> str:
+    # Never keep raw credentials in memory tables or logs
+    return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def _parse_weights(spec: str) -> Dict[str, float]:
+    weights = {}
+    for item in spec.split(","):
+        key, sep, value = item.strip().rpartition("=")
+        if not sep or not key:
+            continue
+        try:
+            weights[_hash_key(key)] = max(0.01, float(value))
+        except ValueError:
+            pass
+    return weights
+
+
+WEIGHTS = _parse_weights(os.getenv("FAIR_QUEUE_WEIGHTS", ""))
+
+
+class RateLimited(Exception):
+    def __init__(self, endpoint: str, retry_after: int):
+        super().__init__(f"rate limit exceeded for {endpoint}")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class TokenBuckets:
+    def __init__(self, name: str, per_minute: float, burst: float, max_clients: int = MAX_CLIENTS):
+        self.name = name
+        self.rate = per_minute / 60.0  # tokens per second
+        self.burst = max(1.0, burst)
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _evict(self, now: float) -> None:
+        # Front of the dict is least recently used; stop at the first bucket still refilling
+        full_after = self.burst / self.rate
+        while self._buckets:
+            key, (_, updated) = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self.max_clients and now - updated < full_after:
+                break
+            del self._buckets[key]
+
+    def take(self, key: str, cost: float = 1.0) -> None:
+        """Spend ``cost`` tokens or raise RateLimited with the seconds until they are available."""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        cost = min(cost, self.burst)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        self._evict(now)
+        metrics.RATE_LIMIT_CLIENTS.set(len(self._buckets), endpoint=self.name)
+        if bucket[0] < cost:
+            metrics.RATE_LIMITED.inc(endpoint=self.name)
+            wait = (cost - bucket[0]) / self.rate
+            raise RateLimited(self.name, max(1, int(wait + 0.999)))
+        bucket[0] -= cost
+
+
+LIMITS: Dict[str, TokenBuckets] = {
+    "generate": TokenBuckets(
+        "generate", _env_float("RATE_LIMIT_GENERATE_PER_MIN", 30), _env_float("RATE_LIMIT_GENERATE_BURST", 10)
+    ),
+    "composite": TokenBuckets(
+        "composite", _env_float("RATE_LIMIT_COMPOSITE_PER_MIN", 10), _env_float("RATE_LIMIT_COMPOSITE_BURST", 4)
+    ),
+}
+
+
+def client_key(request) -> str:
+    api_key = request.headers.get("x-api-key")
+    if api_key:
+        return _hash_key(api_key)
+    if TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return "ip:" + forwarded.split(",", 1)[0].strip()
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+
+def weight_for(key: str) -> float:
+    return WEIGHTS.get(key, 1.0)
+
+
+def check(endpoint: str, key: str, cost: float = 1.0) -> None:
+    limiter: Optional[TokenBuckets] = LIMITS.get(endpoint)
+    if limiter is not None:
+        limiter.take(key, cost)
@@ -1,25 +1,45 @@
+import asyncio
 import base64
+import hmac
+import json
 import os
+import re
+import time
 import uuid
-from typing import Literal, Optional, Dict, Any
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Literal, Optional
 
 import requests
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from PIL import Image
-from io import BytesIO
 import random
 
-# Optional deps for regulated cropping (OpenCV)
-try:
-    import numpy as np  # type: ignore
-    import cv2  # type: ignore
-    CV2_AVAILABLE = True
-except Exception:
-    CV2_AVAILABLE = False
-    np = None  # type: ignore
-    cv2 = None  # type: ignore
+import admission
+import archive
+import cancel
+import capture
+import deadlines
+import events
+import gemini_parse
+import gallery
+import idempotency
+import idphoto
+import imaging
+import ingest
+import jsonlog
+import metrics
+import payload
+import preflight
+import profiling
+import ratelimit
+import templates
+import upstreams
+import warmup
+import workers
 
 
 import logging
@@ -27,16 +47,24 @@ import logging
 logger = logging.getLogger("ai_portrait_studio")
 logger.setLevel(logging.INFO)
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 # Control how many variants to generate per request (single-subject path)
 try:
     SHOT_COUNT = max(1, int(os.getenv("MULTI_SHOT_COUNT", "1")))
 except Exception:
     SHOT_COUNT = 1
-GEMINI_ENDPOINT = (
-    "https://generativelanguage.googleapis.com/v1beta/models/"
-    "gemini-2.5-flash-image-preview:generateContent"
-)
+# Composite fan-out: references per batch, and how many of one batch run at once
+try:
+    COMPOSITE_BATCH_MAX = max(1, int(os.getenv("COMPOSITE_BATCH_MAX", "8")))
+except Exception:
+    COMPOSITE_BATCH_MAX = 8
+try:
+    COMPOSITE_BATCH_CONCURRENCY = max(1, int(os.getenv("COMPOSITE_BATCH_CONCURRENCY", "3")))
+except Exception:
+    COMPOSITE_BATCH_CONCURRENCY = 3
+# Shared keep-alive pool for upstream calls (connections are primed during warm-up)
+_upstream = requests.Session()
+_upstream.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32))
+_upstream.mount("http://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32))
 
 
 class GenerateBody(BaseModel):
@@ -82,13 +110,37 @@ class CompositeBody(BaseModel):
     # User portrait to cast into reference image
     user_image: str
     user_mime_type: Optional[str] = None
-    # Reference scene/character/poster to merge into
-    ref_image: str
+    # Reference scene/character/poster to merge into: inline, or a registered template
+    ref_image: Optional[str] = None
     ref_mime_type: Optional[str] = None
+    template_id: Optional[str] = None
     # Optional role/style hints (freeform)
     hint: Optional[str] = None
 
 
+class CompositeRef(BaseModel):
+    ref_image: Optional[str] = None
+    ref_mime_type: Optional[str] = None
+    template_id: Optional[str] = None
+    hint: Optional[str] = None
+
+
+class CompositeBatchBody(BaseModel):
+    user_image: str
+    user_mime_type: Optional[str] = None
+    refs: List[CompositeRef]
+    # Used for references without their own hint
+    hint: Optional[str] = None
+    # NDJSON, one line per reference as it finishes, instead of one collected response
+    stream: bool = False
+
+
+class TemplateBody(BaseModel):
+    image: str  # base64-encoded reference scene (PNG or JPEG)
+    mime_type: Optional[str] = None
+    name: Optional[str] = None
+
+
 def _fantasy_scenario() -> str:
     roles = [
         "elven archer in a moonlit forest",
@@ -875,7 +927,131 @@ def normalize_mime(mime_type: Optional[str]) -> str:
     return "image/png"
 
 
-app = FastAPI(title="AI Portrait Studio API")
+def _inline_part(trace: metrics.RequestTrace, part: str, data: bytes, mime: str) -> Dict[str, Any]:
+    """An inlineData part for an image already fitted by ``payload.plan``."""
+    metrics.UPSTREAM_PART_BYTES.observe(len(data), endpoint=trace.endpoint, part=part)
+    return {"inlineData": {"mimeType": mime, "data": base64.b64encode(data).decode("utf-8")}}
+
+
+def _post_gemini(body: Dict[str, Any], trace: metrics.RequestTrace) -> requests.Response:
+    """POST to the best upstream in the pool, moving on to the next after a 429 or transport error."""
+    tried: List[str] = []
+    last: Optional[requests.Response] = None
+    last_error: Optional[Exception] = None
+    while True:
+        timeout = deadlines.upstream_timeout(trace)
+        try:
+            upstream = upstreams.POOL.acquire(exclude=tried)
+        except upstreams.Unavailable as e:
+            if last is not None:
+                return last
+            if last_error is not None:
+                raise HTTPException(status_code=502, detail=f"Upstream error: {last_error}")
+            raise HTTPException(status_code=503, detail="Upstream quota exhausted, retry later",
+                                headers={"Retry-After": str(e.retry_after)})
+        tried.append(upstream.name)
+        t0 = time.perf_counter()
+        try:
+            with trace.stage("upstream"):
+                resp = _upstream.post(
+                    upstream.endpoint,
+                    headers={
+                        "Content-Type": "application/json",
+                        "X-goog-api-key": upstream.key,
+                    },
+                    json=body,
+                    timeout=timeout,
+                )
+        except requests.Timeout as e:
+            upstreams.POOL.release(upstream, "error")
+            trace.upstream("error")
+            if timeout < deadlines.UPSTREAM_TIMEOUT_SECONDS:
+                # The call was cut short by the request's deadline, not by the upstream limit
+                raise deadlines.Exceeded("upstream")
+            logger.exception("Upstream request error: %s", e)
+            raise HTTPException(status_code=502, detail=f"Upstream error: {e}")
+        except requests.RequestException as e:
+            upstreams.POOL.release(upstream, "error")
+            trace.upstream("error")
+            logger.warning("Upstream %s request error: %s", upstream.name, e)
+            last_error = e
+            trace.retry("upstream_failover")
+            continue
+        except BaseException:
+            # Cancelled or out of time on entering the stage: nothing was sent
+            upstreams.POOL.release(upstream, "abandoned")
+            raise
+        status = str(resp.status_code)
+        upstreams.POOL.release(upstream, status, upstreams.retry_after(resp) if status == "429" else None)
+        trace.upstream(status)
+        trace.alloc("upstream", len(resp.request.body or b"") + len(resp.content))
+        if status == "429":
+            last, last_error = resp, None
+            trace.retry("upstream_failover")
+            continue
+        if status == "200":
+            deadlines.UPSTREAM.observe(time.perf_counter() - t0)
+        resp.upstream = upstream
+        return resp
+
+
+def _extract_inline_image(resp: requests.Response, trace: metrics.RequestTrace) -> bytes:
+    """Return the first inlineData image (decoded) of a 200 response; record token usage."""
+    try:
+        with trace.stage("upstream"):
+            found = gemini_parse.extract(resp.content)
+    except ValueError as e:
+        logger.exception("Failed to parse upstream response: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to decode model image")
+    trace.usage(found.usage)
+    upstreams.POOL.usage(getattr(resp, "upstream", None), found.usage)
+    if not found.data:
+        logger.error("No image returned from model for %s theme=%s", trace.endpoint, trace.theme)
+        raise HTTPException(status_code=500, detail="No image returned from model")
+    return found.data
+
+
+OUTPUTS_DIR = os.getenv("OUTPUTS_DIR", os.path.join(os.path.dirname(__file__), "static", "outputs"))
+
+
+def _save_output(png_bytes: bytes, trace: metrics.RequestTrace, composition: Optional[str] = None) -> str:
+    # Save output image into backend/static/outputs and return its static URL
+    os.makedirs(OUTPUTS_DIR, exist_ok=True)
+    out_id = uuid.uuid4().hex
+    with open(os.path.join(OUTPUTS_DIR, f"{out_id}.png"), "wb") as f:
+        f.write(png_bytes)
+    url = f"/outputs/{out_id}.png"
+    trace.info.setdefault("outputs", []).append(events.image_info(png_bytes))
+    try:
+        gallery.INDEX.add(out_id, url, png_bytes, trace.endpoint, trace.theme, composition)
+    except Exception as e:
+        # The file is saved either way; a missing index row only hides it from /api/outputs
+        logger.warning("gallery index insert failed for %s: %s", out_id, e)
+    return url
+
+
+def _backfill_gallery() -> None:
+    try:
+        gallery.INDEX.backfill(OUTPUTS_DIR)
+    except Exception as e:
+        logger.warning("gallery backfill failed: %s", e)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background so /health answers at once; /ready flips when done
+    warm = asyncio.ensure_future(run_in_threadpool(warmup.run, _upstream, upstreams.POOL.endpoints()))
+    # Index outputs saved before the gallery existed (no-op once the index has rows)
+    backfill = asyncio.ensure_future(run_in_threadpool(_backfill_gallery))
+    yield
+    for task in (warm, backfill):
+        if not task.done():
+            task.cancel()
+    workers.shutdown()
+    jsonlog.close_all()
+
+
+app = FastAPI(title="AI Portrait Studio API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -891,12 +1067,268 @@ def health():
     return {"ok": True}
 
 
+def _resident_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+@app.get("/ready")
+def ready():
+    phases_ms = {k: round(v * 1000, 1) for k, v in warmup.phases.items()}
+    if not warmup.is_ready():
+        return JSONResponse({"ready": False, "warmup_ms": phases_ms}, status_code=503)
+    return {"ready": True, "warmup_ms": phases_ms, "warmup_error": warmup.error}
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    rss = _resident_bytes()
+    if rss:
+        metrics.PROCESS_RSS.set(rss)
+    upstreams.POOL.sample()
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def _traced(trace: metrics.RequestTrace, response: Response, shape: Dict[str, Any], fn, *args):
+    status = 500
+    prof = profiling.start(trace)
+    try:
+        with cancel.bound(trace.token):
+            result = fn(*args)
+        if isinstance(result, dict) and trace.info.get("warnings"):
+            result["warnings"] = trace.info["warnings"]
+        status = 200
+        response.headers["Server-Timing"] = trace.server_timing()
+        response.headers["Timing-Allow-Origin"] = "*"
+        return result
+    except HTTPException as e:
+        status = e.status_code
+        e.headers = {**(e.headers or {}), "Server-Timing": trace.server_timing(), "Timing-Allow-Origin": "*"}
+        raise
+    except deadlines.Exceeded as e:
+        status = 504
+        metrics.DEADLINE_EXCEEDED.inc(endpoint=trace.endpoint, stage=e.stage, outcome="failed")
+        logger.warning("%s request: %s (%.1fs)", trace.endpoint, e, trace.elapsed())
+        raise HTTPException(status_code=504, detail="Deadline exceeded", headers={
+            "Server-Timing": trace.server_timing(), "Timing-Allow-Origin": "*",
+        })
+    except cancel.Cancelled as e:
+        status = 499
+        metrics.CANCELLED.inc(endpoint=trace.endpoint, stage=e.stage)
+        logger.info("client disconnected; %s request %s", trace.endpoint, e)
+        raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        trace.finish(status)
+        capture.record(trace, status, shape)
+        events.record(trace, status)
+        if prof is not None:
+            prof.finish(status)
+
+
+def _requested_shots(options: Optional[Dict[str, Any]]) -> int:
+    # Determine shot count (per-request override via options, fallback to env)
+    req_shots = SHOT_COUNT
+    try:
+        if isinstance(options, dict) and options.get("shots") is not None:
+            req_shots = int(options.get("shots"))
+    except Exception:
+        req_shots = SHOT_COUNT
+    return max(1, min(3, req_shots))
+
+
+def _refuse(trace: metrics.RequestTrace, shape: Dict[str, Any], status: int, detail: str,
+            headers: Optional[Dict[str, str]] = None) -> HTTPException:
+    """Record a request refused before it ran, and build the error to raise."""
+    trace.finish(status)
+    capture.record(trace, status, shape)
+    events.record(trace, status)
+    return HTTPException(status_code=status, detail=detail, headers=headers)
+
+
+async def _admitted(pool: admission.Bulkhead, request: Request, cost: float, footprint: int,
+                    trace: metrics.RequestTrace, response: Response, shape: Dict[str, Any], fn, *args):
+    """Rate-limit the client, wait for a bulkhead slot and memory, then run the traced handler in the threadpool."""
+    if not admission.MEMORY.fits(footprint):
+        raise _refuse(trace, shape, 413, "Request too large to process (reduce image size)")
+    client = ratelimit.client_key(request)
+    try:
+        ratelimit.check(trace.endpoint, client, cost)
+    except ratelimit.RateLimited as e:
+        raise _refuse(trace, shape, 429, "Too many requests, please slow down", {"Retry-After": str(e.retry_after)})
+    watch = cancel.watch(request, trace.token)
+    try:
+        return await _run_admitted(pool, client, cost, footprint, trace, response, shape, fn, *args)
+    finally:
+        if watch is not None:
+            watch.cancel()
+
+
+async def _run_admitted(pool: admission.Bulkhead, client: str, cost: float, footprint: int,
+                        trace: metrics.RequestTrace, response: Response, shape: Dict[str, Any], fn, *args):
+    """Wait for a bulkhead slot and memory, then run the traced handler in the threadpool."""
+    wait = deadlines.queue_wait(trace)
+    if wait is not None and wait <= 0:
+        # Not even one upstream call would fit; refuse before taking a slot
+        metrics.DEADLINE_EXCEEDED.inc(endpoint=trace.endpoint, stage="queue", outcome="failed")
+        raise _refuse(trace, shape, 504, "Deadline too short to process this request")
+    # Cancelling the token while queued abandons the wait; once running, the stages check it
+    task = asyncio.current_task()
+    unhook = trace.token.on_cancel(task.cancel)
+    queued = True
+    try:
+        async with pool.slot(client, cost, ratelimit.weight_for(client), deadlines.queue_wait(trace)) as waited:
+            async with admission.MEMORY.reserve(footprint, deadlines.queue_wait(trace)) as mem_waited:
+                unhook()
+                queued = False
+                trace.add("queue", waited + mem_waited)
+                return await run_in_threadpool(_traced, trace, response, shape, fn, *args)
+    except asyncio.CancelledError:
+        if not (queued and trace.token.cancelled):
+            raise
+        task.uncancel()
+        metrics.CANCELLED.inc(endpoint=trace.endpoint, stage="queue")
+        raise _refuse(trace, shape, 499, "Client closed request")
+    except admission.Overloaded as e:
+        trace.add("queue", e.waited)
+        if e.reason == "deadline":
+            metrics.DEADLINE_EXCEEDED.inc(endpoint=trace.endpoint, stage="queue", outcome="failed")
+            raise _refuse(trace, shape, 504, "Deadline exceeded while queued", {"Server-Timing": trace.server_timing()})
+        logger.warning("Admission refused: %s (retry after %ss)", e, e.retry_after)
+        raise _refuse(
+            trace, shape, 503, "Server is busy, please retry shortly",
+            {"Retry-After": str(e.retry_after), "Server-Timing": trace.server_timing()},
+        )
+    finally:
+        unhook()
+
+
+def _probe_inputs(trace: metrics.RequestTrace, shape: Dict[str, Any], *images: str):
+    """Header-only probe of base64 inputs; rejects oversized images before anything is decoded."""
+    try:
+        headers = [ingest.probe_b64(b64) for b64 in images]
+        for header in headers:
+            ingest.check_pixels(header)
+    except ingest.TooManyPixels as e:
+        raise _refuse(trace, shape, 413, str(e))
+    return headers
+
+
+async def _idempotent(request: Request, response: Response, trace: metrics.RequestTrace, shape: Dict[str, Any], run):
+    """Honour an Idempotency-Key header: repeats share the first execution instead of starting a new one.
+
+    A repeat never runs ``run``, so its own trace is finished here with an
+    ``idempotent_replay`` outcome; otherwise replays would be missing from
+    the request metrics and the event log.
+    """
+    key = request.headers.get("idempotency-key")
+    if not key:
+        return await run()
+    if len(key) > idempotency.MAX_KEY_LENGTH:
+        raise _refuse(trace, shape, 400, "Idempotency-Key too long (max 255 characters)")
+    scoped = idempotency.scoped_key(ratelimit.client_key(request), trace.endpoint, key)
+    ran = False
+
+    async def first():
+        nonlocal ran
+        ran = True
+        return await run()
+
+    try:
+        result, replayed = await idempotency.STORE.run(
+            scoped, idempotency.fingerprint(await request.body()), trace.endpoint, first
+        )
+    except idempotency.KeyReused:
+        raise _refuse(trace, shape, 422, "Idempotency-Key was already used with a different request")
+    except Exception as e:
+        if not ran:
+            # Attached to a first execution that failed: the failure is shared, the trace is ours
+            _record_replay(trace, shape, e.status_code if isinstance(e, HTTPException) else 500)
+        raise
+    if replayed:
+        _record_replay(trace, shape, 200)
+        response.headers["Idempotent-Replayed"] = "true"
+        response.headers["Server-Timing"] = trace.server_timing()
+        response.headers["Timing-Allow-Origin"] = "*"
+    return result
+
+
+def _record_replay(trace: metrics.RequestTrace, shape: Dict[str, Any], status: int) -> None:
+    trace.info["outcome"] = "idempotent_replay"
+    trace.finish(status)
+    capture.record(trace, status, shape)
+    events.record(trace, status)
+
+
 @app.post("/api/generate")
-def generate(body: GenerateBody, request: Request):
-    if not GEMINI_API_KEY:
-        logger.error("GEMINI_API_KEY not set in environment for process PID=%s", os.getpid())
-        raise HTTPException(status_code=500, detail="GEMINI_API_KEY not set")
+async def generate(body: GenerateBody, request: Request, response: Response):
+    trace = metrics.RequestTrace("generate", body.theme)
+    deadlines.start(trace, request.headers)
+    shape = {"theme": body.theme, "mime_type": body.mime_type, "options": body.options}
+    pool = admission.pool_for("generate", body.theme)
+    cost = trace.info["shots"] = _requested_shots(body.options)
+    headers = _probe_inputs(trace, shape, body.image)
+    footprint = ingest.estimate_peak([len(body.image)], headers, outputs=cost)
+    return await _idempotent(
+        request, response, trace, shape,
+        lambda: _admitted(pool, request, cost, footprint, trace, response, shape, _generate, body, request, trace),
+    )
+
 
+def _partial(trace: metrics.RequestTrace, e: deadlines.Exceeded, done: int) -> None:
+    """Out of time with some images ready: return those in place of failing."""
+    metrics.DEADLINE_EXCEEDED.inc(endpoint=trace.endpoint, stage=e.stage, outcome="partial")
+    trace.info["partial"] = True
+    logger.warning("%s request: %s; returning %d image(s)", trace.endpoint, e, done)
+
+
+def _preflight(data: bytes, theme: str, trace: metrics.RequestTrace) -> List[Any]:
+    """Faces in a working image; a preflight error refuses the request with a 422 (see preflight.py)."""
+    with trace.stage("detect"):
+        report = workers.run(preflight.run, data, theme)
+    for issue in report.issues:
+        metrics.PREFLIGHT_ISSUES.inc(theme=theme, check=issue.check, severity=issue.severity)
+    if report.issues:
+        trace.info["preflight"] = [f"{i.check}:{i.severity}" for i in report.issues]
+    warnings = [i._asdict() for i in report.warnings]
+    if report.errors:
+        raise HTTPException(status_code=422, detail={
+            "error": "Input photo failed preflight checks", "failed": [i._asdict() for i in report.errors],
+            "warnings": warnings, "measures": report.measures,
+        })
+    if warnings:
+        trace.info.setdefault("warnings", []).extend(warnings)
+    return report.faces
+
+
+def _render_local(body: GenerateBody, input_bytes: bytes, faces: List[Any],
+                  trace: metrics.RequestTrace) -> Optional[Dict[str, Any]]:
+    """Try the local ID-photo renderer; None sends the request upstream."""
+    region = body.options.get("region") if isinstance(body.options, dict) else None
+    with trace.stage("postprocess"):
+        png, failed, measures = workers.run(idphoto.render, input_bytes, body.theme,
+                                            region if isinstance(region, str) else None, faces)
+    metrics.LOCAL_RENDERS.inc(theme=body.theme, outcome=failed[0] if failed else "ok")
+    if png is None:
+        trace.info["local_failed"] = failed
+        if idphoto.MODE == "only":
+            raise HTTPException(status_code=422, detail={"error": "ID photo checks failed", "failed": failed, "measures": measures})
+        logger.info("local %s render failed %s %s; using upstream", body.theme, failed, measures)
+        return None
+    trace.info["render"] = "local"
+    trace.info["composition"] = "half"
+    with trace.stage("persist"):
+        saved_url = _save_output(png, trace, "half")
+    with trace.stage("encode"):
+        b64 = base64.b64encode(png).decode("utf-8")
+    trace.alloc("encode", len(png) + len(b64))
+    image = {"image_base64": b64, "mime_type": "image/png", "saved_url": saved_url}
+    return {"images": [image], **image, "render": "local"}
+
+
+def _generate(body: GenerateBody, request: Request, trace: metrics.RequestTrace):
     # Decode input to validate and possibly re-encode as PNG
     def decode_image_b64(b64: str) -> bytes:
         try:
@@ -909,39 +1341,50 @@ def generate(body: GenerateBody, request: Request):
         except Exception:
             raise HTTPException(status_code=400, detail="Invalid image base64. Expect raw base64 (or data URL) of PNG/JPEG.")
 
-    input_bytes = decode_image_b64(body.image)
+    with trace.stage("decode"):
+        input_bytes = decode_image_b64(body.image)
     if not input_bytes:
         logger.warning("/api/generate empty image payload from %s", request.client.host if request.client else "unknown")
         raise HTTPException(status_code=400, detail="Empty image payload")
 
+    if capture.ENABLED:
+        trace.info["images"] = [capture.describe_image(input_bytes, "image")]
+    trace.alloc("decode", len(body.image) + len(input_bytes))
+    try:
+        header = ingest.probe(input_bytes)
+        trace.info.setdefault("inputs", []).append(events.image_info(input_bytes, header, "image"))
+        ingest.check_pixels(header)
+    except ingest.TooManyPixels as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
     # Normalize mime type
     mime_type = normalize_mime(body.mime_type)
     logger.info("/api/generate theme=%s mime=%s img_len=%s", body.theme, mime_type, len(input_bytes))
 
-    # Pre-compress large inputs to avoid upstream 400 due to payload limits
-    def preprocess_input(img_bytes: bytes, mime: str) -> (bytes, str):
-        try:
-            img = Image.open(BytesIO(img_bytes)).convert("RGB")
-            w, h = img.size
-            max_side = 1600
-            if max(w, h) > max_side:
-                scale = max_side / float(max(w, h))
-                nw, nh = int(w * scale), int(h * scale)
-                img = img.resize((nw, nh), Image.LANCZOS)
-            buf = BytesIO()
-            # Prefer JPEG to reduce payload size
-            img.save(buf, format="JPEG", quality=90)
-            out = buf.getvalue()
-            return out, "image/jpeg"
-        except Exception as e:
-            logger.warning("preprocess_input failed: %s", e)
-            return img_bytes, mime
-
-    # If input is large (>8MB) or mime unknown, compress
-    if len(input_bytes) > 8 * 1024 * 1024 or mime_type not in {"image/png", "image/jpeg"}:
-        before = len(input_bytes)
-        input_bytes, mime_type = preprocess_input(input_bytes, mime_type)
-        logger.info("compressed input %s -> %s bytes, mime=%s", before, len(input_bytes), mime_type)
+    # Ingest: decode near working resolution and apply EXIF orientation; every later stage uses this image
+    before = len(input_bytes)
+    with trace.stage("preprocess"):
+        input_bytes, mime_type = workers.run(imaging.ingest_input, input_bytes, mime_type)
+    if len(input_bytes) != before:
+        logger.info("ingested input %s -> %s bytes, mime=%s", before, len(input_bytes), mime_type)
+    trace.alloc("preprocess", 3 * ingest.ingest_decode_pixels(header) + len(input_bytes))
+    header = ingest.probe(input_bytes)
+    # Bytes of one RGB/BGR copy of the working image
+    input_pixel_bytes = 3 * header.width * header.height if header else 0
+
+    # Preflight finds the faces and refuses unusable photos before any upstream work
+    faces = _preflight(input_bytes, body.theme, trace)
+    trace.alloc("detect", input_pixel_bytes)
+    multiple = len(faces) >= 2
+    trace.info["faces"] = trace.info["subjects"] = len(faces)
+
+    if idphoto.wanted(body.theme, body.options):
+        local = _render_local(body, input_bytes, faces, trace)
+        if local is not None:
+            return local
+    if not upstreams.POOL.upstreams:
+        logger.error("no upstream API key configured for process PID=%s", os.getpid())
+        raise HTTPException(status_code=500, detail="GEMINI_API_KEY not set")
 
     # Choose composition (random for non-regulated themes) and build prompt
     comp_key = _choose_composition_for_theme(body.theme, body.options)
@@ -950,50 +1393,17 @@ def generate(body: GenerateBody, request: Request):
         comp_key = "half"
     prompt = build_prompt(body.theme, comp_key, body.options)
     logger.info("composition=%s", comp_key)
+    trace.info["composition"] = comp_key
 
-    # Construct contents for Gemini, with optional identity face crop to improve consistency
-    def make_identity_crop(img_bytes: bytes):
-        if not CV2_AVAILABLE:
-            return None
-        try:
-            arr = np.frombuffer(img_bytes, dtype=np.uint8)
-            cvimg = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-            if cvimg is None:
-                return None
-            gray = cv2.cvtColor(cvimg, cv2.COLOR_BGR2GRAY)
-            face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-            faces = face_cascade.detectMultiScale(gray, scaleFactor=1.08, minNeighbors=4, minSize=(48,48))
-            if len(faces) == 0:
-                return None
-            x,y,w,h = sorted(faces, key=lambda f: f[2]*f[3], reverse=True)[0]
-            pad = int(max(w,h)*0.45)
-            x0 = max(0, x-pad); y0 = max(0, y-pad)
-            x1 = min(cvimg.shape[1], x+w+pad); y1 = min(cvimg.shape[0], y+h+pad)
-            crop = cvimg[y0:y1, x0:x1]
-            # Resize to manageable ref size
-            ref_w = 512
-            ch, cw = crop.shape[:2]
-            if cw > ref_w:
-                scale = ref_w/float(cw)
-                crop = cv2.resize(crop, (ref_w, int(ch*scale)), interpolation=cv2.INTER_LANCZOS4)
-            _, enc = cv2.imencode('.jpg', crop, [int(cv2.IMWRITE_JPEG_QUALITY), 90])
-            return enc.tobytes(), 'image/jpeg'
-        except Exception:
-            return None
-
-    identity_part = None
-    id_crop = make_identity_crop(input_bytes)
-    if id_crop is not None:
-        cid_bytes, cid_mime = id_crop
-        identity_part = {"inlineData": {"mimeType": cid_mime, "data": base64.b64encode(cid_bytes).decode("utf-8")}}
+    # Fit the upstream copy of the input to the theme's budgets
+    with trace.stage("preprocess"):
+        main_bytes, main_mime = workers.run(payload.plan, input_bytes, mime_type, body.theme, "main")
+    trace.alloc("preprocess", input_pixel_bytes + len(main_bytes))
 
-    parts = [{"text": prompt}, {"inlineData": {"mimeType": mime_type, "data": base64.b64encode(input_bytes).decode("utf-8")}}]
-    if identity_part:
-        parts = [{"text": "Identity reference close-up (keep same person):"}, identity_part] + parts
-
-    contents = [{"role": "user", "parts": parts}]
-
-    def model_generate(image_bytes: bytes, prompt_override: Optional[str] = None, temperature: float = 1.05) -> str:
+    def model_generate(image_bytes: bytes, prompt_override: Optional[str] = None, temperature: float = 1.05,
+                       image_mime: Optional[str] = None, part: str = "main") -> bytes:
+        image_mime = image_mime or main_mime
+        image_part = _inline_part(trace, part, image_bytes, image_mime)
         payload_full = {
             "systemInstruction": {
                 "role": "system",
@@ -1007,10 +1417,7 @@ def generate(body: GenerateBody, request: Request):
             "contents": [
                 {
                     "role": "user",
-                    "parts": [
-                        {"text": (prompt_override or prompt)},
-                        {"inlineData": {"mimeType": mime_type, "data": base64.b64encode(image_bytes).decode("utf-8")}},
-                    ],
+                    "parts": [{"text": (prompt_override or prompt)}, image_part],
                 }
             ],
             "generationConfig": {
@@ -1023,30 +1430,12 @@ def generate(body: GenerateBody, request: Request):
             "contents": [
                 {
                     "role": "user",
-                    "parts": [
-                        {"text": (prompt_override or prompt)},
-                        {"inlineData": {"mimeType": mime_type, "data": base64.b64encode(image_bytes).decode("utf-8")}},
-                    ],
+                    "parts": [{"text": (prompt_override or prompt)}, image_part],
                 }
             ]
         }
 
-        def call(payload):
-            try:
-                return requests.post(
-                    GEMINI_ENDPOINT,
-                    headers={
-                        "Content-Type": "application/json",
-                        "X-goog-api-key": GEMINI_API_KEY,
-                    },
-                    json=payload,
-                    timeout=60,
-                )
-            except requests.RequestException as e:
-                logger.exception("Upstream request error: %s", e)
-                raise HTTPException(status_code=502, detail=f"Upstream error: {e}")
-
-        resp = call(payload_full)
+        resp = _post_gemini(payload_full, trace)
         if resp.status_code == 400:
             # Retry without systemInstruction/generationConfig (some models are strict)
             try:
@@ -1054,200 +1443,61 @@ def generate(body: GenerateBody, request: Request):
                 logger.warning("400 INVALID_ARGUMENT with full payload, retrying minimal. body=%s", snippet)
             except Exception:
                 pass
-            resp = call(payload_min)
+            metrics.FALLBACKS_400.inc(endpoint=trace.endpoint, theme=trace.theme)
+            trace.retry("400_fallback")
+            resp = _post_gemini(payload_min, trace)
 
         if resp.status_code != 200:
             snippet = resp.text[:400] if hasattr(resp, 'text') else str(resp.status_code)
             logger.error("Upstream non-200 status=%s body=%s", resp.status_code, snippet)
             raise HTTPException(status_code=resp.status_code, detail=resp.text)
 
-        data = resp.json()
-        inline_b64: Optional[str] = None
-        try:
-            candidates = data.get("candidates", [])
-            for cand in candidates:
-                parts = cand.get("content", {}).get("parts", [])
-                for p in parts:
-                    if "inlineData" in p:
-                        inline_b64 = p["inlineData"]["data"]
-                        break
-                if inline_b64:
-                    break
-        except Exception as e:
-            logger.exception("Failed to parse upstream response: %s", e)
-            inline_b64 = None
-        if not inline_b64:
-            logger.error("No image returned from model for theme=%s", body.theme)
-            raise HTTPException(status_code=500, detail="No image returned from model")
-        return inline_b64
-
-    # Multi-subject support: detect multiple faces and generate for each crop
-    def detect_faces(image_bytes: bytes):
-        if not CV2_AVAILABLE:
-            return []
-        try:
-            arr = np.frombuffer(image_bytes, dtype=np.uint8)
-            img_cv = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-            if img_cv is None:
-                return []
-            gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
-            face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-            faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(48,48))
-            faces = sorted(faces, key=lambda f: f[2]*f[3], reverse=True)
-            return faces
-        except Exception:
-            return []
-
-    faces = detect_faces(input_bytes)
-    multiple = len(faces) >= 2
-
-    # Process output image to target aspect/size per theme and composition
-    def get_target_size(theme: str, comp: Optional[str]):
-        if theme == "passport":
-            return (900, 1200)  # 3:4 regulated
-        if theme == "resume":
-            return (900, 1200)  # 3:4 common ID/resume portrait aspect
-        # Composition-driven sizes
-        if comp == "full" or comp == "three_quarter":
-            return (1080, 1620)  # 2:3 tall
-        if comp == "half":
-            return (1024, 1280)  # 4:5
-        if comp == "close":
-            return (900, 1200)   # 3:4 tight portrait
-        # Fallback by theme
-        if theme in {"model", "kpop", "actor", "travel", "activity", "profession", "aerial_set"}:
-            return (1080, 1620)
-        return (1024, 1280)
-
-    def resize_cover(img: Image.Image, tw: int, th: int) -> Image.Image:
-        w, h = img.size
-        if w == 0 or h == 0:
-            return img
-        scale = max(tw / w, th / h)
-        nw, nh = int(w * scale), int(h * scale)
-        img2 = img.resize((nw, nh), Image.LANCZOS)
-        left = max(0, (nw - tw) // 2)
-        top = max(0, (nh - th) // 2)
-        box = (left, top, left + tw, top + th)
-        img3 = img2.crop(box)
-        return img3
+        return _extract_inline_image(resp, trace)
 
     # Helper to process a single generated base64 image
-    def process_and_save(inline_b64: str, comp_key_local: Optional[str], theme: str):
-        # Decode model image, apply processing
-        out_img: Image.Image
+    def process_and_save(out_bytes_local: bytes, comp_key_local: Optional[str], theme: str):
+        trace.token.check("postprocess")
+        t0 = time.perf_counter()
         try:
-            out_bytes_local = base64.b64decode(inline_b64)
-            out_img = Image.open(BytesIO(out_bytes_local))
-            out_img.load()
-        except Exception:
+            processed_bytes_local, post_s, enc_s = workers.run(imaging.postprocess_output, out_bytes_local, theme, comp_key_local)
+        except ValueError:
             raise HTTPException(status_code=500, detail="Failed to decode model image")
-
-        def enforce_id_crop(pil_img: Image.Image, target_w: int, target_h: int, head_ratio: float = 0.65, eye_line_from_top: float = 0.43) -> Image.Image:
-            if not CV2_AVAILABLE:
-                # Fallback without OpenCV: simple cover crop
-                return resize_cover(pil_img.convert("RGBA"), target_w, target_h)
-            # Convert PIL -> CV2
-            img = np.array(pil_img.convert("RGB"))
-            img_cv = img[:, :, ::-1]
-            h0, w0 = img_cv.shape[:2]
-            # Detect face (largest)
-            face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-            gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
-            faces_loc = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(int(min(w0, h0)*0.15), int(min(w0, h0)*0.15)))
-            if len(faces_loc) == 0:
-                # fallback: simple cover center crop
-                return resize_cover(pil_img.convert("RGBA"), target_w, target_h)
-            # pick largest
-            x, y, w, h = sorted(faces_loc, key=lambda f: f[2]*f[3], reverse=True)[0]
-            # Desired head height in final
-            desired_head_h = head_ratio * target_h
-            scale = desired_head_h / max(h, 1)
-            # Resize original by scale
-            new_w, new_h = int(w0 * scale), int(h0 * scale)
-            img_scaled = cv2.resize(img_cv, (new_w, new_h), interpolation=cv2.INTER_LANCZOS4)
-            # Face center in scaled image
-            cx = int((x + w/2) * scale)
-            # Approximate eye line ~ 0.38 of face height from top
-            eyes_y_scaled = int((y + 0.38*h) * scale)
-            # Compute crop top-left so that eye line sits at specified position
-            crop_x = cx - target_w // 2
-            crop_y = int(eyes_y_scaled - 0.43 * target_h)
-            # Clamp
-            crop_x = max(0, min(crop_x, new_w - target_w))
-            crop_y = max(0, min(crop_y, new_h - target_h))
-            # If scaled image smaller than target, pad
-            if new_w < target_w or new_h < target_h:
-                pad_w = max(0, target_w - new_w)
-                pad_h = max(0, target_h - new_h)
-                img_scaled = cv2.copyMakeBorder(img_scaled, pad_h//2, pad_h - pad_h//2, pad_w//2, pad_w - pad_w//2, cv2.BORDER_REPLICATE)
-                new_h, new_w = img_scaled.shape[:2]
-                crop_x = max(0, min(crop_x, new_w - target_w))
-                crop_y = max(0, min(crop_y, new_h - target_h))
-            crop = img_scaled[crop_y:crop_y+target_h, crop_x:crop_x+target_w]
-            if crop.shape[0] != target_h or crop.shape[1] != target_w:
-                crop = cv2.resize(crop, (target_w, target_h), interpolation=cv2.INTER_LANCZOS4)
-            pil_out = Image.fromarray(crop[:, :, ::-1])
-            return pil_out
-
-        try:
-            tw, th = get_target_size(theme, comp_key_local)
-            if theme in {"passport", "resume"}:
-                # Make head smaller in the frame to include shoulders/chest
-                # Passport: tighter but still chest-up; Resume: slightly looser
-                out_img = enforce_id_crop(
-                    out_img,
-                    tw,
-                    th,
-                    head_ratio=0.45 if theme == "passport" else 0.50,
-                    eye_line_from_top=0.43,
-                )
-            else:
-                out_img = resize_cover(out_img.convert("RGBA"), tw, th)
-        except Exception:
-            pass
-
-        # Re-encode processed image to PNG base64 and save
-        buf = BytesIO()
-        out_img.save(buf, format="PNG")
-        processed_bytes_local = buf.getvalue()
-        processed_b64_local = base64.b64encode(processed_bytes_local).decode("utf-8")
-
-        out_dir = os.path.join(os.path.dirname(__file__), "static", "outputs")
-        os.makedirs(out_dir, exist_ok=True)
-        out_id_local = f"{uuid.uuid4().hex}.png"
-        out_path_local = os.path.join(out_dir, out_id_local)
-        with open(out_path_local, "wb") as f:
-            f.write(processed_bytes_local)
-        saved_url_local = f"/outputs/{out_id_local}"
+        # Pool round trip counts as post-processing
+        trace.add("postprocess", time.perf_counter() - t0 - enc_s)
+        trace.add("encode", enc_s)
+        tw, th = imaging.get_target_size(theme, comp_key_local)
+        trace.alloc("postprocess", len(out_bytes_local) + 4 * tw * th)
+        with trace.stage("encode"):
+            processed_b64_local = base64.b64encode(processed_bytes_local).decode("utf-8")
+        trace.alloc("encode", len(processed_bytes_local) + len(processed_b64_local))
+        with trace.stage("persist"):
+            saved_url_local = _save_output(processed_bytes_local, trace, comp_key_local)
         return processed_b64_local, saved_url_local
 
     # If multiple faces detected, crop around each face and call the model per face
     if multiple:
-        # decode original for cropping
-        arr = np.frombuffer(input_bytes, dtype=np.uint8) if CV2_AVAILABLE else None
-        img_cv_src = cv2.imdecode(arr, cv2.IMREAD_COLOR) if CV2_AVAILABLE and arr is not None else None
-        h0, w0 = (img_cv_src.shape[0], img_cv_src.shape[1]) if img_cv_src is not None else (0,0)
         results = []
         max_subjects = min(len(faces), 3)  # practical cap
-        for idx, (x,y,w,h) in enumerate(faces[:max_subjects]):
-            if img_cv_src is None:
-                break
+        for idx, face in enumerate(faces[:max_subjects]):
             # expand box to include shoulders
-            cx, cy = x + w/2, y + h/2
-            box_w = int(w * 2.0)
-            box_h = int(h * 2.4)
-            x0 = max(0, int(cx - box_w/2))
-            y0 = max(0, int(cy - box_h*0.45))
-            x1 = min(w0, x0 + box_w)
-            y1 = min(h0, y0 + box_h)
-            crop_cv = img_cv_src[y0:y1, x0:x1]
-            _, enc = cv2.imencode('.png', crop_cv)
+            with trace.stage("preprocess"):
+                crop_png = workers.run(imaging.crop_subject, input_bytes, face)
+                if crop_png is not None:
+                    crop_bytes, crop_mime = workers.run(payload.plan, crop_png, "image/png", body.theme, "subject")
+            if crop_png is None:
+                break
             # Encourage per-subject diversity
             variation_tag = uuid.uuid4().hex[:8]
             prompt_var = prompt + f"\nVariation tag: {variation_tag}. Produce a distinct, non-identical rendering."
-            inline_b64 = model_generate(enc.tobytes(), prompt_override=prompt_var, temperature=1.1)
-            processed_b64, saved_url = process_and_save(inline_b64, comp_key, body.theme)
+            try:
+                out_bytes = model_generate(crop_bytes, prompt_override=prompt_var, temperature=1.1,
+                                           image_mime=crop_mime, part="subject")
+                processed_b64, saved_url = process_and_save(out_bytes, comp_key, body.theme)
+            except deadlines.Exceeded as e:
+                if not results:
+                    raise
+                _partial(trace, e, len(results))
+                break
             results.append({
                 "subject_index": idx,
                 "image_base64": processed_b64,
@@ -1265,14 +1515,7 @@ def generate(body: GenerateBody, request: Request):
             }
 
     # Single-subject path: generate multiple variants (default 3)
-    # Determine shot count (per-request override via options, fallback to env)
-    req_shots = SHOT_COUNT
-    try:
-        if isinstance(body.options, dict) and body.options.get("shots") is not None:
-            req_shots = int(body.options.get("shots"))
-    except Exception:
-        req_shots = SHOT_COUNT
-    req_shots = max(1, min(3, req_shots))
+    req_shots = _requested_shots(body.options)
 
     # Generate unique variants (dedupe by hash)
     import hashlib
@@ -1284,8 +1527,14 @@ def generate(body: GenerateBody, request: Request):
         attempts += 1
         variation_tag = uuid.uuid4().hex[:8]
         prompt_var = prompt + f"\nVariation tag: {variation_tag}. Produce a distinct, non-identical rendering."
-        inline_b64 = model_generate(input_bytes, prompt_override=prompt_var, temperature=1.1)
-        processed_b64, saved_url = process_and_save(inline_b64, comp_key, body.theme)
+        try:
+            out_bytes = model_generate(main_bytes, prompt_override=prompt_var, temperature=1.1)
+            processed_b64, saved_url = process_and_save(out_bytes, comp_key, body.theme)
+        except deadlines.Exceeded as e:
+            if not variants:
+                raise
+            _partial(trace, e, len(variants))
+            break
         try:
             img_bytes = base64.b64decode(processed_b64)
             h = hashlib.sha256(img_bytes).hexdigest()
@@ -1293,6 +1542,8 @@ def generate(body: GenerateBody, request: Request):
             h = uuid.uuid4().hex
         if h in seen:
             logger.info("duplicate variant detected, retrying (tag=%s)", variation_tag)
+            metrics.DUPLICATE_VARIANTS.inc(theme=body.theme)
+            trace.retry("duplicate_variant")
             continue
         seen.add(h)
         variants.append({
@@ -1309,107 +1560,139 @@ def generate(body: GenerateBody, request: Request):
         "saved_url": first["saved_url"],
     }
 
-    def enforce_id_crop(pil_img: Image.Image, target_w: int, target_h: int, head_ratio: float = 0.65, eye_line_from_top: float = 0.43) -> Image.Image:
-        if not CV2_AVAILABLE:
-            # Fallback without OpenCV: simple cover crop
-            return resize_cover(pil_img.convert("RGBA"), target_w, target_h)
-        # Convert PIL -> CV2
-        img = np.array(pil_img.convert("RGB"))
-        img_cv = img[:, :, ::-1]
-        h0, w0 = img_cv.shape[:2]
-        # Detect face (largest)
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(int(min(w0, h0)*0.15), int(min(w0, h0)*0.15)))
-        if len(faces) == 0:
-            # fallback: simple cover center crop
-            return resize_cover(pil_img.convert("RGBA"), target_w, target_h)
-        # pick largest
-        x, y, w, h = sorted(faces, key=lambda f: f[2]*f[3], reverse=True)[0]
-        # Desired head height in final
-        desired_head_h = head_ratio * target_h
-        scale = desired_head_h / max(h, 1)
-        # Resize original by scale
-        new_w, new_h = int(w0 * scale), int(h0 * scale)
-        img_scaled = cv2.resize(img_cv, (new_w, new_h), interpolation=cv2.INTER_LANCZOS4)
-        # Face center in scaled image
-        cx = int((x + w/2) * scale)
-        cy = int((y + h/2) * scale)
-        # Approximate eye line ~ 0.38 of face height from top
-        eyes_y_scaled = int((y + 0.38*h) * scale)
-        # Compute crop top-left so that eye line sits at specified position
-        crop_x = cx - target_w // 2
-        crop_y = int(eyes_y_scaled - eye_line_from_top * target_h)
-        # Clamp
-        crop_x = max(0, min(crop_x, new_w - target_w))
-        crop_y = max(0, min(crop_y, new_h - target_h))
-        # If scaled image smaller than target, pad
-        if new_w < target_w or new_h < target_h:
-            pad_w = max(0, target_w - new_w)
-            pad_h = max(0, target_h - new_h)
-            img_scaled = cv2.copyMakeBorder(img_scaled, pad_h//2, pad_h - pad_h//2, pad_w//2, pad_w - pad_w//2, cv2.BORDER_REPLICATE)
-            new_h, new_w = img_scaled.shape[:2]
-            crop_x = max(0, min(crop_x, new_w - target_w))
-            crop_y = max(0, min(crop_y, new_h - target_h))
-        crop = img_scaled[crop_y:crop_y+target_h, crop_x:crop_x+target_w]
-        if crop.shape[0] != target_h or crop.shape[1] != target_w:
-            crop = cv2.resize(crop, (target_w, target_h), interpolation=cv2.INTER_LANCZOS4)
-        pil_out = Image.fromarray(crop[:, :, ::-1])
-        return pil_out
 
-    try:
-        tw, th = get_target_size(body.theme, comp_key)
-        if body.theme in {"passport", "resume"}:
-            # Enforce regulated composition more strictly
-            out_img = enforce_id_crop(out_img, tw, th, head_ratio=0.65 if body.theme=="passport" else 0.60, eye_line_from_top=0.43)
-        else:
-            out_img = resize_cover(out_img.convert("RGBA"), tw, th)
-    except Exception:
-        pass
-
-    # Re-encode processed image to PNG base64
-    buf = BytesIO()
-    out_img.save(buf, format="PNG")
-    processed_bytes = buf.getvalue()
-    processed_b64 = base64.b64encode(processed_bytes).decode("utf-8")
-
-    # Save output image into backend/static/outputs
-    out_dir = os.path.join(os.path.dirname(__file__), "static", "outputs")
-    os.makedirs(out_dir, exist_ok=True)
-    out_id = f"{uuid.uuid4().hex}.png"
-    out_path = os.path.join(out_dir, out_id)
-
-    with open(out_path, "wb") as f:
-        f.write(processed_bytes)
-
-    # Serve via static mount path
-    saved_url = f"/outputs/{out_id}"
-    return {"image_base64": processed_b64, "mime_type": "image/png", "saved_url": saved_url}
+@app.post("/api/composite")
+async def composite(body: CompositeBody, request: Request, response: Response):
+    trace = metrics.RequestTrace("composite")
+    deadlines.start(trace, request.headers)
+    shape = {"user_mime_type": body.user_mime_type, "ref_mime_type": body.ref_mime_type, "hint_len": len(body.hint or ""),
+             "template_id": body.template_id}
+    pool = admission.pool_for("composite")
+    if (body.ref_image is None) == (body.template_id is None):
+        raise _refuse(trace, shape, 400, "Provide exactly one of ref_image or template_id")
+    template = None
+    if body.template_id is not None:
+        template = templates.LIBRARY.get(body.template_id)
+        metrics.COMPOSITE_TEMPLATES.inc(outcome="hit" if template else "miss")
+        if template is None:
+            raise _refuse(trace, shape, 404, f"Unknown template_id: {body.template_id}")
+        headers = _probe_inputs(trace, shape, body.user_image)
+        footprint = ingest.estimate_peak([len(body.user_image)], headers) + len(template.b64)
+    else:
+        headers = _probe_inputs(trace, shape, body.user_image, body.ref_image)
+        footprint = ingest.estimate_peak([len(body.user_image), len(body.ref_image)], headers)
+    return await _idempotent(
+        request, response, trace, shape,
+        lambda: _admitted(pool, request, 1, footprint, trace, response, shape, _composite, body, trace, template),
+    )
 
 
-@app.post("/api/composite")
-def composite(body: CompositeBody):
-    if not GEMINI_API_KEY:
+def _composite(body: CompositeBody, trace: metrics.RequestTrace, template: Optional[templates.Template] = None):
+    if not upstreams.POOL.upstreams:
         raise HTTPException(status_code=500, detail="GEMINI_API_KEY not set")
+    scene_part, ref_face = _composite_scene(body.ref_image, body.ref_mime_type, template, trace)
+    user = _composite_user(body.user_image, body.user_mime_type, trace)
+    return _composite_render(user, scene_part, ref_face, body.hint, trace)
 
-    # Decode inputs
+
+def _decode_input(b64: str, role: str, trace: metrics.RequestTrace):
+    """Decode and validate one composite input; returns (bytes, header)."""
     try:
-        user_bytes = base64.b64decode(body.user_image)
-        ref_bytes = base64.b64decode(body.ref_image)
+        with trace.stage("decode"):
+            data = base64.b64decode(b64)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid base64 in inputs")
-
     # Basic file validations
-    if len(user_bytes) == 0 or len(ref_bytes) == 0:
+    if len(data) == 0:
         raise HTTPException(status_code=400, detail="Empty image data")
-    if len(user_bytes) > 12 * 1024 * 1024 or len(ref_bytes) > 12 * 1024 * 1024:
+    if capture.ENABLED:
+        trace.info.setdefault("images", []).append(capture.describe_image(data, role))
+    if len(data) > 12 * 1024 * 1024:
         raise HTTPException(status_code=413, detail="Image too large (max 12MB each)")
+    trace.alloc("decode", len(b64) + len(data))
+    try:
+        header = ingest.probe(data)
+        trace.info.setdefault("inputs", []).append(events.image_info(data, header, role))
+        ingest.check_pixels(header)
+    except ingest.TooManyPixels as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return data, header
 
-    user_mime = normalize_mime(body.user_mime_type)
-    ref_mime = normalize_mime(body.ref_mime_type)
-    if user_mime not in {"image/png", "image/jpeg"} or ref_mime not in {"image/png", "image/jpeg"}:
+
+def _ingest_input(data: bytes, mime: str, header, trace: metrics.RequestTrace):
+    """Working-resolution, upright copy; returns (bytes, mime, bytes of one RGB copy)."""
+    if mime not in {"image/png", "image/jpeg"}:
         raise HTTPException(status_code=415, detail="Unsupported image mime type (use PNG or JPEG)")
+    with trace.stage("preprocess"):
+        data, mime = workers.run(imaging.ingest_input, data, mime)
+    trace.alloc("preprocess", 3 * ingest.ingest_decode_pixels(header) + len(data))
+    work = ingest.probe(data)
+    return data, mime, 3 * work.width * work.height if work else 0
+
+
+def _composite_user(user_b64: str, user_mime_type: Optional[str], trace: metrics.RequestTrace) -> List[Dict[str, Any]]:
+    """User-side parts of a composite (portrait, optional face close-up), independent of the reference."""
+    user_bytes, header = _decode_input(user_b64, "user", trace)
+    user_bytes, user_mime, pixel_bytes = _ingest_input(user_bytes, normalize_mime(user_mime_type), header, trace)
+    faces = _preflight(user_bytes, "composite", trace)
+    user_face = tuple(int(v) for v in faces[0][:4]) if faces else None
+    trace.alloc("detect", pixel_bytes)
+    with trace.stage("preprocess"):
+        portrait_bytes, portrait_mime = workers.run(payload.plan, user_bytes, user_mime, None, "main")
+    trace.alloc("preprocess", len(portrait_bytes))
+    parts = [
+        {"text": "User portrait (cast this person's FACE into the reference):"},
+        _inline_part(trace, "main", portrait_bytes, portrait_mime),
+    ]
 
+    # Provide a close crop of the user's face to strengthen identity match
+    try:
+        if user_face:
+            with trace.stage("preprocess"):
+                crop_png = workers.run(imaging.face_closeup, user_bytes, user_face, 0.4)
+                if crop_png:
+                    crop_bytes, crop_mime = workers.run(payload.plan, crop_png, "image/png", None, "identity")
+            if crop_png:
+                parts.append({"text": "User face close-up (for identity and texture):"})
+                parts.append(_inline_part(trace, "identity", crop_bytes, crop_mime))
+    except Exception:
+        pass
+    return parts
+
+
+def _composite_scene(ref_b64: Optional[str], ref_mime_type: Optional[str], template: Optional[templates.Template],
+                     trace: metrics.RequestTrace):
+    """Payload-ready reference scene and its primary face box (scene coordinates)."""
+    if template is not None:
+        # Analysed at registration
+        if capture.ENABLED:
+            trace.info.setdefault("images", []).append({
+                "role": "ref", "bytes": template.size, "format": template.mime.split("/")[1].upper(),
+                "width": template.width, "height": template.height,
+            })
+        metrics.UPSTREAM_PART_BYTES.observe(template.size, endpoint=trace.endpoint, part="scene")
+        return {"inlineData": {"mimeType": template.mime, "data": template.b64}}, template.face
+
+    ref_bytes, header = _decode_input(ref_b64, "ref", trace)
+    ref_bytes, ref_mime, pixel_bytes = _ingest_input(ref_bytes, normalize_mime(ref_mime_type), header, trace)
+    with trace.stage("detect"):
+        ref_face = workers.run(imaging.analyze_face, ref_bytes)
+    trace.alloc("detect", pixel_bytes)
+    # Fit the upstream copy to its budget; the face box stays valid only if the scene keeps its size
+    with trace.stage("preprocess"):
+        scene_bytes, scene_mime = workers.run(payload.plan, ref_bytes, ref_mime, None, "scene")
+    trace.alloc("preprocess", len(scene_bytes))
+    if ref_face:
+        scene_header, ref_header = ingest.probe(scene_bytes), ingest.probe(ref_bytes)
+        if scene_header and ref_header and scene_header.width != ref_header.width:
+            k = scene_header.width / float(ref_header.width)
+            ref_face = tuple(int(v * k) for v in ref_face)
+    return _inline_part(trace, "scene", scene_bytes, scene_mime), ref_face
+
+
+def _composite_render(user_parts: List[Dict[str, Any]], scene_part: Dict[str, Any], ref_face, hint: Optional[str],
+                      trace: metrics.RequestTrace):
+    """Upstream call, post-processing and persistence for one user/reference pair."""
     instruction = (
         "Create ONE photorealistic composite image. Use the REFERENCE image as the BASE SCENE. Replace/merge the PRIMARY FACE in the reference with the face from the USER PORTRAIT. "
         "Keep the reference background, props, and scene intact. Align head pose, scale, gaze direction, and skin tone; match lighting and color. Blend seams (hairline, edges), cast realistic shadows/reflections. "
@@ -1417,149 +1700,300 @@ def composite(body: CompositeBody):
         "Preserve the user's identity and realistic anatomy. Absolutely remove/avoid any text, letters, numbers, logos, or watermarks. "
         "No unsafe content."
     )
-    if body.hint:
-        instruction += f" Hint: {body.hint}."
-
-    # Optional: detect faces to help the model focus
-    def detect_face_box(img_bytes: bytes):
-        if not CV2_AVAILABLE:
-            return None
-        arr = np.frombuffer(img_bytes, dtype=np.uint8)
-        cv = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-        if cv is None:
-            return None
-        gray = cv2.cvtColor(cv, cv2.COLOR_BGR2GRAY)
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(48,48))
-        if len(faces) == 0:
-            return None
-        x,y,w,h = sorted(faces, key=lambda f: f[2]*f[3], reverse=True)[0]
-        return (x,y,w,h), cv
-
-    ref_face, ref_cv = detect_face_box(ref_bytes)
-    user_face, user_cv = detect_face_box(user_bytes)
+    if hint:
+        instruction += f" Hint: {hint}."
 
     # Build contents with optional face crops and coordinates
     parts = [{"text": instruction}]
-    if ref_face and ref_cv is not None:
-        x,y,w,h = ref_face[0], ref_face[1], ref_face[2], ref_face[3]
+    if ref_face:
+        x,y,w,h = ref_face
         parts.append({"text": f"Reference base scene (primary face approx bbox: x={x}, y={y}, w={w}, h={h}):"})
     else:
         parts.append({"text": "Reference base scene:"})
-    parts.append({"inlineData": {"mimeType": ref_mime, "data": base64.b64encode(ref_bytes).decode("utf-8")}})
-
-    parts.append({"text": "User portrait (cast this person's FACE into the reference):"})
-    parts.append({"inlineData": {"mimeType": user_mime, "data": base64.b64encode(user_bytes).decode("utf-8")}})
-
-    # Provide a close crop of the user's face to strengthen identity match
-    try:
-        if user_face and user_cv is not None:
-            ux,uy,uw,uh = user_face[0], user_face[1], user_face[2], user_face[3]
-            # expand box for hairline/chin
-            pad = int(max(uw, uh)*0.4)
-            x0 = max(0, ux - pad)
-            y0 = max(0, uy - pad)
-            x1 = min(user_cv.shape[1], ux + uw + pad)
-            y1 = min(user_cv.shape[0], uy + uh + pad)
-            crop = user_cv[y0:y1, x0:x1]
-            _, enc = cv2.imencode('.png', crop)
-            parts.append({"text": "User face close-up (for identity and texture):"})
-            parts.append({"inlineData": {"mimeType": "image/png", "data": base64.b64encode(enc.tobytes()).decode("utf-8")}})
-    except Exception:
-        pass
+    parts.append(scene_part)
+    parts.extend(user_parts)
 
     contents = [{"role": "user", "parts": parts}]
 
-    try:
-        resp = requests.post(
-            GEMINI_ENDPOINT,
-            headers={
-                "Content-Type": "application/json",
-                "X-goog-api-key": GEMINI_API_KEY,
-            },
-            json={
-                "systemInstruction": {
-                    "role": "system",
-                    "parts": [
-                        {"text": (
-                            "Photorealistic composite. Preserve identity. Do not change gender/gender expression, skin tone, ethnicity, age, or body type. "
-                            "Absolutely no text/letters/numbers/logos/watermarks anywhere in the image."
-                        )}
-                    ]
-                },
-                "contents": contents,
+    resp = _post_gemini(
+        {
+            "systemInstruction": {
+                "role": "system",
+                "parts": [
+                    {"text": (
+                        "Photorealistic composite. Preserve identity. Do not change gender/gender expression, skin tone, ethnicity, age, or body type. "
+                        "Absolutely no text/letters/numbers/logos/watermarks anywhere in the image."
+                    )}
+                ]
             },
-            timeout=60,
-        )
-    except requests.RequestException as e:
-        raise HTTPException(status_code=502, detail=f"Upstream error: {e}")
+            "contents": contents,
+        },
+        trace,
+    )
 
     if resp.status_code != 200:
         raise HTTPException(status_code=resp.status_code, detail=resp.text)
 
-    data = resp.json()
-    inline_b64: Optional[str] = None
-    try:
-        for cand in data.get("candidates", []):
-            for p in cand.get("content", {}).get("parts", []):
-                if "inlineData" in p:
-                    inline_b64 = p["inlineData"]["data"]
-                    break
-            if inline_b64:
-                break
-    except Exception as e:
-        logger.exception("Failed to parse upstream response: %s", e)
-        inline_b64 = None
-    if not inline_b64:
-        logger.error("No image returned from model for theme=%s", body.theme)
-        raise HTTPException(status_code=500, detail="No image returned from model")
+    out_bytes = _extract_inline_image(resp, trace)
 
     # Post-process to a consistent size (portrait)
-    def resize_cover(img: Image.Image, tw: int, th: int) -> Image.Image:
-        w, h = img.size
-        if w == 0 or h == 0:
-            return img
-        scale = max(tw / w, th / h)
-        nw, nh = int(w * scale), int(h * scale)
-        img2 = img.resize((nw, nh), Image.LANCZOS)
-        left = max(0, (nw - tw) // 2)
-        top = max(0, (nh - th) // 2)
-        box = (left, top, left + tw, top + th)
-        img3 = img2.crop(box)
-        return img3
-
+    t0 = time.perf_counter()
     try:
-        out_bytes = base64.b64decode(inline_b64)
-        out_img = Image.open(BytesIO(out_bytes))
-        out_img.load()
-    except Exception:
+        processed_bytes, _, enc_s = workers.run(imaging.postprocess_composite, out_bytes, 1024, 1280)
+    except ValueError:
         raise HTTPException(status_code=500, detail="Failed to decode model image")
+    trace.add("postprocess", time.perf_counter() - t0 - enc_s)
+    trace.add("encode", enc_s)
+    trace.alloc("postprocess", len(out_bytes) + 4 * 1024 * 1280)
+    with trace.stage("encode"):
+        processed_b64 = base64.b64encode(processed_bytes).decode("utf-8")
+    trace.alloc("encode", len(processed_bytes) + len(processed_b64))
+
+    with trace.stage("persist"):
+        saved_url = _save_output(processed_bytes, trace)
+    return {"image_base64": processed_b64, "mime_type": "image/png", "saved_url": saved_url}
 
-    tw, th = (1024, 1280)
+
+def _composite_batch_user(body: CompositeBatchBody, trace: metrics.RequestTrace) -> List[Dict[str, Any]]:
+    if not upstreams.POOL.upstreams:
+        raise HTTPException(status_code=500, detail="GEMINI_API_KEY not set")
+    return _composite_user(body.user_image, body.user_mime_type, trace)
+
+
+def _composite_ref(ref: CompositeRef, user_parts: List[Dict[str, Any]], template: Optional[templates.Template],
+                   hint: Optional[str], trace: metrics.RequestTrace):
+    scene_part, ref_face = _composite_scene(ref.ref_image, ref.ref_mime_type, template, trace)
+    return _composite_render(user_parts, scene_part, ref_face, hint, trace)
+
+
+async def _batch_ref(index: int, ref: CompositeRef, user_parts: List[Dict[str, Any]], default_hint: Optional[str],
+                     pool: admission.Bulkhead, client: str, gate: asyncio.Semaphore,
+                     batch: metrics.RequestTrace) -> Dict[str, Any]:
+    """One reference of a batch as its own traced composite; any failure becomes this entry's error."""
+    hint = ref.hint if ref.hint is not None else default_hint
+    trace = metrics.RequestTrace("composite")
+    # The whole batch stops together and shares one deadline
+    trace.token, trace.deadline = batch.token, batch.deadline
+    trace.info["batch_index"] = index
+    shape = {"ref_mime_type": ref.ref_mime_type, "hint_len": len(hint or ""), "template_id": ref.template_id,
+             "batch_index": index}
     try:
-        out_img = resize_cover(out_img.convert("RGBA"), tw, th)
-    except Exception:
+        if (ref.ref_image is None) == (ref.template_id is None):
+            raise _refuse(trace, shape, 400, "Provide exactly one of ref_image or template_id")
+        template = None
+        if ref.template_id is not None:
+            template = templates.LIBRARY.get(ref.template_id)
+            metrics.COMPOSITE_TEMPLATES.inc(outcome="hit" if template else "miss")
+            if template is None:
+                raise _refuse(trace, shape, 404, f"Unknown template_id: {ref.template_id}")
+            footprint = ingest.estimate_peak([], []) + len(template.b64)
+        else:
+            headers = _probe_inputs(trace, shape, ref.ref_image)
+            footprint = ingest.estimate_peak([len(ref.ref_image)], headers)
+        if not admission.MEMORY.fits(footprint):
+            raise _refuse(trace, shape, 413, "Request too large to process (reduce image size)")
+        async with gate:
+            result = await _run_admitted(pool, client, 1, footprint, trace, Response(), shape,
+                                         _composite_ref, ref, user_parts, template, hint, trace)
+        return {"index": index, **result}
+    except HTTPException as e:
+        error = {"status": e.status_code, "detail": e.detail}
+        if e.headers and "Retry-After" in e.headers:
+            error["retry_after"] = int(e.headers["Retry-After"])
+        return {"index": index, "error": error}
+    except Exception as e:
+        logger.exception("composite batch reference %s failed: %s", index, e)
+        return {"index": index, "error": {"status": 500, "detail": "Internal error"}}
+
+
+@app.post("/api/composite/batch")
+async def composite_batch(body: CompositeBatchBody, request: Request, response: Response):
+    """Cast one user into many references.
+
+    The user photo is decoded, ingested, detected and fitted once, under its
+    own composite slot. Each reference then runs as a separate composite
+    with its own slot, memory reservation and trace, at most
+    COMPOSITE_BATCH_CONCURRENCY at a time. The rate limit is charged once
+    per reference, up front. A failing reference becomes an ``error`` entry
+    and does not affect the others. If the client disconnects, references
+    not yet started are dropped (see cancel.py).
+    """
+    trace = metrics.RequestTrace("composite_batch")
+    deadlines.start(trace, request.headers)
+    shape = {"user_mime_type": body.user_mime_type, "refs": len(body.refs), "stream": body.stream}
+    if not 1 <= len(body.refs) <= COMPOSITE_BATCH_MAX:
+        raise _refuse(trace, shape, 400, f"refs must hold 1 to {COMPOSITE_BATCH_MAX} references")
+    if body.stream and request.headers.get("idempotency-key"):
+        raise _refuse(trace, shape, 400, "Idempotency-Key is not supported with stream")
+    pool = admission.pool_for("composite")
+    headers = _probe_inputs(trace, shape, body.user_image)
+    footprint = ingest.estimate_peak([len(body.user_image)], headers)
+
+    async def run_user():
+        if not admission.MEMORY.fits(footprint):
+            raise _refuse(trace, shape, 413, "Request too large to process (reduce image size)")
+        client = ratelimit.client_key(request)
+        try:
+            ratelimit.check("composite", client, len(body.refs))
+        except ratelimit.RateLimited as e:
+            raise _refuse(trace, shape, 429, "Too many requests, please slow down", {"Retry-After": str(e.retry_after)})
+        user_parts = await _run_admitted(pool, client, 1, footprint, trace, response, shape,
+                                         _composite_batch_user, body, trace)
+        gate = asyncio.Semaphore(COMPOSITE_BATCH_CONCURRENCY)
+        return [
+            asyncio.ensure_future(_batch_ref(i, ref, user_parts, body.hint, pool, client, gate, trace))
+            for i, ref in enumerate(body.refs)
+        ]
+
+    async def collected():
+        results = await asyncio.gather(*await run_user())
+        failed = sum(1 for r in results if "error" in r)
+        out = {"results": results, "succeeded": len(results) - failed, "failed": failed}
+        if trace.info.get("warnings"):
+            out["warnings"] = trace.info["warnings"]
+        return out
+
+    watch = cancel.watch(request, trace.token)
+    try:
+        if not body.stream:
+            return await _idempotent(request, response, trace, shape, collected)
+        tasks = await run_user()
+    finally:
+        if watch is not None:
+            watch.cancel()
+
+    async def lines():
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done) + "\n"
+        finally:
+            # The response stream closed early: the client went away
+            if not all(task.done() for task in tasks):
+                trace.token.cancel()
+            for task in tasks:
+                task.cancel()
+
+    timing = {k: v for k, v in response.headers.items() if k.lower() in {"server-timing", "timing-allow-origin"}}
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers=timing)
+
+
+def _parse_time(value: Optional[str], name: str) -> Optional[float]:
+    """Epoch seconds or ISO 8601 (naive times are UTC)."""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
         pass
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}: use epoch seconds or ISO 8601")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+@app.get("/api/outputs")
+def list_outputs(theme: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                 limit: int = 50, cursor: Optional[str] = None):
+    """Saved outputs, newest first, from the gallery index; pass next_cursor back for the next page."""
+    try:
+        items, next_cursor = gallery.INDEX.list(
+            theme=theme, since=_parse_time(since, "since"), until=_parse_time(until, "until"), limit=limit, cursor=cursor,
+        )
+    except gallery.BadCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": items, "next_cursor": next_cursor}
+
+
+@app.get("/api/outputs/archive")
+def download_outputs(ids: str, name: Optional[str] = None):
+    """Stream a ZIP of saved outputs (comma-separated ids) without buffering the archive."""
+    wanted = archive.parse_ids(ids)
+    if not wanted or len(wanted) > archive.MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"ids must list 1 to {archive.MAX_ITEMS} outputs")
+    bad = [oid for oid in wanted if not archive.valid_id(oid)]
+    if bad:
+        raise HTTPException(status_code=400, detail=f"Invalid output id: {bad[0][:64]}")
+    entries, missing = archive.entries_for(wanted, OUTPUTS_DIR)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Unknown output ids: {', '.join(missing[:10])}")
+    filename = re.sub(r"[^A-Za-z0-9._-]", "_", name or "")[:64] or f"portraits_{int(time.time())}"
+    if not filename.endswith(".zip"):
+        filename += ".zip"
+    metrics.OUTPUT_ARCHIVES.inc(len(entries))
+    return StreamingResponse(
+        archive.stream_zip(entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
-    buf = BytesIO()
-    out_img.save(buf, format="PNG")
-    processed_bytes = buf.getvalue()
-    processed_b64 = base64.b64encode(processed_bytes).decode("utf-8")
 
-    out_dir = os.path.join(os.path.dirname(__file__), "static", "outputs")
-    os.makedirs(out_dir, exist_ok=True)
-    out_id = f"{uuid.uuid4().hex}.png"
-    out_path = os.path.join(out_dir, out_id)
-    with open(out_path, "wb") as f:
-        f.write(processed_bytes)
+def _check_admin(request: Request) -> None:
+    # Templates are shared by every composite; without a configured key nobody may change them
+    if not templates.ADMIN_KEY:
+        raise HTTPException(status_code=403, detail="Template changes are disabled (TEMPLATES_ADMIN_KEY not set)")
+    if not hmac.compare_digest(request.headers.get("x-admin-key", ""), templates.ADMIN_KEY):
+        raise HTTPException(status_code=403, detail="X-Admin-Key required")
 
-    saved_url = f"/outputs/{out_id}"
-    return {"image_base64": processed_b64, "mime_type": "image/png", "saved_url": saved_url}
+
+@app.post("/api/templates")
+def register_template(body: TemplateBody, request: Request, response: Response):
+    """Register a reference scene once; composites then pass its id instead of ref_image."""
+    _check_admin(request)
+    try:
+        data = base64.b64decode(body.image)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid base64 image")
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty image data")
+    if len(data) > 12 * 1024 * 1024:
+        raise HTTPException(status_code=413, detail="Image too large (max 12MB)")
+    try:
+        header = ingest.probe(data)
+        ingest.check_pixels(header)
+    except ingest.TooManyPixels as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if header is None:
+        raise HTTPException(status_code=400, detail="Unreadable image")
+    mime = normalize_mime(body.mime_type)
+    if mime not in {"image/png", "image/jpeg"}:
+        raise HTTPException(status_code=415, detail="Unsupported image mime type (use PNG or JPEG)")
+    try:
+        template, created = templates.LIBRARY.register(data, mime, body.name or "")
+    except templates.LibraryFull as e:
+        raise HTTPException(status_code=507, detail=str(e))
+    logger.info("template %s %s (%sx%s, face=%s)", template.id, "registered" if created else "already registered",
+                template.width, template.height, template.face)
+    if created:
+        response.status_code = 201
+    return template.describe()
+
+
+@app.get("/api/templates")
+def list_templates():
+    return {"templates": [t.describe() for t in templates.LIBRARY.list()]}
+
+
+@app.get("/api/templates/{template_id}")
+def get_template(template_id: str):
+    template = templates.LIBRARY.get(template_id)
+    if template is None:
+        raise HTTPException(status_code=404, detail="Unknown template")
+    return template.describe()
+
+
+@app.delete("/api/templates/{template_id}")
+def delete_template(template_id: str, request: Request):
+    _check_admin(request)
+    if not templates.LIBRARY.delete(template_id):
+        raise HTTPException(status_code=404, detail="Unknown template")
+    return {"deleted": template_id}
 
 
 # Static files (outputs) via ASGI mount
 from fastapi.staticfiles import StaticFiles  # noqa: E402
 
-static_dir = os.path.join(os.path.dirname(__file__), "static")
-os.makedirs(os.path.join(static_dir, "outputs"), exist_ok=True)
-app.mount("/outputs", StaticFiles(directory=os.path.join(static_dir, "outputs")), name="outputs")
+os.makedirs(OUTPUTS_DIR, exist_ok=True)
+app.mount("/outputs", StaticFiles(directory=OUTPUTS_DIR), name="outputs")
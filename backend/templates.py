@@ -0,0 +1,187 @@
+"""Reference-scene templates for ``/api/composite``.
+
+Composite traffic casts many users into the same few dozen posters and
+scenes. A template is such a reference registered once. At registration
+the server ingests it (working resolution, upright), detects its primary
+face, and fits it to the ``scene`` payload budget. The stored result is
+the payload-ready encoding, its base64 text, the face box in that
+encoding's coordinates, and the metadata. A composite that names a
+``template_id`` then only decodes, detects and encodes the user photo.
+
+Templates persist under ``TEMPLATES_DIR``, one ``<id>.json`` metadata
+file plus one image file each, and are loaded lazily on first use. The
+id is derived from the content of the uploaded image, so registering the
+same file twice returns the existing template. ``TEMPLATES_MAX`` bounds
+the library, since every template's base64 stays in memory. Registering
+and deleting require ``TEMPLATES_ADMIN_KEY`` in ``X-Admin-Key``; without a
+configured key both are disabled (403).
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import imaging
+import ingest
+import payload
+import workers
+
+logger = logging.getLogger("ai_portrait_studio")
+
+TEMPLATES_DIR = os.getenv("TEMPLATES_DIR", os.path.join(os.path.dirname(__file__), "data", "templates"))
+ADMIN_KEY = os.getenv("TEMPLATES_ADMIN_KEY", "")
+try:
+    MAX_TEMPLATES = max(1, int(os.getenv("TEMPLATES_MAX", "200")))
+except Exception:
+    MAX_TEMPLATES = 200
+
+_EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp"}
+
+
+class LibraryFull(Exception):
+    pass
+
+
+class Template:
+    __slots__ = ("id", "name", "mime", "width", "height", "face", "b64", "size", "source", "created")
+
+    def __init__(self, id: str, name: str, mime: str, width: int, height: int,
+                 face: Optional[Tuple[int, int, int, int]], b64: str, size: int, source: Dict[str, Any], created: float):
+        self.id = id
+        self.name = name
+        self.mime = mime
+        self.width = width
+        self.height = height
+        self.face = face
+        self.b64 = b64
+        self.size = size
+        self.source = source
+        self.created = created
+
+    def describe(self) -> Dict[str, Any]:
+        """Metadata only (no image data); also what ``<id>.json`` holds."""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "mime_type": self.mime,
+            "width": self.width,
+            "height": self.height,
+            "face_box": list(self.face) if self.face else None,
+            "bytes": self.size,
+            "source": self.source,
+            "created": self.created,
+        }
+
+
+def template_id(img_bytes: bytes) -> str:
+    return hashlib.sha256(img_bytes).hexdigest()[:16]
+
+
+def analyze(img_bytes: bytes, mime: str) -> Tuple[bytes, str, int, int, Optional[Tuple[int, int, int, int]]]:
+    """Ingest, detect and fit a reference scene; returns (bytes, mime, width, height, face box).
+
+    The face box is detected on the working image and scaled to the fitted
+    encoding, which is what the model sees.
+    """
+    work_bytes, work_mime = imaging.ingest_input(img_bytes, mime)
+    face = imaging.analyze_face(work_bytes)
+    scene_bytes, scene_mime = payload.fit(work_bytes, work_mime, payload.budget_for(None, "scene"))
+    work_header, scene_header = ingest.probe(work_bytes), ingest.probe(scene_bytes)
+    if scene_header is None:
+        raise ValueError("unreadable image")
+    if face and work_header and work_header.width != scene_header.width:
+        k = scene_header.width / float(work_header.width)
+        face = tuple(int(v * k) for v in face)
+    return scene_bytes, scene_mime, scene_header.width, scene_header.height, face
+
+
+class TemplateLibrary:
+    def __init__(self, root: str, max_templates: int = MAX_TEMPLATES):
+        self.root = root
+        self.max_templates = max_templates
+        self._lock = threading.Lock()
+        self._items: Optional[Dict[str, Template]] = None
+
+    def _paths(self, tid: str, mime: str) -> Tuple[str, str]:
+        return os.path.join(self.root, f"{tid}.json"), os.path.join(self.root, f"{tid}.{_EXTENSIONS.get(mime, 'bin')}")
+
+    def _load(self) -> Dict[str, Template]:
+        # Called with the lock held
+        if self._items is not None:
+            return self._items
+        items: Dict[str, Template] = {}
+        if os.path.isdir(self.root):
+            for fname in sorted(os.listdir(self.root)):
+                if not fname.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(self.root, fname), encoding="utf-8") as f:
+                        meta = json.load(f)
+                    with open(self._paths(meta["id"], meta["mime_type"])[1], "rb") as f:
+                        data = f.read()
+                    face = tuple(meta["face_box"]) if meta.get("face_box") else None
+                    items[meta["id"]] = Template(
+                        meta["id"], meta.get("name") or "", meta["mime_type"], meta["width"], meta["height"], face,
+                        base64.b64encode(data).decode("ascii"), len(data), meta.get("source") or {}, meta.get("created", 0.0),
+                    )
+                except Exception as e:
+                    logger.warning("skipping template %s: %s", fname, e)
+        self._items = items
+        logger.info("loaded %d composite templates from %s", len(items), self.root)
+        return items
+
+    def get(self, tid: str) -> Optional[Template]:
+        with self._lock:
+            return self._load().get(tid)
+
+    def list(self) -> List[Template]:
+        with self._lock:
+            return sorted(self._load().values(), key=lambda t: t.created)
+
+    def register(self, img_bytes: bytes, mime: str, name: str = "") -> Tuple[Template, bool]:
+        """Analyse and store a reference scene; returns (template, created)."""
+        tid = template_id(img_bytes)
+        with self._lock:
+            existing = self._load().get(tid)
+            if existing is not None:
+                return existing, False
+            if len(self._items) >= self.max_templates:
+                raise LibraryFull(f"template library is full ({self.max_templates})")
+        # Analysis is the slow part; run it outside the lock
+        header = ingest.probe(img_bytes)
+        scene_bytes, scene_mime, width, height, face = workers.run(analyze, img_bytes, mime)
+        source = {"format": header.format if header else None, "width": header.width if header else None,
+                  "height": header.height if header else None, "bytes": len(img_bytes)}
+        tpl = Template(tid, name[:128], scene_mime, width, height, face,
+                       base64.b64encode(scene_bytes).decode("ascii"), len(scene_bytes), source, time.time())
+        os.makedirs(self.root, exist_ok=True)
+        meta_path, image_path = self._paths(tid, scene_mime)
+        for path, data in ((image_path, scene_bytes), (meta_path, json.dumps(tpl.describe()).encode("utf-8"))):
+            tmp = f"{path}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        with self._lock:
+            # A concurrent registration of the same image may have won; both wrote identical files
+            tpl = self._items.setdefault(tid, tpl)
+        return tpl, True
+
+    def delete(self, tid: str) -> bool:
+        with self._lock:
+            tpl = self._load().pop(tid, None)
+        if tpl is None:
+            return False
+        for path in self._paths(tid, tpl.mime):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return True
+
+
+LIBRARY = TemplateLibrary(TEMPLATES_DIR)
@@ -0,0 +1,279 @@
+"""Pool of upstream API keys and endpoints.
+
+One key caps throughput at that key's quota. ``GEMINI_UPSTREAMS`` configures
+a pool instead: ``;``-separated entries of ``field=value`` pairs, e.g.
+
+    GEMINI_UPSTREAMS="name=a,key=env:GEMINI_KEY_A,rpm=60;name=b,key=env:GEMINI_KEY_B,rpm=30,weight=2"
+
+- ``key``: the API key, or ``env:NAME`` to read it from another variable
+- ``endpoint``: defaults to ``GEMINI_ENDPOINT``
+- ``rpm``/``tpm``: the key's requests/tokens per minute (0 = not tracked)
+- ``weight``: relative share among upstreams with the same headroom (default 1)
+- ``name``: label in metrics and logs (default ``u<n>``); keys never appear there
+
+``GEMINI_API_KEYS=k1,k2`` is shorthand for equal keys on ``GEMINI_ENDPOINT``.
+Without either, the pool is the single ``GEMINI_API_KEY``.
+
+Each call goes to the upstream with the highest score. The score is the
+free share of its rpm and tpm windows over the last minute, times its
+weight, divided by one plus the calls already in flight on it. An upstream
+is out of rotation while:
+
+- its rpm window is full
+- it is cooling down after a 429. The cooldown is the response's retry
+  hint when present, else ``UPSTREAM_COOLDOWN_SECONDS``, doubling for
+  consecutive 429s up to ``UPSTREAM_COOLDOWN_MAX_SECONDS``.
+- it is ejected after ``UPSTREAM_EJECT_FAILURES`` consecutive 5xx or
+  transport errors, with the same backoff. The first call after the
+  cooldown is a probe, and one more failure ejects it again.
+
+The last upstream in rotation (always the case with a single key) is
+never ejected. After a 429 it cools down only for the retry hint, or
+else for a short backoff (1s, doubling up to 8s). Otherwise one 429 would
+refuse all traffic for the whole cooldown when nothing can take over.
+
+``server._post_gemini`` moves a call that got a 429 or a transport error
+to the next upstream. When no upstream is in rotation, it raises
+``Unavailable`` with the seconds until one is.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger("ai_portrait_studio")
+
+DEFAULT_ENDPOINT = (
+    "https://generativelanguage.googleapis.com/v1beta/models/"
+    "gemini-2.5-flash-image-preview:generateContent"
+)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return max(0.0, float(os.getenv(name, str(default))))
+    except Exception:
+        return default
+
+
+COOLDOWN_SECONDS = _env_float("UPSTREAM_COOLDOWN_SECONDS", 30.0)
+COOLDOWN_MAX_SECONDS = _env_float("UPSTREAM_COOLDOWN_MAX_SECONDS", 300.0)
+try:
+    EJECT_FAILURES = max(1, int(os.getenv("UPSTREAM_EJECT_FAILURES", "3")))
+except Exception:
+    EJECT_FAILURES = 3
+
+_WINDOW = 60.0
+# Cooldown after a 429 without a retry hint when no other upstream can take over
+_LAST_BACKOFF_SECONDS = 1.0
+_LAST_BACKOFF_MAX_SECONDS = 8.0
+# google.rpc.RetryInfo in a 429 body: "retryDelay": "27s"
+_RETRY_DELAY = re.compile(rb'"retryDelay"\s*:\s*"(\d+(?:\.\d+)?)s"')
+
+
+class Unavailable(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("no upstream in rotation")
+        self.retry_after = retry_after
+
+
+class Upstream:
+    def __init__(self, name: str, key: str, endpoint: str, weight: float = 1.0, rpm: float = 0.0, tpm: float = 0.0):
+        self.name = name
+        self.key = key
+        self.endpoint = endpoint
+        self.weight = weight
+        self.rpm = rpm
+        self.tpm = tpm
+        self.calls: Deque[float] = deque()  # send times within the window
+        self.tokens: Deque[Tuple[float, int]] = deque()
+        self.token_sum = 0
+        self.inflight = 0
+        self.cooldown_until = 0.0
+        self.strikes = 0  # consecutive 429s
+        self.failures = 0  # consecutive 5xx / transport errors
+
+    def __repr__(self) -> str:
+        return f"Upstream({self.name}, {self.endpoint}, weight={self.weight}, rpm={self.rpm}, tpm={self.tpm})"
+
+    def _trim(self, now: float) -> None:
+        while self.calls and now - self.calls[0] >= _WINDOW:
+            self.calls.popleft()
+        while self.tokens and now - self.tokens[0][0] >= _WINDOW:
+            self.token_sum -= self.tokens.popleft()[1]
+
+    def headroom(self, now: float) -> float:
+        """Free share of the tighter per-minute quota; 1.0 when neither is tracked."""
+        self._trim(now)
+        free = 1.0
+        if self.rpm:
+            free = min(free, 1.0 - len(self.calls) / self.rpm)
+        if self.tpm:
+            free = min(free, 1.0 - self.token_sum / self.tpm)
+        return free
+
+    def available_at(self, now: float) -> float:
+        """Earliest time this upstream is back in rotation, ignoring token use."""
+        at = max(now, self.cooldown_until)
+        if self.rpm and len(self.calls) >= self.rpm:
+            at = max(at, self.calls[0] + _WINDOW)
+        return at
+
+
+class Pool:
+    def __init__(self, upstreams: List[Upstream]):
+        self.upstreams = upstreams
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.upstreams)
+
+    def endpoints(self) -> List[str]:
+        return list(dict.fromkeys(u.endpoint for u in self.upstreams))
+
+    def acquire(self, exclude: Iterable[str] = ()) -> Upstream:
+        """Reserve a call on the best upstream not in ``exclude``; raises Unavailable when none is in rotation."""
+        exclude = set(exclude)
+        with self._lock:
+            now = time.monotonic()
+            best, best_score = None, 0.0
+            for u in self.upstreams:
+                if u.name in exclude or u.cooldown_until > now:
+                    continue
+                score = u.weight * u.headroom(now) / (1 + u.inflight)
+                if score > best_score:
+                    best, best_score = u, score
+            if best is None:
+                waits = [u.available_at(now) - now for u in self.upstreams if u.name not in exclude]
+                metrics.UPSTREAM_POOL_EXHAUSTED.inc()
+                raise Unavailable(max(1, int(min(waits, default=COOLDOWN_SECONDS) + 0.999)))
+            best.calls.append(now)
+            best.inflight += 1
+        metrics.UPSTREAM_POOL_INFLIGHT.inc(upstream=best.name)
+        return best
+
+    def _last_in_rotation(self, u: Upstream, now: float) -> bool:
+        return not any(v is not u and v.cooldown_until <= now for v in self.upstreams)
+
+    def release(self, u: Upstream, status: str, retry_after: Optional[float] = None) -> None:
+        """Record a call's outcome: an HTTP status, ``error`` (transport) or ``abandoned`` (never sent)."""
+        metrics.UPSTREAM_POOL_INFLIGHT.dec(upstream=u.name)
+        if status != "abandoned":
+            metrics.UPSTREAM_POOL_CALLS.inc(upstream=u.name, status=status)
+        with self._lock:
+            u.inflight -= 1
+            now = time.monotonic()
+            last = self._last_in_rotation(u, now)
+            if status == "429":
+                u.strikes += 1
+                if last:
+                    cooldown = retry_after if retry_after is not None else min(
+                        _LAST_BACKOFF_MAX_SECONDS, _LAST_BACKOFF_SECONDS * 2 ** (u.strikes - 1))
+                else:
+                    cooldown = retry_after or COOLDOWN_SECONDS * 2 ** (u.strikes - 1)
+                reason = "429"
+            elif status == "error" or status.startswith("5"):
+                u.failures += 1
+                # Ejecting the last upstream would only turn its errors into refusals
+                if u.failures < EJECT_FAILURES or last:
+                    return
+                cooldown = COOLDOWN_SECONDS * 2 ** (u.failures - EJECT_FAILURES)
+                reason = "failures"
+            else:
+                if status != "abandoned":
+                    u.strikes = u.failures = 0
+                return
+            cooldown = min(COOLDOWN_MAX_SECONDS, cooldown)
+            u.cooldown_until = max(u.cooldown_until, now + cooldown)
+        metrics.UPSTREAM_POOL_COOLDOWNS.inc(upstream=u.name, reason=reason)
+        logger.warning("upstream %s out of rotation for %.0fs (%s)", u.name, cooldown, reason)
+
+    def usage(self, u: Optional[Upstream], usage: Any) -> None:
+        """Charge a response's total tokens to its upstream's tpm window."""
+        if u is None or not isinstance(usage, dict):
+            return
+        total = usage.get("totalTokenCount")
+        if not isinstance(total, int) or total <= 0:
+            return
+        metrics.UPSTREAM_POOL_TOKENS.inc(total, upstream=u.name)
+        with self._lock:
+            u.tokens.append((time.monotonic(), total))
+            u.token_sum += total
+
+    def sample(self) -> None:
+        """Refresh the headroom and rotation gauges (called on scrape)."""
+        with self._lock:
+            now = time.monotonic()
+            rows = [(u.name, u.headroom(now), u.available_at(now) <= now) for u in self.upstreams]
+        for name, free, up in rows:
+            metrics.UPSTREAM_POOL_HEADROOM.set(round(max(0.0, free), 4), upstream=name)
+            metrics.UPSTREAM_POOL_AVAILABLE.set(1 if up else 0, upstream=name)
+
+
+def retry_after(resp) -> Optional[float]:
+    """Seconds a 429 asks us to wait: the Retry-After header, else RetryInfo in the body."""
+    raw = resp.headers.get("Retry-After")
+    if raw:
+        try:
+            return max(0.0, float(raw))
+        except ValueError:
+            pass
+    m = _RETRY_DELAY.search(resp.content[:4096])
+    return float(m.group(1)) if m else None
+
+
+def _resolve(value: str) -> str:
+    if value.startswith("env:"):
+        return os.getenv(value[4:], "")
+    return value
+
+
+def parse(spec: str, default_endpoint: str) -> List[Upstream]:
+    upstreams: List[Upstream] = []
+    names = set()
+    for i, entry in enumerate(e for e in re.split(r"[;\n]", spec) if e.strip()):
+        fields: Dict[str, str] = {}
+        for item in entry.split(","):
+            name, sep, value = item.strip().partition("=")
+            if sep:
+                fields[name.strip()] = value.strip()
+        key = _resolve(fields.get("key", ""))
+        if not key:
+            logger.warning("GEMINI_UPSTREAMS entry %d has no key; skipped", i + 1)
+            continue
+        numbers = {}
+        for field, default in (("weight", 1.0), ("rpm", 0.0), ("tpm", 0.0)):
+            try:
+                numbers[field] = max(0.0, float(fields.get(field, default)))
+            except ValueError:
+                numbers[field] = default
+        name = fields.get("name") or f"u{i + 1}"
+        if name in names:
+            # Names label metrics and failover exclusions; a shared one would merge two keys
+            unique = next(f"{name}-{n}" for n in range(2, len(names) + 3) if f"{name}-{n}" not in names)
+            logger.warning("GEMINI_UPSTREAMS entry %d reuses name %s; renamed %s", i + 1, name, unique)
+            name = unique
+        names.add(name)
+        upstreams.append(Upstream(name, key, fields.get("endpoint") or default_endpoint,
+                                  max(0.01, numbers["weight"]), numbers["rpm"], numbers["tpm"]))
+    return upstreams
+
+
+def from_env() -> Pool:
+    endpoint = os.getenv("GEMINI_ENDPOINT", DEFAULT_ENDPOINT)
+    spec = os.getenv("GEMINI_UPSTREAMS", "")
+    if spec.strip():
+        return Pool(parse(spec, endpoint))
+    keys = [k.strip() for k in os.getenv("GEMINI_API_KEYS", "").split(",") if k.strip()]
+    if not keys and os.getenv("GEMINI_API_KEY"):
+        keys = [os.getenv("GEMINI_API_KEY")]
+    return Pool([Upstream(f"u{i + 1}", key, endpoint) for i, key in enumerate(keys)])
+
+
+POOL = from_env()
@@ -0,0 +1,118 @@
+"""Startup warm-up and readiness.
+
+Heavy imports (OpenCV) are deferred (see ``lazy.py``), so ``import server``
+stays cheap. The first-request costs move into an explicit warm-up phase
+that the app lifespan starts in the background:
+
+- ``imports``: load numpy/OpenCV and register PIL's image plugins
+- ``detector``: build ``WARMUP_DETECTORS`` face detector instances (Haar
+  XML / YuNet model) into the shared free list, one per request that can
+  run at once (the admission slots), so no request thread pays the load
+- ``pipeline``: run a tiny synthetic image through ingest, preflight and
+  postprocess. This starts the CPU worker pool when one is configured.
+- ``upstream``: open keep-alive connections (TCP + TLS) to each upstream
+  host in the shared session's pool
+
+Each phase is timed into ``portrait_warmup_seconds``. ``/ready`` answers 503
+until warm-up has finished; ``/health`` stays a pure liveness check.
+Failures are logged and do not block readiness: the request path handles
+everything lazily anyway. Set ``WARMUP=0`` to skip it.
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from PIL import Image
+
+import admission
+import detectors
+import imaging
+import lazy
+import metrics
+import preflight
+import workers
+
+logger = logging.getLogger("ai_portrait_studio")
+
+ENABLED = os.getenv("WARMUP", "1").lower() not in {"0", "false", "no"}
+try:
+    UPSTREAM_CONNECTIONS = max(0, int(os.getenv("WARMUP_UPSTREAM_CONNECTIONS", "2")))
+except Exception:
+    UPSTREAM_CONNECTIONS = 2
+try:
+    DETECTORS = max(0, int(os.getenv("WARMUP_DETECTORS") or sum(p.concurrency for p in admission.POOLS.values())))
+except Exception:
+    DETECTORS = sum(p.concurrency for p in admission.POOLS.values())
+
+_ready = threading.Event()
+phases: Dict[str, float] = {}
+error: Optional[str] = None
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def _synthetic_jpeg() -> bytes:
+    img = Image.linear_gradient("L").resize((240, 300)).convert("RGB")
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+def _prime_upstream(session, endpoints: List[str]) -> None:
+    origins = list(dict.fromkeys(f"{p.scheme}://{p.netloc}/" for p in map(urlsplit, endpoints)))
+
+    def touch(origin: str):
+        try:
+            # Any response will do; the point is a pooled, already-handshaken connection
+            session.head(origin, timeout=5)
+        except Exception as e:
+            logger.info("warm-up: upstream connection to %s failed: %s", origin, e)
+
+    with ThreadPoolExecutor(max_workers=UPSTREAM_CONNECTIONS * max(1, len(origins))) as pool:
+        list(pool.map(touch, [o for o in origins for _ in range(UPSTREAM_CONNECTIONS)]))
+
+
+def _phase(name: str, fn, *args) -> None:
+    global error
+    t0 = time.perf_counter()
+    try:
+        fn(*args)
+    except Exception as e:
+        error = f"{name}: {e}"
+        logger.warning("warm-up phase %s failed: %s", name, e)
+    phases[name] = time.perf_counter() - t0
+    metrics.WARMUP_SECONDS.set(phases[name], phase=name)
+
+
+def _pipeline() -> None:
+    data = _synthetic_jpeg()
+    # Small max_side so the draft-decode and resize paths run too
+    data, _ = workers.run(imaging.ingest_input, data, "image/jpeg", 160)
+    preflight.run(data, "resume")
+    imaging.postprocess_output(data, "resume", None)
+
+
+def run(session, endpoints: List[str]) -> None:
+    """Run all phases (blocking; called from a worker thread by the lifespan)."""
+    if not ENABLED:
+        _ready.set()
+        return
+    t0 = time.perf_counter()
+    _phase("imports", lambda: (lazy.available("numpy", "cv2"), Image.init()))
+    _phase("detector", detectors.prewarm, DETECTORS)
+    _phase("pipeline", _pipeline)
+    if UPSTREAM_CONNECTIONS:
+        _phase("upstream", _prime_upstream, session, endpoints)
+    phases["total"] = time.perf_counter() - t0
+    metrics.WARMUP_SECONDS.set(phases["total"], phase="total")
+    logger.info("warm-up done in %.2fs: %s", phases["total"],
+                ", ".join(f"{k}={v * 1000:.0f}ms" for k, v in phases.items() if k != "total"))
+    _ready.set()
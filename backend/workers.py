@@ -0,0 +1,165 @@
+"""Process pool for the CPU-heavy image stages.
+
+``run(fn, data, *args)`` calls ``fn(data, *args)`` where ``fn`` is a
+module-level function from ``imaging`` and ``data`` is encoded image bytes.
+With ``CPU_POOL_WORKERS`` > 0 the call runs in a worker process: the input
+buffer is copied once into a shared-memory block, and ``bytes`` in the
+result (top level or inside a top-level tuple) come back the same way, so
+large images never go through pickling. With 0 (default) the call runs
+inline in the request thread.
+
+A job still queued in the pool is withdrawn when the calling thread's
+cancel token (``cancel.bound``) is cancelled; a running job finishes.
+"""
+
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import threading
+from multiprocessing import shared_memory
+from typing import Any, Callable, Optional
+
+import cancel
+import detectors
+
+logger = logging.getLogger("ai_portrait_studio")
+
+try:
+    CPU_POOL_WORKERS = max(0, int(os.getenv("CPU_POOL_WORKERS", "0")))
+except Exception:
+    CPU_POOL_WORKERS = 0
+# Buffers smaller than this are passed by value; a shm round trip costs more.
+try:
+    SHM_MIN_BYTES = max(0, int(os.getenv("CPU_POOL_SHM_MIN_BYTES", str(64 * 1024))))
+except Exception:
+    SHM_MIN_BYTES = 64 * 1024
+
+
+class _ShmRef:
+    """Picklable handle to a bytes payload stored in a shared-memory block."""
+
+    __slots__ = ("name", "size")
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+
+    def __getstate__(self):
+        return (self.name, self.size)
+
+    def __setstate__(self, state):
+        self.name, self.size = state
+
+
+def _to_shm(data: bytes) -> _ShmRef:
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    try:
+        shm.buf[:len(data)] = data
+    finally:
+        shm.close()
+    return _ShmRef(shm.name, len(data))
+
+
+def _from_shm(ref: _ShmRef, unlink: bool) -> bytes:
+    shm = shared_memory.SharedMemory(name=ref.name)
+    try:
+        return bytes(shm.buf[:ref.size])
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+
+def _wrap(value: Any) -> Any:
+    if isinstance(value, (bytes, bytearray)) and len(value) >= SHM_MIN_BYTES:
+        return _to_shm(value)
+    return value
+
+
+def _unwrap(value: Any) -> Any:
+    if isinstance(value, _ShmRef):
+        return _from_shm(value, unlink=True)
+    return value
+
+
+def _map_tuple(fn: Callable, value: tuple) -> tuple:
+    # NamedTuple results (e.g. preflight.Report) keep their type
+    items = (fn(v) for v in value)
+    return type(value)._make(items) if hasattr(value, "_make") else tuple(items)
+
+
+def _worker_call(fn: Callable, data: Any, args: tuple) -> Any:
+    # Runs in the worker process; the parent owns (and unlinks) the input block.
+    if isinstance(data, _ShmRef):
+        data = _from_shm(data, unlink=False)
+    result = fn(data, *args)
+    if isinstance(result, tuple):
+        return _map_tuple(_wrap, result)
+    return _wrap(result)
+
+
+def _init_worker() -> None:
+    # A worker runs one job at a time: one detector, built before its first job
+    try:
+        detectors.prewarm(1)
+    except Exception as e:
+        logger.warning("CPU pool worker: detector warm-up failed: %s", e)
+
+
+_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> Optional[concurrent.futures.ProcessPoolExecutor]:
+    global _pool
+    if CPU_POOL_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # forkserver/spawn: forking a threaded server process is unsafe
+                methods = multiprocessing.get_all_start_methods()
+                ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                _pool = concurrent.futures.ProcessPoolExecutor(max_workers=CPU_POOL_WORKERS, mp_context=ctx,
+                                                                initializer=_init_worker)
+                logger.info("started CPU pool with %s workers", CPU_POOL_WORKERS)
+    return _pool
+
+
+def shutdown() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
+
+
+def _wait(future: concurrent.futures.Future, token: Optional[cancel.CancelToken]) -> Any:
+    if token is None:
+        return future.result()
+    while True:
+        try:
+            return future.result(timeout=cancel.POLL_SECONDS)
+        except concurrent.futures.TimeoutError:
+            # Only a job that has not started can be withdrawn; a running one is waited for
+            if token.cancelled and future.cancel():
+                raise cancel.Cancelled("cpu")
+
+
+def run(fn: Callable, data: bytes, *args: Any) -> Any:
+    """Run ``fn(data, *args)`` on the CPU pool (or inline when disabled)."""
+    pool = get_pool()
+    if pool is None:
+        return fn(data, *args)
+    ref = _wrap(data)
+    try:
+        result = _wait(pool.submit(_worker_call, fn, ref, args), cancel.current())
+    finally:
+        if isinstance(ref, _ShmRef):
+            shm = shared_memory.SharedMemory(name=ref.name)
+            shm.close()
+            shm.unlink()
+    if isinstance(result, tuple):
+        return _map_tuple(_unwrap, result)
+    return _unwrap(result)
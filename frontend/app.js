@@ -12,6 +12,7 @@
   
   const quickButtons = Array.from(document.querySelectorAll('[data-theme]'));
   const dlBtn = document.getElementById('downloadBtn');
+  const dlAllBtn = document.getElementById('downloadAllBtn');
   const savedLink = document.getElementById('savedLink');
   const genderSeg = document.getElementById('genderSeg');
 
@@ -26,7 +27,8 @@
 
   let selectedTheme = 'resume';
   let uploaded = null; // { mime, base64Data (no prefix) }
-  let lastResult = null; // { dataUrl, saved_url }
+  let lastResult = null; // { dataUrl, saved_url, ids }
+  const sessionIds = []; // saved output ids from this page session, for the ZIP download
   let genderPresentation = 'auto';
   // composite feature removed
   let shotsCount = 1;
@@ -163,7 +165,8 @@
       quickButtons.forEach(b => b.disabled = true);
       const resp = await fetchWithTimeout(`${API_BASE}/api/generate`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        // Let the server stop (or return the variants done so far) before this fetch gives up
+        headers: { 'Content-Type': 'application/json', 'X-Request-Timeout': '58' },
         body: JSON.stringify({ theme, image: uploaded.base64, mime_type: uploaded.mime, options }),
       }, 60000);
       if (!resp.ok) {
@@ -176,7 +179,7 @@
         const first = data.images[0];
         const firstUrl = `data:${first.mime_type || 'image/png'};base64,${first.image_base64}`;
         UI.setResultImage(firstUrl);
-        lastResult = { dataUrl: firstUrl, saved_url: first.saved_url };
+        lastResult = { dataUrl: firstUrl, saved_url: first.saved_url, ids: rememberOutputs(data.images.map(im => im.saved_url)) };
         data.images.forEach((im, i) => {
           const u = `data:${im.mime_type || 'image/png'};base64,${im.image_base64}`;
           UI.addToGallery(u);
@@ -190,7 +193,7 @@
         const dataUrl = `data:${data.mime_type || 'image/png'};base64,${data.image_base64}`;
         UI.setResultImage(dataUrl);
         UI.addToGallery(dataUrl);
-        lastResult = { dataUrl, saved_url: data.saved_url };
+        lastResult = { dataUrl, saved_url: data.saved_url, ids: rememberOutputs([data.saved_url]) };
         if (dlBtn) dlBtn.disabled = false;
         if (savedLink) {
           savedLink.textContent = data.saved_url ? '파일 열기' : '';
@@ -267,16 +270,44 @@
 
   // composite feature removed
 
-  // Download
+  // Output id from a saved_url (/outputs/<id>.png)
+  function rememberOutputs(urls) {
+    const ids = [];
+    (urls || []).forEach(u => {
+      const m = /\/outputs\/([0-9a-f]{32})\.png$/.exec(u || '');
+      if (!m) return;
+      ids.push(m[1]);
+      if (!sessionIds.includes(m[1])) sessionIds.push(m[1]);
+    });
+    if (dlAllBtn) dlAllBtn.disabled = !(API_BASE && sessionIds.length > 0);
+    return ids;
+  }
+
+  // The server streams the ZIP; the browser saves it without holding it in memory
+  function downloadZip(ids, name) {
+    if (!API_BASE || !ids.length) return;
+    const a = document.createElement('a');
+    a.href = `${API_BASE}/api/outputs/archive?ids=${ids.join(',')}&name=${encodeURIComponent(name)}`;
+    a.click();
+  }
+
+  // Download (a ZIP when the last generation produced several variants)
   if (dlBtn) {
     dlBtn.addEventListener('click', () => {
       if (!lastResult) return;
+      if (lastResult.ids && lastResult.ids.length > 1 && API_BASE) {
+        downloadZip(lastResult.ids, `portrait_${Date.now()}`);
+        return;
+      }
       const a = document.createElement('a');
       a.href = lastResult.dataUrl;
       a.download = `portrait_${Date.now()}.png`;
       a.click();
     });
   }
+  if (dlAllBtn) {
+    dlAllBtn.addEventListener('click', () => downloadZip(sessionIds.slice(-100), `portraits_${Date.now()}`));
+  }
 
   // App initialization complete - hide spinner
   console.log('App initialized successfully');